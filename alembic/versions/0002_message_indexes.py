@@ -0,0 +1,46 @@
+"""indexes for inbox, unread, sent and markAsRead lookups
+
+Revision ID: 0002_message_indexes
+Revises: 0001_initial_schema
+Create Date: 2026-10-18 09:30:00.000000
+
+On PostgreSQL the indexes are built CONCURRENTLY so the tables stay
+writable while a large message_recipients table is indexed.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_message_indexes'
+down_revision: Union[str, None] = '0001_initial_schema'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ('ix_messages_sender_timestamp', 'messages', ['sender_id', 'timestamp', 'id'], {}),
+    ('ix_message_recipients_recipient_read', 'message_recipients', ['recipient_id', 'read'], {}),
+    ('ix_message_recipients_unread', 'message_recipients', ['recipient_id'], {
+        'postgresql_where': sa.text('read = false'),
+        'sqlite_where': sa.text('read = 0'),
+    }),
+    ('ix_message_recipients_message_recipient', 'message_recipients', ['message_id', 'recipient_id'], {}),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, **options)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
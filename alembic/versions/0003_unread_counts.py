@@ -0,0 +1,42 @@
+"""per-user unread counters
+
+Revision ID: 0003_unread_counts
+Revises: 0002_message_indexes
+Create Date: 2026-10-18 10:30:00.000000
+
+Backfills the counters from message_recipients. Run
+`just rebuild-unread-counts` after deploying if writes happened between
+the backfill and the new code going live.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_unread_counts'
+down_revision: Union[str, None] = '0002_message_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'unread_counts',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('unread', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.execute(
+        "INSERT INTO unread_counts (user_id, unread) "
+        "SELECT recipient_id, count(*) FROM message_recipients WHERE read = false GROUP BY recipient_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('unread_counts')
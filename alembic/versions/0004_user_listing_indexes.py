@@ -0,0 +1,39 @@
+"""indexes for the paginated, prefix-filtered user listing
+
+Revision ID: 0004_user_listing_indexes
+Revises: 0003_unread_counts
+Create Date: 2026-10-18 11:30:00.000000
+
+On PostgreSQL the indexes are built CONCURRENTLY so users stays writable.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_user_listing_indexes'
+down_revision: Union[str, None] = '0003_unread_counts'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ('ix_users_created_at_id', 'users', ['created_at', 'id'], {}),
+    ('ix_users_email_pattern', 'users', ['email'], {'postgresql_ops': {'email': 'varchar_pattern_ops'}}),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, **options)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,60 @@
+"""full-text search over message subject and content
+
+Revision ID: 0005_message_search
+Revises: 0004_user_listing_indexes
+Create Date: 2026-10-18 12:30:00.000000
+
+PostgreSQL gets a GIN expression index (built CONCURRENTLY), SQLite an
+FTS5 table over messages kept in sync by triggers and filled here.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_message_search'
+down_revision: Union[str, None] = '0004_user_listing_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Copies of app.models.MESSAGE_SEARCH_DOCUMENT / app.models.MESSAGE_SEARCH_SQLITE at this revision
+SEARCH_DOCUMENT = "to_tsvector('simple', coalesce(subject, '') || ' ' || content)"
+SQLITE_SEARCH = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(subject, content, content='messages', content_rowid='rowid')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, subject, content) VALUES (new.rowid, new.subject, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, subject, content) VALUES ('delete', old.rowid, old.subject, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, subject, content) VALUES ('delete', old.rowid, old.subject, old.content); "
+    "INSERT INTO messages_fts(rowid, subject, content) VALUES (new.rowid, new.subject, new.content); END",
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH:
+            op.execute(statement)
+        op.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        return
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_search', 'messages', [sa.text(f"({SEARCH_DOCUMENT})")],
+            postgresql_using='gin', postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('messages_fts_update', 'messages_fts_delete', 'messages_fts_insert'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_search', table_name='messages', postgresql_concurrently=True)
@@ -0,0 +1,58 @@
+"""conversation threading: messages.in_reply_to and messages.thread_id
+
+Revision ID: 0006_message_threads
+Revises: 0005_message_search
+Create Date: 2026-10-18 13:30:00.000000
+
+Existing messages become single-message threads (thread_id = id).
+SQLite cannot add NOT NULL to an existing column without rebuilding the
+table, which would also drop the search triggers, so thread_id stays
+nullable there.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_message_threads'
+down_revision: Union[str, None] = '0005_message_search'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'sqlite':
+        # ALTER TABLE ... ADD CONSTRAINT does not exist there, the reference goes inline
+        op.execute("ALTER TABLE messages ADD COLUMN in_reply_to CHAR(32) REFERENCES messages (id) ON DELETE SET NULL")
+    else:
+        op.add_column('messages', sa.Column(
+            'in_reply_to', postgresql.UUID(as_uuid=True),
+            sa.ForeignKey('messages.id', name='messages_in_reply_to_fkey', ondelete='SET NULL'), nullable=True
+        ))
+    op.add_column('messages', sa.Column('thread_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.execute("UPDATE messages SET thread_id = id")
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('messages', 'thread_id', nullable=False)
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_thread', 'messages', ['thread_id', 'timestamp', 'id'], postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_thread', table_name='messages', postgresql_concurrently=True)
+    if op.get_bind().dialect.name == 'sqlite':
+        op.drop_column('messages', 'thread_id')
+        op.drop_column('messages', 'in_reply_to')
+        return
+    op.drop_constraint('messages_in_reply_to_fkey', 'messages', type_='foreignkey')
+    op.drop_column('messages', 'thread_id')
+    op.drop_column('messages', 'in_reply_to')
@@ -0,0 +1,46 @@
+"""background fan-out jobs for large sends
+
+Revision ID: 0008_fanout_jobs
+Revises: 0007_idempotency_keys
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008_fanout_jobs'
+down_revision: Union[str, None] = '0007_idempotency_keys'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'fanout_jobs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('message_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('recipient_ids', sa.Text(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('delivered', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_fanout_jobs_status', 'fanout_jobs', ['status'], unique=False)
+    op.create_index('ix_fanout_jobs_message_id', 'fanout_jobs', ['message_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_fanout_jobs_message_id', table_name='fanout_jobs')
+    op.drop_index('ix_fanout_jobs_status', table_name='fanout_jobs')
+    op.drop_table('fanout_jobs')
@@ -0,0 +1,192 @@
+# Pooled keep-alive HTTP sessions for aps_toolkit clients
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# requests module functions that aps_toolkit calls to reach APS
+HTTP_METHODS = {"request", "get", "options", "head", "post", "put", "patch", "delete"}
+
+
+class HTTPMetrics:
+    """Counters shared by the sessions of one ClientRegistry."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connects = 0
+        self.errors = 0
+        self.clients = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def record_client(self):
+        with self._lock:
+            self.clients += 1
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(self.requests - self.connects, 0)
+            return {
+                "requests": self.requests,
+                "connects": self.connects,
+                "reused": reused,
+                "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+                "errors": self.errors,
+                "clients_built": self.clients,
+            }
+
+
+class _MeteredConnectionPoolMixin:
+    """Counts the connections a urllib3 pool opens instead of taking from its idle ones."""
+
+    metrics = None
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        if self.metrics is not None:
+            self.metrics.record_connect()
+        return conn
+
+
+class MeteredHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout and records requests and new connections."""
+
+    def __init__(self, metrics, timeout=None, **kwargs):
+        self.metrics = metrics
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # Pools are built by the pool manager from these classes, one subclass per adapter carries its metrics
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(pool_class.__name__, (_MeteredConnectionPoolMixin, pool_class), {"metrics": self.metrics})
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.metrics.record_request()
+        try:
+            return super().send(
+                request, stream=stream, timeout=self.timeout if timeout is None else timeout,
+                verify=verify, cert=cert, proxies=proxies,
+            )
+        except requests.RequestException:
+            self.metrics.record_error()
+            raise
+
+
+class SessionRouter:
+    """Stands in for the requests module inside aps_toolkit.
+
+    aps_toolkit calls requests.get/post/... directly, which opens a new
+    connection (and TLS handshake) every time. Calls made while a session is
+    bound to the thread go through that session instead; everything else falls
+    through to requests.
+    """
+
+    def __init__(self, module=requests):
+        self._module = module
+        self._local = threading.local()
+
+    @contextmanager
+    def bind(self, session):
+        previous = getattr(self._local, "session", None)
+        self._local.session = session
+        try:
+            yield
+        finally:
+            self._local.session = previous
+
+    def __getattr__(self, name):
+        session = getattr(self._local, "session", None)
+        if session is not None and name in HTTP_METHODS:
+            return getattr(session, name)
+        return getattr(self._module, name)
+
+
+router = SessionRouter()
+
+
+def route_requests(module):
+    """Send the requests.* calls of a module through router."""
+    module.requests = router
+
+
+class ClientRegistry:
+    """One long-lived client per access token, each with its own keep-alive connection pool.
+
+    A token the registry has not seen replaces the clients of the previous
+    ones, so a rotated token rebuilds the client and its pool once.
+    """
+
+    def __init__(self, factory, pool_size=10, connect_timeout=None, read_timeout=None):
+        self.factory = factory
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.metrics = HTTPMetrics()
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def build_session(self):
+        session = requests.Session()
+        adapter = MeteredHTTPAdapter(
+            self.metrics,
+            timeout=(self.connect_timeout, self.read_timeout),
+            pool_maxsize=self.pool_size,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self, token):
+        """The client of a token, built with a fresh session the first time the token is seen."""
+        key = str(getattr(token, "access_token", token))
+        stale = {}
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.factory(token)
+                client.session = self.build_session()
+                stale, self._clients = self._clients, {key: client}
+                self.metrics.record_client()
+        # Calls still running on an old session finish; their connections are closed on return
+        for old in stale.values():
+            old.session.close()
+        return client
+
+    def call(self, client, method, *args):
+        """Call a client method with its requests on the client's pooled session."""
+        with router.bind(getattr(client, "session", None)):
+            return getattr(client, method)(*args)
+
+    def close(self):
+        """Close every pooled connection and forget the clients."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.session.close()
+
+    def stats(self):
+        stats = self.metrics.snapshot()
+        with self._lock:
+            stats["clients"] = len(self._clients)
+        stats.update({
+            "pool_size": self.pool_size,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+        })
+        return stats
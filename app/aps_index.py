@@ -0,0 +1,268 @@
+# Local SQLite index of APS project folder trees
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    project_id TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    parent_id TEXT,
+    position INTEGER NOT NULL DEFAULT 0,
+    name TEXT,
+    -- lastModifiedTime of the folder when it was listed, listed_at NULL = never listed
+    last_modified TEXT,
+    listed_at REAL,
+    PRIMARY KEY (project_id, folder_id)
+);
+CREATE INDEX IF NOT EXISTS ix_folders_parent ON folders (project_id, parent_id);
+CREATE TABLE IF NOT EXISTS files (
+    project_id TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    -- The attributes format_item shows
+    name TEXT,
+    file_type TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (project_id, folder_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS ix_files_type ON files (project_id, file_type);
+CREATE TABLE IF NOT EXISTS syncs (
+    project_id TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (project_id, folder_id)
+);
+-- Syncs that listed every folder again, whatever its lastModifiedTime
+CREATE TABLE IF NOT EXISTS full_syncs (
+    project_id TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (project_id, folder_id)
+);
+"""
+
+# Distinct file types of a project, one ix_files_type seek per type instead of a scan
+FILE_TYPES = """
+WITH RECURSIVE types(file_type) AS (
+    SELECT min(file_type) FROM files WHERE project_id = :project_id
+    UNION ALL
+    SELECT (SELECT min(file_type) FROM files WHERE project_id = :project_id AND file_type > types.file_type)
+    FROM types WHERE types.file_type IS NOT NULL
+)
+SELECT file_type FROM types WHERE file_type IS NOT NULL
+"""
+
+DELETE_SUBTREE = """
+WITH RECURSIVE tree(folder_id) AS (
+    VALUES (:folder_id)
+    UNION ALL
+    SELECT f.folder_id FROM folders f JOIN tree t ON f.project_id = :project_id AND f.parent_id = t.folder_id
+)
+DELETE FROM {table} WHERE project_id = :project_id AND folder_id IN (SELECT folder_id FROM tree)
+"""
+
+# A folder and every folder above it
+ANCESTORS = """
+WITH RECURSIVE up(folder_id) AS (
+    VALUES (:folder_id)
+    UNION
+    SELECT f.parent_id FROM folders f JOIN up u ON f.project_id = :project_id AND f.folder_id = u.folder_id
+    WHERE f.parent_id IS NOT NULL
+)
+SELECT folder_id FROM up
+"""
+
+
+def file_item(item_id, name, file_type, last_modified):
+    """APS item dict of an indexed file, with the attributes format_item shows."""
+    attributes = {"displayName": name, "fileType": file_type, "lastModifiedTime": last_modified}
+    return {"type": "items", "id": item_id, "attributes": {key: value for key, value in attributes.items() if value is not None}}
+
+
+class FolderIndex:
+    """Files and folders of APS projects as they were last listed, kept in SQLite.
+
+    A folder is listed again only when the lastModifiedTime its parent reports
+    differs from the one it had when it was listed; otherwise its indexed
+    subtree is reused as it is.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def synced_at(self, project_id, folder_ids, full=False):
+        """When all of these start folders last finished a sync (a full one if full), None if one of them never did."""
+        table = "full_syncs" if full else "syncs"
+        folder_ids = set(folder_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT synced_at FROM {table} WHERE project_id = ? AND folder_id IN ({','.join('?' * len(folder_ids))})",
+                (project_id, *folder_ids),
+            ).fetchall()
+        if not folder_ids or len(rows) < len(folder_ids):
+            return None
+        return min(row[0] for row in rows)
+
+    def mark_synced(self, project_id, folder_ids, synced_at, full=False):
+        rows = [(project_id, folder_id, synced_at) for folder_id in folder_ids]
+        with self._lock, self._conn:
+            for table in ("syncs", "full_syncs") if full else ("syncs",):
+                self._conn.executemany(f"INSERT OR REPLACE INTO {table} (project_id, folder_id, synced_at) VALUES (?, ?, ?)", rows)
+
+    def mark_unsynced(self, project_id, folder_ids):
+        """Forget the last sync of these start folders, so the next call syncs again."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM syncs WHERE project_id = ? AND folder_id = ?", [(project_id, folder_id) for folder_id in folder_ids]
+            )
+
+    def mark_failed(self, project_id, folder_id):
+        """Treat a folder whose listing failed, and every folder above it, as never listed.
+
+        Its parent already stored the new lastModifiedTime, so without this the
+        next sync would take the failed folder as unchanged and never reach it.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE folders SET listed_at = NULL WHERE project_id = :project_id AND folder_id IN ({ANCESTORS})",
+                {"project_id": project_id, "folder_id": folder_id},
+            )
+
+    def store_listing(self, project_id, folder_id, contents, last_modified, listed_at, force=False):
+        """Replace the indexed contents of a folder with a fresh listing.
+
+        Args:
+            project_id: The real ID of the project
+            folder_id: The real ID of the listed folder
+            contents: get_folder_contents response
+            last_modified: lastModifiedTime of the folder as its parent reported it, None if unknown
+            listed_at: Time of the listing
+            force: Report every subfolder as needing a listing
+
+        Returns:
+            [(subfolder id, lastModifiedTime)] of the subfolders that changed since they were listed
+        """
+        folders = []
+        files = []
+        for position, item in enumerate(contents.get("data", [])):
+            attributes = item.get("attributes", {})
+            if item.get("type") == "folders":
+                folders.append((item.get("id"), position, attributes.get("displayName"), attributes.get("lastModifiedTime")))
+            elif item.get("type") == "items":
+                files.append((
+                    project_id, folder_id, item.get("id"), position,
+                    attributes.get("displayName"), attributes.get("fileType"), attributes.get("lastModifiedTime"),
+                ))
+
+        with self._lock, self._conn:
+            known = {
+                row[0]: (row[1], row[2])
+                for row in self._conn.execute(
+                    "SELECT folder_id, last_modified, listed_at FROM folders WHERE project_id = ? AND parent_id = ?",
+                    (project_id, folder_id),
+                )
+            }
+            changed = [
+                (sub_folder_id, stamp)
+                for sub_folder_id, _, _, stamp in folders
+                if force or stamp is None or sub_folder_id not in known
+                or known[sub_folder_id][1] is None or known[sub_folder_id][0] != stamp
+            ]
+            # Subfolders deleted (or moved away) since the last listing, with everything below them
+            for gone in set(known) - {sub_folder_id for sub_folder_id, *_ in folders}:
+                for table in ("files", "folders"):
+                    self._conn.execute(DELETE_SUBTREE.format(table=table), {"project_id": project_id, "folder_id": gone})
+
+            self._conn.execute("DELETE FROM files WHERE project_id = ? AND folder_id = ?", (project_id, folder_id))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (project_id, folder_id, item_id, position, name, file_type, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                files,
+            )
+            self._conn.executemany(
+                "INSERT INTO folders (project_id, folder_id, parent_id, position, name) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (project_id, folder_id) DO UPDATE SET "
+                "parent_id = excluded.parent_id, position = excluded.position, name = excluded.name",
+                [(project_id, sub_folder_id, folder_id, position, name) for sub_folder_id, position, name, _ in folders],
+            )
+            self._conn.execute(
+                "INSERT INTO folders (project_id, folder_id, last_modified, listed_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (project_id, folder_id) DO UPDATE SET "
+                "last_modified = excluded.last_modified, listed_at = excluded.listed_at",
+                (project_id, folder_id, last_modified, listed_at),
+            )
+        return changed
+
+    def find_files(self, project_id, folder_ids, file_type=None, max_depth=0, max_items=0):
+        """Indexed files below the start folders, in depth-first order.
+
+        Args:
+            project_id: The real ID of the project
+            folder_ids: Real IDs of the folders to start from
+            file_type: Optional filter for file type (e.g., "rvt" for Revit files)
+            max_depth: Subfolder levels to descend into (0 = no limit)
+            max_items: Maximum number of files to return (0 = no limit)
+
+        Returns:
+            (list of file items, True if max_depth or max_items cut the answer short)
+        """
+        query = "SELECT position, item_id, name, file_type, last_modified FROM files WHERE project_id = ? AND folder_id = ?"
+        items = []
+        truncated = False
+
+        with self._lock:
+            filter_params = ()
+            if file_type:
+                # A project has few distinct file types; match them once instead of on every row
+                filter_params = tuple(
+                    row[0] for row in self._conn.execute(FILE_TYPES, {"project_id": project_id})
+                    if file_type.lower() in row[0].lower()
+                )
+                if not filter_params:
+                    return [], False
+                # Unary + keeps SQLite on the (project_id, folder_id) key instead of ix_files_type
+                query += f" AND +file_type IN ({','.join('?' * len(filter_params))})"
+
+            # The folder tree is small next to the files; walk it here and read
+            # files folder by folder, so a capped query stops early
+            children = {}
+            for sub_folder_id, parent_id, position in self._conn.execute(
+                "SELECT folder_id, parent_id, position FROM folders WHERE project_id = ? AND parent_id IS NOT NULL",
+                (project_id,),
+            ):
+                children.setdefault(parent_id, []).append((position, "folder", sub_folder_id))
+
+            def visit(folder_id, depth):
+                nonlocal truncated
+                entries = [(row[0], "file", row) for row in self._conn.execute(query, (project_id, folder_id, *filter_params))]
+                sub_folders = children.get(folder_id, [])
+                if max_depth and depth >= max_depth:
+                    truncated = truncated or bool(sub_folders)
+                else:
+                    entries += sub_folders
+                # Files and subfolders in listing order
+                for _, kind, entry in sorted(entries, key=lambda entry: entry[0]):
+                    if kind == "folder":
+                        if not visit(entry, depth + 1):
+                            return False
+                    elif max_items and len(items) >= max_items:
+                        truncated = True
+                        return False
+                    else:
+                        items.append(file_item(*entry[1:]))
+                return True
+
+            for folder_id in folder_ids:
+                if not visit(folder_id, 0):
+                    break
+        return items, truncated
+
+    def clear(self):
+        with self._lock, self._conn:
+            for table in ("files", "folders", "syncs", "full_syncs"):
+                self._conn.execute(f"DELETE FROM {table}")
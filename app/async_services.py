@@ -0,0 +1,720 @@
+# Async counterparts of services.py, built on AsyncSession (asyncpg).
+# Function names, arguments and return values match services.py so routes
+# can switch between the two with DB_BACKEND.
+from datetime import datetime
+import uuid
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from . import models
+from . import db
+from . import services
+from .cache import idempotency_cache, user_cache
+from .services import (
+    bulk_read_args,
+    cached_users,
+    created_message,
+    decode_cursor,
+    decode_search_cursor,
+    encode_search_cursor,
+    expired_idempotency_key,
+    fanout_batch,
+    fanout_failed,
+    fanout_job_entry,
+    fanout_job_record,
+    idempotency_entry,
+    idempotency_query,
+    idempotency_record,
+    idempotency_ttl_left,
+    inbox_entry,
+    in_mailbox_clause,
+    locked_fanout_job,
+    inbox_query,
+    inbox_summary_entry,
+    mark_read_bulk_statement,
+    mark_read_statement,
+    message_rows,
+    page_of,
+    pending_fanout_query,
+    received_export_entry,
+    resolved_users,
+    search_entry,
+    search_query,
+    sent_export_entries,
+    sent_export_query,
+    sent_query,
+    thread_entry,
+    thread_query,
+    thread_summary_entry,
+    thread_summary_query,
+    unread_count_query,
+    unread_decrement,
+    unread_increment,
+    users_estimate_query,
+    users_query,
+    user_import_batches,
+    user_import_records,
+    user_import_report,
+    USER_IMPORT_FROM_STAGING,
+    USER_IMPORT_STAGING,
+)
+
+AsyncSessionLocal = db.AsyncSessionLocal
+
+
+def _as_uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+def _recipient_detail(recipient):
+    return {
+        "recipient_email": recipient.recipient.email,
+        "recipient_name": recipient.recipient.name,
+        "read": recipient.read if recipient.read else False,
+        "read_at": recipient.read_at
+    }
+
+def _message_with_recipients(message_id):
+    # Lazy loading is not available on AsyncSession, load the graph up front
+    return select(models.Message).where(models.Message.id == message_id).options(
+        selectinload(models.Message.sender),
+        selectinload(models.Message.recipients).selectinload(models.MessageRecipient.recipient)
+    )
+
+async def get_list_users():
+    """
+    Retrieve a list of all users from the users table.
+
+    :return: List of User objects or an empty list if no users found
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(select(models.User))
+            return result.scalars().all()
+        except Exception as e:
+            print(f"Error retrieving users: {e}")
+            return []
+
+async def find_users_page(limit, cursor=None, email_prefix=None, include_total=False):
+    """Retrieve one page of users, oldest first.
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :param email_prefix: Only users whose email starts with this
+    :param include_total: Also return an estimate of the number of matching users
+    :return: dict with "users", "next_cursor" (None on the last page) and "total_estimate"
+        (None unless requested and available)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    async with AsyncSessionLocal() as session:
+        try:
+            users = (await session.execute(users_query(limit + 1, after, email_prefix))).scalars().all()
+            page = page_of(users, limit, lambda user: (user.created_at, user.id), key="users")
+            page["total_estimate"] = None
+            if include_total:
+                statement, convert = users_estimate_query(session, email_prefix)
+                page["total_estimate"] = convert((await session.execute(statement)).scalar())
+            return page
+        except Exception as e:
+            print(f"Error retrieving users: {e}")
+            return {"users": [], "next_cursor": None, "total_estimate": None}
+
+async def create_user(email, name, created_at=None):
+    """
+    Create a new user in the users table.
+
+    :param email: Email of the user (must be unique)
+    :param name: Name of the user
+    :return: UUID of the newly created user or None if an error occurred
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            new_user = models.User(
+                id=uuid.uuid4(),
+                email=email,
+                name=name,
+                created_at=created_at or datetime.utcnow()
+            )
+            session.add(new_user)
+            await session.commit()
+            user_cache.invalidate(user_id=new_user.id, email=new_user.email)
+            print(f"User  created with id: {new_user.id}")
+            return new_user
+        except IntegrityError:
+            await session.rollback()
+            print("Error: A user with this email already exists.")
+            return None
+        except Exception as e:
+            await session.rollback()
+            print(f"Error creating user: {e}")
+            return None
+
+async def find_user_by_mail(email):
+    """
+    Find a user by their email address.
+
+    :param email: Email of the user to find
+    :return: User object if found, None otherwise
+    """
+    cached = user_cache.get_by_email(email)
+    if cached is not None:
+        return cached
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(select(models.User).where(models.User.email == email))
+            user = result.scalars().first()
+            user_cache.put(user)
+            return user
+        except Exception as e:
+            print(f"Error finding user by email: {e}")
+            return None
+
+async def find_users_by_mails(emails):
+    """
+    Resolve many email addresses to users with a single query.
+
+    :param emails: Iterable of email addresses (duplicates allowed)
+    :return: dict with "users" (email -> User) and "missing" (emails without a user, in input order)
+    """
+    emails = list(dict.fromkeys(emails))
+    users, uncached = cached_users(emails)
+    if uncached:
+        async with AsyncSessionLocal() as session:
+            try:
+                result = await session.execute(select(models.User).where(models.User.email.in_(uncached)))
+                found = result.scalars().all()
+                for user in found:
+                    user_cache.put(user)
+                users.extend(found)
+            except Exception as e:
+                print(f"Error finding users by email: {e}")
+    return resolved_users(emails, users)
+
+async def update_user(user_id, email=None, name=None):
+    """
+    Update an existing user in the users table.
+
+    :param user_id: UUID of the user to update
+    :param email: New email for the user (optional)
+    :param name: New name for the user (optional)
+    :return: Updated User object or None if an error occurred
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            user = await session.get(models.User, _as_uuid(user_id))
+            if not user:
+                print("User not found")
+                return None
+
+            # The id record may already be evicted, so the old email key is dropped by name
+            old_email = user.email
+            if email:
+                user.email = email
+            if name:
+                user.name = name
+
+            await session.commit()
+            user_cache.invalidate(user_id=user.id, email=old_email)
+            if email:
+                user_cache.invalidate(email=email)
+            return user
+        except Exception as e:
+            await session.rollback()
+            print(f"Error updating user: {e}")
+            return None
+
+async def import_users(rows):
+    """Insert many users in one transaction, skipping emails that already exist.
+    On PostgreSQL (asyncpg) the rows are COPYed into a temporary table and moved over with a single
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING; elsewhere multi-row INSERT ... ON CONFLICT DO NOTHING
+    statements are used.
+    :param rows: Rows from parse_user_import
+    :return: dict with "created" (count) and "conflicts" (rows that already existed), None on error
+    """
+    if not rows:
+        return {"created": 0, "conflicts": []}
+    records = user_import_records(rows)
+    async with AsyncSessionLocal() as session:
+        try:
+            if session.get_bind().dialect.driver == "asyncpg":
+                await session.execute(USER_IMPORT_STAGING)
+                raw = await (await session.connection()).get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    "user_import",
+                    records=[(record["id"], record["email"], record["name"], record["created_at"]) for record in records],
+                    columns=["id", "email", "name", "created_at"]
+                )
+                created = (await session.execute(USER_IMPORT_FROM_STAGING)).scalars().all()
+            else:
+                created = []
+                for statement in user_import_batches(session, records):
+                    created.extend((await session.execute(statement)).scalars().all())
+            await session.commit()
+            print(f"Imported {len(created)} users")
+            return user_import_report(rows, created)
+        except Exception as e:
+            await session.rollback()
+            print(f"Error importing users: {e}")
+            return None
+
+async def find_reply_thread(message_id, user_id):
+    """Look up the thread a reply joins; users can only reply to messages in their own mailbox.
+    :param message_id: UUID of the message replied to
+    :param user_id: UUID of the user replying
+    :return: (message id, thread id) to pass to create_message as reply_to, None if not found
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            thread_id = (await session.execute(
+                select(models.Message.thread_id).where(models.Message.id == message_id, in_mailbox_clause(user_id))
+            )).scalar()
+            return (message_id, thread_id) if thread_id else None
+        except Exception as e:
+            print(f"Error finding reply thread: {e}")
+            return None
+
+async def find_idempotent_response(key):
+    """Look up the stored sendMessage response for an Idempotency-Key, in-process cache first.
+    :param key: Idempotency-Key header value
+    :return: dict with "fingerprint" and "response" (message dict as JSON types), None if unknown or expired
+    """
+    entry = idempotency_cache.get(key)
+    if entry is not None:
+        return entry
+    async with AsyncSessionLocal() as session:
+        try:
+            row = (await session.execute(idempotency_query(key))).first()
+            if row is None:
+                return None
+            entry = idempotency_entry(row._mapping)
+            idempotency_cache.set(key, entry, ttl=idempotency_ttl_left(row.created_at))
+            return entry
+        except Exception as e:
+            print(f"Error finding idempotency key: {e}")
+            return None
+
+async def create_message(sender, recipients, subject, content, reply_to=None, idempotency=None):
+    """Create a new message and associate it with the sender and recipients.
+    The message, every message_recipients row and the recipients' unread counters are
+    written in one transaction.
+    :param sender: User object representing the sender
+    :param recipients: List of User objects representing the recipients
+    :param subject: Subject of the message
+    :param content: Content of the message
+    :param reply_to: (message id, thread id) from find_reply_thread, None to start a thread
+    :param idempotency: (Idempotency-Key, request fingerprint) to store the response under, in the same transaction
+    :return: Message dict if created successfully, None otherwise
+    """
+    message, recipient_rows = message_rows(sender, recipients, subject, content, reply_to)
+    response = created_message(message, sender, recipients)
+    record = idempotency_record(*idempotency, response) if idempotency else None
+    async with AsyncSessionLocal() as session:
+        try:
+            if record:
+                await session.execute(expired_idempotency_key(record["key"]))
+                await session.execute(insert(models.IdempotencyKey).values(**record))
+            await session.execute(insert(models.Message).values(**message))
+            if recipient_rows:
+                await session.execute(insert(models.MessageRecipient), recipient_rows)
+                await session.execute(*unread_increment(session, recipient_rows))
+            await session.commit()
+            if record:
+                idempotency_cache.set(record["key"], idempotency_entry(record), ttl=idempotency_ttl_left(record["created_at"]))
+            return response
+        except IntegrityError:
+            await session.rollback()
+            print("Error: A message with this ID or idempotency key already exists.")
+            return None
+        except Exception as e:
+            await session.rollback()
+            print(f"Error creating message: {e}")
+            return None
+
+async def create_message_fanout(sender, recipients, subject, content, reply_to=None, idempotency=None):
+    """Create a message and a fan-out job for its recipient rows instead of writing them now.
+    :param sender: User object representing the sender
+    :param recipients: List of User objects representing the recipients
+    :param subject: Subject of the message
+    :param content: Content of the message
+    :param reply_to: (message id, thread id) from find_reply_thread, None to start a thread
+    :param idempotency: (Idempotency-Key, request fingerprint) to store the accepted response under
+    :return: dict with "message" (as create_message returns it), "job_id" and "status", None otherwise
+    """
+    message, _ = message_rows(sender, [], subject, content, reply_to)
+    job = fanout_job_record(message["id"], recipients)
+    accepted = {"job_id": job["id"], "status": job["status"], "message": created_message(message, sender, recipients)}
+    record = idempotency_record(*idempotency, accepted) if idempotency else None
+    async with AsyncSessionLocal() as session:
+        try:
+            if record:
+                await session.execute(expired_idempotency_key(record["key"]))
+                await session.execute(insert(models.IdempotencyKey).values(**record))
+            await session.execute(insert(models.Message).values(**message))
+            await session.execute(insert(models.FanoutJob).values(**job))
+            await session.commit()
+            if record:
+                idempotency_cache.set(record["key"], idempotency_entry(record), ttl=idempotency_ttl_left(record["created_at"]))
+            return accepted
+        except IntegrityError:
+            await session.rollback()
+            print("Error: A message with this ID or idempotency key already exists.")
+            return None
+        except Exception as e:
+            await session.rollback()
+            print(f"Error creating message: {e}")
+            return None
+
+async def deliver_fanout_batch(job_id, batch_size=None):
+    """Write the next batch of a fan-out job's recipient rows and unread counters, with its progress.
+    :param job_id: ID of the fan-out job
+    :param batch_size: Recipients per transaction, defaults to FANOUT_BATCH_SIZE
+    :return: Number of recipients delivered, 0 once the job is finished
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            job = (await session.execute(locked_fanout_job(job_id))).scalars().first()
+            if job is None or job.status in ("done", "failed"):
+                await session.rollback()
+                return 0
+            rows, progress = fanout_batch(job, batch_size or services.FANOUT_BATCH_SIZE)
+            if rows:
+                await session.execute(insert(models.MessageRecipient), rows)
+                await session.execute(*unread_increment(session, rows))
+            await session.execute(update(models.FanoutJob).where(models.FanoutJob.id == job_id).values(**progress))
+            await session.commit()
+            return len(rows)
+        except Exception:
+            await session.rollback()
+            raise
+
+async def run_fanout_job(job_id, batch_size=None):
+    """Deliver a fan-out job batch by batch until every recipient has the message.
+    :param job_id: ID of the fan-out job
+    :param batch_size: Recipients per transaction, defaults to FANOUT_BATCH_SIZE
+    :return: Status dict of the job, None if it does not exist
+    """
+    try:
+        while await deliver_fanout_batch(job_id, batch_size):
+            pass
+    except Exception as e:
+        print(f"Error delivering fan-out job {job_id}: {e}")
+        async with AsyncSessionLocal() as session:
+            await session.execute(fanout_failed(job_id, e))
+            await session.commit()
+    return await find_fanout_job(job_id)
+
+async def find_fanout_job(job_id):
+    """Retrieve the status of a fan-out job.
+    :param job_id: ID of the fan-out job
+    :return: Status dict if found, None otherwise
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            job = await session.get(models.FanoutJob, job_id)
+            return fanout_job_entry(job) if job else None
+        except Exception as e:
+            print(f"Error finding fan-out job: {e}")
+            return None
+
+async def pending_fanout_jobs():
+    """IDs of the fan-out jobs not finished yet, oldest first."""
+    async with AsyncSessionLocal() as session:
+        try:
+            return list((await session.execute(pending_fanout_query())).scalars())
+        except Exception as e:
+            print(f"Error listing fan-out jobs: {e}")
+            return []
+
+async def find_message_by_mail(email):
+    """Retrieve messages sent by a user with a given email address.
+    :param email: Email of the sender
+    :return: List of Message objects if found, empty list otherwise
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            user = (await session.execute(select(models.User).where(models.User.email == email))).scalars().first()
+            if not user:
+                print("Sender user not found")
+                return []
+
+            result = await session.execute(select(models.Message).where(models.Message.sender_id == user.id))
+            messages = result.scalars().all()
+            if not messages:
+                print("No messages found for this user")
+                return []
+            return messages
+        except Exception as e:
+            print(f"Error retrieving message by email: {e}")
+            return []
+
+async def find_message_by_mail_page(email, limit, cursor=None):
+    """Retrieve one page of messages sent by a user, newest first.
+    :param email: Email of the sender
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: dict with "messages" (Message objects) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    async with AsyncSessionLocal() as session:
+        try:
+            messages = (await session.execute(sent_query(email, limit=limit + 1, after=after))).scalars().all()
+            return page_of(messages, limit, lambda message: (message.timestamp, message.id))
+        except Exception as e:
+            print(f"Error retrieving message by email: {e}")
+            return {"messages": [], "next_cursor": None}
+
+async def find_message_inbox(email):
+    """Retrieve inbox messages for a given email address.
+    :param email: Email of the recipient
+    :return: List of inbox message dicts if found, empty list otherwise
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            rows = (await session.execute(inbox_query(email))).all()
+            return [inbox_entry(row) for row in rows]
+        except Exception as e:
+            print(f"Error retrieving inbox messages: {e}")
+            return []
+
+async def find_message_inbox_unread(email):
+    """Retrieve unread messages in the inbox for a given email address.
+    :param email: Email of the recipient
+    :return: List of unread inbox message dicts if found, empty list otherwise
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            rows = (await session.execute(inbox_query(email, unread_only=True))).all()
+            return [inbox_entry(row) for row in rows]
+        except Exception as e:
+            print(f"Error retrieving unread inbox messages: {e}")
+            return []
+
+async def find_message_inbox_page(email, limit, cursor=None, unread_only=False):
+    """Retrieve one page of inbox messages for a recipient, newest first.
+    :param email: Email of the recipient
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :param unread_only: Only list unread messages
+    :return: dict with "messages" (inbox message dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    async with AsyncSessionLocal() as session:
+        try:
+            query = inbox_query(email, unread_only=unread_only, limit=limit + 1, after=after)
+            rows = (await session.execute(query)).all()
+            page = page_of(rows, limit, lambda row: (row.timestamp, row.entry_id))
+            page["messages"] = [inbox_entry(row) for row in page["messages"]]
+            return page
+        except Exception as e:
+            print(f"Error retrieving inbox messages: {e}")
+            return {"messages": [], "next_cursor": None}
+
+async def find_message_inbox_summary_page(email, limit, cursor=None, unread_only=False, preview_length=0):
+    """Retrieve one page of the inbox as summaries, without the message content.
+    :param email: Email of the recipient
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :param unread_only: Only list unread messages
+    :param preview_length: Number of leading content characters to return as preview, 0 for none
+    :return: dict with "messages" (inbox summary dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    async with AsyncSessionLocal() as session:
+        try:
+            query = inbox_query(email, unread_only=unread_only, limit=limit + 1, after=after, preview_length=preview_length)
+            page = page_of((await session.execute(query)).all(), limit, lambda row: (row.timestamp, row.entry_id))
+            page["messages"] = [inbox_summary_entry(row) for row in page["messages"]]
+            return page
+        except Exception as e:
+            print(f"Error retrieving inbox summaries: {e}")
+            return {"messages": [], "next_cursor": None}
+
+async def export_mailbox(email, batch_size=None):
+    """Stream every message a user sent and received, sent first, newest first within each half.
+    :param email: Email of the user
+    :param batch_size: Rows per fetch, defaults to EXPORT_BATCH_SIZE
+    :return: Async generator of export dicts with a "direction" of "sent" or "received"
+    """
+    options = {"yield_per": batch_size or services.EXPORT_BATCH_SIZE}
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.stream(sent_export_query(email), execution_options=options)
+            pending = []
+            async for partition in result.partitions():
+                pending.extend(partition)
+                # The last message of a batch may continue in the next one
+                last_id = pending[-1].id
+                complete = [row for row in pending if row.id != last_id]
+                for entry in sent_export_entries(complete):
+                    yield entry
+                pending = pending[len(complete):]
+            for entry in sent_export_entries(pending):
+                yield entry
+
+            result = await session.stream(inbox_query(email), execution_options=options)
+            async for row in result:
+                yield received_export_entry(row)
+        except Exception as e:
+            print(f"Error exporting mailbox: {e}")
+            raise
+
+async def find_messages_search_page(email, terms, limit, cursor=None):
+    """Search the messages a user sent or received, best match first, one page at a time.
+    :param email: Email of the user
+    :param terms: Search text; every word must match
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: dict with "messages" (search result dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_search_cursor(cursor) if cursor else None
+    async with AsyncSessionLocal() as session:
+        try:
+            query = search_query(session.get_bind().dialect.name, email, terms, limit=limit + 1, after=after)
+            rows = (await session.execute(query)).all()
+            page = page_of(rows, limit, lambda row: (row.rank, row.id), encode=encode_search_cursor)
+            page["messages"] = [search_entry(row) for row in page["messages"]]
+            return page
+        except Exception as e:
+            print(f"Error searching messages: {e}")
+            return {"messages": [], "next_cursor": None}
+
+async def find_thread(email, thread_id):
+    """Retrieve a whole conversation as the user sees it, in one query.
+    :param email: Email of the user
+    :param thread_id: UUID of the thread
+    :return: List of thread message dicts, oldest first; empty if the thread is not in the mailbox
+    """
+    thread_id = _as_uuid(thread_id)
+    async with AsyncSessionLocal() as session:
+        try:
+            return [thread_entry(row) for row in await session.execute(thread_query(email, thread_id))]
+        except Exception as e:
+            print(f"Error retrieving thread: {e}")
+            return []
+
+async def find_thread_summaries_page(email, limit, cursor=None):
+    """Retrieve one page of the inbox grouped by thread, most recently active first.
+    :param email: Email of the recipient
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: dict with "threads" (thread summary dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    async with AsyncSessionLocal() as session:
+        try:
+            rows = (await session.execute(thread_summary_query(email, limit=limit + 1, after=after))).all()
+            page = page_of(rows, limit, lambda row: (row.timestamp, row.thread_id), key="threads")
+            page["threads"] = [thread_summary_entry(row) for row in page["threads"]]
+            return page
+        except Exception as e:
+            print(f"Error retrieving thread summaries: {e}")
+            return {"threads": [], "next_cursor": None}
+
+async def find_message_sender_detail(message_id):
+    """Retrieve detailed information about a specific message by message ID.
+    :param message_id: UUID of the message
+    :return: Message detail with sender and recipient information if found, None otherwise
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            message = (await session.execute(_message_with_recipients(_as_uuid(message_id)))).scalars().first()
+            if not message:
+                print("Message not found")
+                return None
+
+            return {
+                "id": message.id,
+                "sender": message.sender.email,
+                "subject": message.subject,
+                "content": message.content,
+                "timestamp": message.timestamp,
+                "recipients": [_recipient_detail(recipient) for recipient in message.recipients]
+            }
+        except Exception as e:
+            print(f"Error retrieving message detail: {e}")
+            return None
+
+async def find_message_recipient_detail(message_id, recipient_id):
+    """Retrieve detailed information about a specific message for a recipient by message ID and recipient ID.
+    :param message_id: UUID of the message
+    :param recipient_id: UUID of the recipient
+    :return: Message detail with recipient information if found, None otherwise
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            message = (await session.execute(_message_with_recipients(_as_uuid(message_id)))).scalars().first()
+            if not message:
+                print("Message not found")
+                return None
+
+            message_recipient = next(
+                (recipient for recipient in message.recipients if recipient.recipient_id == _as_uuid(recipient_id)),
+                None
+            )
+            if not message_recipient:
+                print("Message recipient not found")
+                return None
+
+            if message_recipient.read == False:
+                # Conditional UPDATE so two concurrent reads decrement the counter only once
+                result = await session.execute(mark_read_statement(message_recipient.id))
+                if result.rowcount:
+                    await session.execute(unread_decrement(message_recipient.recipient_id, result.rowcount))
+                await session.commit()
+                await session.refresh(message_recipient)
+
+            return {
+                "id": message.id,
+                "sender": message.sender.email,
+                "subject": message.subject,
+                "content": message.content,
+                "timestamp": message.timestamp,
+                "recipients": [_recipient_detail(recipient) for recipient in message.recipients],
+                "read": message_recipient.read,
+                "read_at": message_recipient.read_at
+            }
+        except Exception as e:
+            print(f"Error retrieving message detail: {e}")
+            return None
+
+async def mark_messages_read(recipient_id, message_ids=None, before=None):
+    """Mark many messages as read for one recipient with a single UPDATE statement.
+    :param recipient_id: UUID of the recipient
+    :param message_ids: List of message UUIDs to mark, or None
+    :param before: Mark every message with a timestamp before this datetime, or None
+    :return: List of {"message_id", "read_at"} dicts for the messages that changed
+    :raises ValueError: on malformed ids or when not exactly one of message_ids/before is given
+    """
+    recipient_id, message_ids = bulk_read_args(recipient_id, message_ids, before)
+    if message_ids == []:
+        return []
+    async with AsyncSessionLocal() as session:
+        try:
+            rows = (await session.execute(mark_read_bulk_statement(recipient_id, message_ids, before))).all()
+            if rows:
+                await session.execute(unread_decrement(recipient_id, len(rows)))
+            await session.commit()
+            return [{"message_id": row.message_id, "read_at": row.read_at} for row in rows]
+        except Exception as e:
+            await session.rollback()
+            print(f"Error marking messages as read: {e}")
+            return None
+
+async def find_unread_count(email):
+    """Read a user's maintained unread counter (a primary key lookup, independent of inbox size).
+    :param email: Email of the user
+    :return: Number of unread messages, or None if the user does not exist
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            row = (await session.execute(unread_count_query(email))).first()
+            return row.unread if row else None
+        except Exception as e:
+            print(f"Error retrieving unread count: {e}")
+            return None
@@ -0,0 +1,236 @@
+# In-process caches
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from . import models
+
+load_dotenv()
+
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+# Entries, two per user (by email and by id)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "20000"))
+# Each worker has its own cache, so an update made in one worker can stay
+# visible as stale data in the others for up to this many seconds
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+# sendMessage responses kept for Idempotency-Key replays (the database keeps
+# them for IDEMPOTENCY_TTL too, this cache only saves the lookup)
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+
+
+class CacheBackend:
+    """Storage interface for caches. Implement it to share entries across workers (e.g. Redis)."""
+
+    def get(self, key):
+        """Return the value stored under key, or None."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, for ttl seconds when given instead of the backend's default."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+def json_size(value):
+    """Length of a value serialized as compact JSON, an approximation of the memory it holds."""
+    return len(json.dumps(value, separators=(",", ":")))
+
+
+class LRUTTLCache(CacheBackend):
+    """Thread-safe LRU cache whose entries also expire after ttl seconds.
+
+    maxsize bounds the number of entries. maxbytes, when set, also bounds their
+    total sizeof(value); a value larger than maxbytes on its own is not stored.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic, maxbytes=0, sizeof=json_size):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def _discard(self, key):
+        self._entries.pop(key, None)
+        self.bytes -= self._sizes.pop(key, 0)
+
+    def _store(self, key, expires_at, value, size):
+        self._discard(key)
+        if self.maxbytes and size > self.maxbytes:
+            return
+        self._entries[key] = (expires_at, value)
+        if self.maxbytes:
+            self._sizes[key] = size
+            self.bytes += size
+
+    def _trim(self):
+        while len(self._entries) > self.maxsize or (self.maxbytes and self.bytes > self.maxbytes):
+            self._discard(next(iter(self._entries)))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        # Measured outside the lock, it may serialize a large value
+        size = self.sizeof(value) if self.maxbytes else 0
+        with self._lock:
+            self._store(key, self._clock() + (self.ttl if ttl is None else ttl), value, size)
+            self._trim()
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PersistentLRUTTLCache(LRUTTLCache):
+    """LRUTTLCache of JSON values that is loaded from a file and saved back to it, to survive restarts.
+
+    Expiry uses wall-clock time so saved entries stay valid in the next process.
+    """
+
+    def __init__(self, maxsize, ttl, path, clock=time.time, maxbytes=0, sizeof=json_size):
+        super().__init__(maxsize, ttl, clock, maxbytes, sizeof)
+        self.path = path
+        self.load()
+
+    def load(self):
+        """Add the unexpired entries saved in the file, if there is one."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading cache from {self.path}: {e}")
+            return
+        now = self._clock()
+        saved = [
+            (key, expires_at, value, self.sizeof(value) if self.maxbytes else 0)
+            for key, expires_at, value in saved if expires_at > now
+        ]
+        with self._lock:
+            # Saved least recently used first
+            for key, expires_at, value, size in saved:
+                self._store(key, expires_at, value, size)
+            self._trim()
+
+    def save(self):
+        """Write the unexpired entries to the file, replacing it atomically."""
+        now = self._clock()
+        with self._lock:
+            saved = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items() if expires_at > now]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.path)
+
+
+class UserCache:
+    """Read-through cache of user id/email/name/created_at, keyed by email and by id."""
+
+    FIELDS = ("id", "email", "name", "created_at")
+
+    def __init__(self, backend, enabled=True):
+        self.backend = backend
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _lookup(self, key):
+        if not self.enabled:
+            return None
+        record = self.backend.get(key)
+        self._count(record is not None)
+        if record is None:
+            return None
+        # Hand out a fresh detached object so callers can never mutate the cached record
+        return models.User(**record)
+
+    def get_by_email(self, email):
+        return self._lookup(f"email:{email}")
+
+    def get_by_id(self, user_id):
+        return self._lookup(f"id:{user_id}")
+
+    def put(self, user):
+        if not self.enabled or user is None:
+            return
+        record = {field: getattr(user, field) for field in self.FIELDS}
+        self.backend.set(f"email:{record['email']}", record)
+        self.backend.set(f"id:{record['id']}", record)
+
+    def invalidate(self, user_id=None, email=None):
+        """Drop a user by id and/or email, including the other key of a cached record."""
+        if user_id is not None:
+            record = self.backend.get(f"id:{user_id}")
+            if record is not None:
+                self.backend.delete(f"email:{record['email']}")
+            self.backend.delete(f"id:{user_id}")
+        if email is not None:
+            record = self.backend.get(f"email:{email}")
+            if record is not None:
+                self.backend.delete(f"id:{record['id']}")
+            self.backend.delete(f"email:{email}")
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        if isinstance(self.backend, LRUTTLCache):
+            stats.update({"entries": len(self.backend), "maxsize": self.backend.maxsize, "ttl": self.backend.ttl})
+        return stats
+
+
+user_cache = UserCache(LRUTTLCache(USER_CACHE_SIZE, USER_CACHE_TTL), enabled=USER_CACHE_ENABLED)
+idempotency_cache = LRUTTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
@@ -1,6 +1,373 @@
 # DB connection setup
-from sqlalchemy import create_engine
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+load_dotenv()
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Pool sizing. Each uvicorn worker owns its own pool, so the server needs
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections at peak.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+# Server-side timeouts in milliseconds (0 disables them)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_LOCK_TIMEOUT_MS = int(os.getenv("DB_LOCK_TIMEOUT_MS", "0"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# Request path: "sync" runs services.py on the threadpool, "async" runs
+# async_services.py on an AsyncEngine (asyncpg)
+DB_BACKEND = os.getenv("DB_BACKEND", "sync").strip().lower()
+# Create missing tables on startup; set to false when Alembic manages the schema
+DB_CREATE_SCHEMA = _env_bool("DB_CREATE_SCHEMA", True)
+
+
+def build_postgresql_url(host, database, user, password, port=5432):
+    """
+    Build a PostgreSQL connection string.
+    :param host: Địa chỉ máy chủ PostgreSQL
+    :param database: Tên cơ sở dữ liệu
+    :param user: Tên người dùng
+    :param password: Mật khẩu
+    :return: DSN string
+    """
+    return "postgresql://{user}:{password}@{host}:{port}/{database}".format(
+        user=user,
+        password=password,
+        host=host,
+        port=port,
+        database=database
+    )
+
+
+def database_url():
+    """
+    DSN of the application database.
+    DATABASE_URL wins when set, otherwise the docker-compose defaults are used with HOST.
+    """
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    return build_postgresql_url(
+        host=os.getenv("HOST"),
+        database="postgres",
+        user="postgres",
+        password="postgres",
+        port=5432
+    )
+
+
+def async_database_url(url=None):
+    """
+    Async driver variant of a DSN (asyncpg for PostgreSQL, aiosqlite for SQLite).
+    :param url: DSN, defaults to database_url()
+    :return: DSN string
+    """
+    url = make_url(url or database_url())
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+    elif backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url.render_as_string(hide_password=False)
+
+
+class PoolMetrics:
+    """Counters collected from one engine's connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+
+    def record_checkin(self):
+        with self._lock:
+            self.checkins += 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "timeouts": self.timeouts,
+                "wait_total_ms": round(self.wait_total * 1000, 3),
+                "wait_avg_ms": round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+class _MeteredPoolMixin:
+    """Records how long callers wait for a pooled connection."""
+
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            if self.metrics is not None:
+                self.metrics.record_timeout()
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    """QueuePool that records how long callers wait for a connection."""
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long callers wait for a connection."""
+
+
+# One engine (and therefore one pool) per DSN for the whole process
+_engines = {}
+_sessionmakers = {}
+_async_engines = {}
+_async_sessionmakers = {}
+_metrics = {}
+_registry_lock = threading.Lock()
+
+
+def _engine_options(url, is_async=False):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        # SQLite picks its own pool class; sizing options do not apply
+        return {}
+
+    options = {
+        "poolclass": MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if backend == "postgresql":
+        settings = {}
+        if DB_STATEMENT_TIMEOUT_MS:
+            settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+        if DB_LOCK_TIMEOUT_MS:
+            settings["lock_timeout"] = str(DB_LOCK_TIMEOUT_MS)
+
+        if url.get_driver_name() == "asyncpg":
+            connect_args = {"timeout": DB_CONNECT_TIMEOUT}
+            if settings:
+                connect_args["server_settings"] = settings
+        else:
+            connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT}
+            if settings:
+                connect_args["options"] = " ".join(f"-c {name}={value}" for name, value in settings.items())
+        options["connect_args"] = connect_args
+    return options
+
+
+def _instrument(engine, url):
+    """Attach a PoolMetrics to a (sync) engine's pool."""
+    metrics = PoolMetrics()
+    if isinstance(engine.pool, _MeteredPoolMixin):
+        engine.pool.metrics = metrics
+
+    event.listen(engine, "checkout", lambda *args: metrics.record_checkout())
+    event.listen(engine, "checkin", lambda *args: metrics.record_checkin())
+    event.listen(engine, "connect", lambda *args: metrics.record_connect())
+
+    _metrics[url] = metrics
+    print(f"Created database engine for {engine.url!r}")
+
+
+def _build_engine(url):
+    engine = create_engine(url, **_engine_options(url))
+    _instrument(engine, url)
+    return engine
+
+
+def _build_async_engine(url):
+    engine = create_async_engine(url, **_engine_options(url, is_async=True))
+    _instrument(engine.sync_engine, url)
+    return engine
+
+
+def get_engine(url=None):
+    """
+    Return the shared engine for a DSN, building it on first use.
+    :param url: DSN, defaults to database_url()
+    :return: sqlalchemy Engine
+    """
+    url = url or database_url()
+    engine = _engines.get(url)
+    if engine is None:
+        with _registry_lock:
+            engine = _engines.get(url)
+            if engine is None:
+                engine = _build_engine(url)
+                _engines[url] = engine
+    return engine
+
+
+def get_sessionmaker(url=None):
+    """
+    Return the shared session factory bound to get_engine(url).
+    :param url: DSN, defaults to database_url()
+    :return: sessionmaker
+    """
+    url = url or database_url()
+    factory = _sessionmakers.get(url)
+    if factory is None:
+        engine = get_engine(url)
+        with _registry_lock:
+            factory = _sessionmakers.get(url)
+            if factory is None:
+                factory = sessionmaker(bind=engine)
+                _sessionmakers[url] = factory
+    return factory
+
+
+def get_async_engine(url=None):
+    """
+    Return the shared AsyncEngine for a DSN, building it on first use.
+    :param url: DSN, defaults to async_database_url()
+    :return: sqlalchemy AsyncEngine
+    """
+    url = url or async_database_url()
+    engine = _async_engines.get(url)
+    if engine is None:
+        with _registry_lock:
+            engine = _async_engines.get(url)
+            if engine is None:
+                engine = _build_async_engine(url)
+                _async_engines[url] = engine
+    return engine
+
+
+def get_async_sessionmaker(url=None):
+    """
+    Return the shared AsyncSession factory bound to get_async_engine(url).
+    :param url: DSN, defaults to async_database_url()
+    :return: async_sessionmaker
+    """
+    url = url or async_database_url()
+    factory = _async_sessionmakers.get(url)
+    if factory is None:
+        engine = get_async_engine(url)
+        with _registry_lock:
+            factory = _async_sessionmakers.get(url)
+            if factory is None:
+                # Objects are returned after the session closes, so never expire them
+                factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+                _async_sessionmakers[url] = factory
+    return factory
+
+
+def SessionLocal():
+    """Open a new session on the default engine."""
+    return get_sessionmaker()()
+
+
+def AsyncSessionLocal():
+    """Open a new AsyncSession on the default async engine."""
+    return get_async_sessionmaker()()
+
+
+def pool_metrics(url=None):
+    """
+    Pool state and counters for one DSN (sync or async).
+    :param url: DSN, defaults to the DSN of the DB_BACKEND in use
+    :return: dict of metrics, empty if the engine was never built
+    """
+    url = url or (async_database_url() if DB_BACKEND == "async" else database_url())
+    engine = _engines.get(url)
+    if engine is None and url in _async_engines:
+        engine = _async_engines[url].sync_engine
+    if engine is None:
+        return {}
+
+    pool = engine.pool
+    stats = {"pool": pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": DB_MAX_OVERFLOW,
+        })
+    stats.update(_metrics[url].snapshot())
+    return stats
+
+
+def bootstrap_schema(metadata, url=None):
+    """
+    Create missing tables once per process, at application startup.
+    :param metadata: MetaData holding the tables
+    :param url: DSN, defaults to database_url()
+    :return: True if create_all ran, False when disabled by DB_CREATE_SCHEMA
+    """
+    if not DB_CREATE_SCHEMA:
+        return False
+    metadata.create_all(bind=get_engine(url))
+    return True
+
+
+def dispose_engines():
+    """Close every pooled connection, e.g. on shutdown or after fork."""
+    with _registry_lock:
+        for engine in _engines.values():
+            engine.dispose()
+
+
+async def dispose_async_engines():
+    """Close every pooled async connection."""
+    for engine in list(_async_engines.values()):
+        await engine.dispose()
 
 
 def connect_to_postgresql(host, database, user, password, port=5432):
@@ -10,35 +377,14 @@ def connect_to_postgresql(host, database, user, password, port=5432):
     :param database: Tên cơ sở dữ liệu
     :param user: Tên người dùng
     :param password: Mật khẩu
-    :return: Đối tượng kết nối
+    :return: Đối tượng kết nối (engine và SessionLocal dùng chung theo DSN)
     """
     try:
-        # Tạo kết nối đến cơ sở dữ liệu
-        # Replace with your PostgreSQL connection string
-        DATABASE_URL = "postgresql://{user}:{password}@{host}:{port}/{database}".format(
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            database=database
-        )
-
-        # Set up the database engine and session
-        engine = create_engine(DATABASE_URL)
-        SessionLocal = sessionmaker(bind=engine)
-
-        print("Kết nối thành công đến PostgreSQL://{user}:{password}@{host}:{port}/{database}".format(
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            database=database
-        ))
-        
+        url = build_postgresql_url(host=host, database=database, user=user, password=password, port=port)
         return {
-            'engine': engine,
-            'SessionLocal': SessionLocal
+            'engine': get_engine(url),
+            'SessionLocal': get_sessionmaker(url)
         }
     except Exception as e:
         print(f"Lỗi khi kết nối đến PostgreSQL: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,64 @@
+# Background fan-out of recipient rows for large sends
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Sends to at least this many recipients are answered with 202 and have their
+# recipient rows written in the background (0 keeps every send synchronous)
+FANOUT_THRESHOLD = int(os.getenv("FANOUT_THRESHOLD", "0"))
+# Fan-out jobs worked on concurrently by each process
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "2"))
+
+
+class FanoutQueue:
+    """In-process queue of fan-out job ids drained by a pool of asyncio worker tasks.
+
+    Job state lives in the fanout_jobs table; the queue only says which job to
+    work on next, so jobs left unfinished by a restart are queued again at startup.
+    """
+
+    def __init__(self, workers=FANOUT_WORKERS):
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self._runner = None
+
+    def start(self, runner, pending=()):
+        """Start the workers.
+        :param runner: Coroutine function delivering one job, called with its id
+        :param pending: Job ids to queue first, e.g. unfinished jobs from a previous run
+        """
+        self._runner = runner
+        self._queue = asyncio.Queue()
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def put(self, job_id):
+        self._queue.put_nowait(job_id)
+
+    async def join(self):
+        """Wait until every queued job has been worked on."""
+        await self._queue.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._runner(job_id)
+            except Exception as e:
+                print(f"Error running fan-out job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+fanout_queue = FanoutQueue()
@@ -1,5 +1,22 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from . import routes
+from . import db, models, routes
+from .fanout import fanout_queue
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One-time schema bootstrap instead of create_all on every request
+    db.bootstrap_schema(models.Base.metadata)
+    # Large sends finish in the background; resume the ones a previous run left unfinished
+    pending = await routes.run_service("pending_fanout_jobs")
+    fanout_queue.start(lambda job_id: routes.run_service("run_fanout_job", job_id), pending)
+    yield
+    await fanout_queue.stop()
+    db.dispose_engines()
+    await db.dispose_async_engines()
+
 
-app = FastAPI()
-app.include_router(router=routes.router, prefix="/api", tags=["users"])
\ No newline at end of file
+app = FastAPI(lifespan=lifespan)
+app.include_router(router=routes.router, prefix="/api", tags=["users"])
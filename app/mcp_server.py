@@ -1,25 +1,109 @@
 from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
 import os
+import threading
 import time
 import re
+import sys
+import requests
 from dotenv import load_dotenv
 from aps_toolkit import Auth, BIM360
 from mcp.server.fastmcp import FastMCP
 
+from .aps_http import ClientRegistry, route_requests
+from .aps_index import FolderIndex
+from .cache import LRUTTLCache, PersistentLRUTTLCache
+
 # region Load environment variables
 # Load environment variables
 load_dotenv()
 APS_CLIENT_ID = os.getenv('APS_CLIENT_ID')
 APS_CLIENT_SECRET = os.getenv('APS_CLIENT_SECRET')
 APS_REDIRECT_URI = os.getenv('APS_REDIRECT_URI', "http://localhost:8080/api/auth/callback")
-APS_SCOPES = os.getenv('APS_SCOPES', 'data:read viewables:read account:read')
+# user-profile:read lets token_scope ask userinfo who a token belongs to; without it cached responses are kept per token
+APS_SCOPES = os.getenv('APS_SCOPES', 'data:read viewables:read account:read user-profile:read')
 APS_TOKEN = os.getenv('APS_TOKEN')  # Direct token if provided
+# Tells who a 3-legged token acts for, to key cached responses by user instead of by token
+APS_USERINFO_URL = os.getenv('APS_USERINFO_URL', 'https://api.userprofile.autodesk.com/userinfo')
+
+# Threads running blocking aps_toolkit calls for all tools together
+APS_EXECUTOR_WORKERS = int(os.getenv('APS_EXECUTOR_WORKERS', '16'))
+
+# Keep-alive connections to APS, one pool per token shared by all tools
+APS_HTTP_POOL_SIZE = int(os.getenv('APS_HTTP_POOL_SIZE', str(APS_EXECUTOR_WORKERS)))  # Connections kept open per host
+APS_HTTP_CONNECT_TIMEOUT = float(os.getenv('APS_HTTP_CONNECT_TIMEOUT', '10')) or None  # Seconds, 0 = wait forever
+APS_HTTP_READ_TIMEOUT = float(os.getenv('APS_HTTP_READ_TIMEOUT', '60')) or None  # Seconds, 0 = wait forever
+
+# Cache of APS responses shared by all tools
+APS_CACHE_ENABLED = os.getenv('APS_CACHE_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+APS_CACHE_SIZE = int(os.getenv('APS_CACHE_SIZE', '10000'))  # Responses kept, least recently used dropped first
+# Total size of the kept responses as compact JSON, a folder listing can be megabytes; 0 = no limit
+APS_CACHE_MAX_BYTES = int(os.getenv('APS_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+APS_CACHE_PATH = os.getenv('APS_CACHE_PATH')  # JSON file kept between restarts; unset keeps the cache in memory only
+# Seconds a response is reused for, per BIM360 method
+APS_CACHE_TTL = {
+    "get_hubs": float(os.getenv('APS_CACHE_TTL_HUBS', '3600')),
+    "get_projects": float(os.getenv('APS_CACHE_TTL_PROJECTS', '900')),
+    "get_top_folders": float(os.getenv('APS_CACHE_TTL_FOLDERS', '300')),
+    "get_folder_contents": float(os.getenv('APS_CACHE_TTL_FOLDERS', '300')),
+    "get_item_versions": float(os.getenv('APS_CACHE_TTL_VERSIONS', '300')),
+}
+
+# Folder traversal of get_project_files
+APS_FOLDER_CONCURRENCY = int(os.getenv('APS_FOLDER_CONCURRENCY', '8'))  # Folder listings in flight at once
+APS_FOLDER_MAX_DEPTH = int(os.getenv('APS_FOLDER_MAX_DEPTH', '0'))  # Subfolder levels below the start folder, 0 = no limit
+APS_FOLDER_MAX_ITEMS = int(os.getenv('APS_FOLDER_MAX_ITEMS', '0'))  # Files returned at most, 0 = no limit
+
+# Local index of project folder trees answering get_project_files
+APS_INDEX_ENABLED = os.getenv('APS_INDEX_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+APS_INDEX_PATH = os.getenv('APS_INDEX_PATH') or ':memory:'  # SQLite file kept between restarts
+APS_INDEX_SYNC_INTERVAL = float(os.getenv('APS_INDEX_SYNC_INTERVAL', '60'))  # Seconds a synced tree is answered without asking APS
+# Seconds after which a sync lists every folder again instead of trusting lastModifiedTime, 0 = never.
+# A folder is otherwise only re-listed when the stamp its parent reports changed, which misses changes
+# deeper down unless APS moves the stamps of all their ancestors, which it does not promise.
+APS_INDEX_MAX_AGE = float(os.getenv('APS_INDEX_MAX_AGE', '3600'))
 
 # Cache for the token
 TOKEN_CACHE = {
     "token": None,
     "expires_at": 0
 }
+# authenticate() runs on executor threads; only one of them may log in
+TOKEN_LOCK = threading.Lock()
+
+# aps_toolkit is synchronous (requests), so its calls run here instead of on the event loop
+aps_executor = ThreadPoolExecutor(max_workers=APS_EXECUTOR_WORKERS, thread_name_prefix="aps")
+
+folder_index = FolderIndex(APS_INDEX_PATH)
+# (project id, start folders) -> lock, so concurrent calls for one tree share a single sync
+index_sync_locks: Dict[tuple, asyncio.Lock] = {}
+
+# aps_toolkit calls requests.get/post directly; route them through the pooled session of each client
+route_requests(sys.modules[BIM360.__module__])
+# BIM360 is looked up on every build so tests can swap it out
+aps_clients = ClientRegistry(
+    lambda token: BIM360(token),
+    pool_size=APS_HTTP_POOL_SIZE,
+    connect_timeout=APS_HTTP_CONNECT_TIMEOUT,
+    read_timeout=APS_HTTP_READ_TIMEOUT,
+)
+
+if APS_CACHE_PATH:
+    aps_cache = PersistentLRUTTLCache(
+        APS_CACHE_SIZE, APS_CACHE_TTL["get_folder_contents"], APS_CACHE_PATH, maxbytes=APS_CACHE_MAX_BYTES
+    )
+    atexit.register(aps_cache.save)
+else:
+    aps_cache = LRUTTLCache(APS_CACHE_SIZE, APS_CACHE_TTL["get_folder_contents"], maxbytes=APS_CACHE_MAX_BYTES)
+# Access token -> identity it acts for, looked up once per token
+token_identities = LRUTTLCache(64, 86400)
+# Seconds before asking userinfo again about a token it could not place
+TOKEN_IDENTITY_RETRY = 60
 
 # endregion
 
@@ -130,29 +214,92 @@ id_masker = IDMasker()
 # endregion
 
 # Helper functions
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the APS executor and wait for its result without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(aps_executor, functools.partial(func, *args, **kwargs))
+
+def fetch_token_identity(token) -> Optional[str]:
+    """Who an access token acts for, stable across token refreshes and restarts.
+    
+    Returns the APS user id from userinfo, None for a token userinfo rejects as
+    invalid (401), and the token itself when userinfo cannot tell (no
+    user-profile:read scope, unreachable), so responses are then only shared
+    while the token lives and never with another token.
+    """
+    access_token = str(getattr(token, "access_token", token))
+    try:
+        response = requests.get(
+            APS_USERINFO_URL,
+            headers={'Authorization': f'Bearer {access_token}'},
+            timeout=(APS_HTTP_CONNECT_TIMEOUT, APS_HTTP_READ_TIMEOUT),
+        )
+        if response.status_code == 401:
+            return None
+        response.raise_for_status()
+        return f"user:{response.json()['sub']}"
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Error fetching APS user info (is user-profile:read in APS_SCOPES?): {e}")
+        return f"token:{access_token}"
+
+async def token_scope(token) -> Optional[str]:
+    """Cache namespace of an access token: a hash of who it acts for, so the token is never written to disk.
+    
+    None for a token APS rejects, whose calls must not be answered from the cache.
+    """
+    access_token = str(getattr(token, "access_token", token))
+    identity = token_identities.get(access_token)
+    if identity is None:
+        identity = await run_blocking(fetch_token_identity, token)
+        if identity is None:
+            return None
+        # Only a confirmed user is remembered for long; ask again soon about the others
+        token_identities.set(access_token, identity, ttl=None if identity.startswith("user:") else TOKEN_IDENTITY_RETRY)
+    return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+async def aps_call(bim360, method: str, *args, force_refresh: bool = False):
+    """Call a BIM360 method on the APS executor, reusing its cached response while it is fresh.
+    
+    Responses are cached per APS user (see token_scope) and arguments for
+    APS_CACHE_TTL[method] seconds; only successful ones (with "data") are kept.
+    """
+    scope = await token_scope(getattr(bim360, "token", None)) if APS_CACHE_ENABLED else None
+    if scope is None:
+        return await run_blocking(aps_clients.call, bim360, method, *args)
+    key = json.dumps([scope, method, *args])
+    if not force_refresh:
+        data = aps_cache.get(key)
+        if data is not None:
+            return data
+    data = await run_blocking(aps_clients.call, bim360, method, *args)
+    if data and "data" in data:
+        aps_cache.set(key, data, ttl=APS_CACHE_TTL[method])
+    return data
+
 def authenticate() -> str:
     """Authenticate with Autodesk and get access token."""
-    # If we have a cached token that hasn't expired, use it
-    current_time = time.time()
-    if TOKEN_CACHE["token"] and TOKEN_CACHE["expires_at"] > current_time:
-        return TOKEN_CACHE["token"]
-    
-    # If direct token is provided in environment, use it
-    if APS_TOKEN:
-        TOKEN_CACHE["token"] = APS_TOKEN
-        # Set expiration to a reasonable time (1 hour)
+    with TOKEN_LOCK:
+        # If we have a cached token that hasn't expired, use it
+        current_time = time.time()
+        if TOKEN_CACHE["token"] and TOKEN_CACHE["expires_at"] > current_time:
+            return TOKEN_CACHE["token"]
+        
+        # If direct token is provided in environment, use it
+        if APS_TOKEN:
+            TOKEN_CACHE["token"] = APS_TOKEN
+            # Set expiration to a reasonable time (1 hour)
+            TOKEN_CACHE["expires_at"] = current_time + 3600
+            return APS_TOKEN
+            
+        # Otherwise use 3-legged OAuth
+        auth = Auth(APS_CLIENT_ID, APS_CLIENT_SECRET)
+        token = auth.auth3leg(APS_REDIRECT_URI, APS_SCOPES)
+        
+        # Cache the token with an expiration time (1 hour)
+        TOKEN_CACHE["token"] = token
         TOKEN_CACHE["expires_at"] = current_time + 3600
-        return APS_TOKEN
         
-    # Otherwise use 3-legged OAuth
-    auth = Auth(APS_CLIENT_ID, APS_CLIENT_SECRET)
-    token = auth.auth3leg(APS_REDIRECT_URI, APS_SCOPES)
-    
-    # Cache the token with an expiration time (1 hour)
-    TOKEN_CACHE["token"] = token
-    TOKEN_CACHE["expires_at"] = current_time + 3600
-    
-    return token
+        return token
 
 def format_hub(hub: Dict) -> str:
     """Format a hub into a readable string with masked ID."""
@@ -196,17 +343,230 @@ File Type: {attributes.get('fileType', 'N/A')}
 Last Modified: {attributes.get('lastModifiedTime', 'Unknown')}
 """
 
+async def drain_queue(queue: asyncio.Queue, handle, concurrency: int, stop: Optional[asyncio.Event] = None):
+    """Run `handle` on every entry put on the queue, `concurrency` at a time, until it is empty.
+    
+    Handlers may put more entries on the queue. Stops early when `stop` is set,
+    and re-raises the first error a handler raised.
+    """
+    async def worker():
+        while True:
+            entry = await queue.get()
+            try:
+                await handle(entry)
+            finally:
+                queue.task_done()
+    
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    waiters = [asyncio.create_task(queue.join())]
+    if stop is not None:
+        waiters.append(asyncio.create_task(stop.wait()))
+    try:
+        # Queue drained, stop requested, or a handler failed
+        await asyncio.wait(waiters + workers, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in waiters + workers:
+            task.cancel()
+        results = await asyncio.gather(*workers, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+async def walk_folders(
+    bim360,
+    project_id: str,
+    folder_ids: List[str],
+    file_type: Optional[str] = None,
+    max_depth: Optional[int] = None,
+    max_items: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    force_refresh: bool = False,
+):
+    """Collect the files below the given folders, listing several folders at a time.
+    
+    Folders are taken breadth-first from a queue by `concurrency` workers, each
+    waiting on one get_folder_contents call at a time on the APS executor.
+    Files are returned in the order a depth-first walk would find them; with an
+    item cap, the walk keeps the ones nearest to the start folders.
+    
+    Args:
+        bim360: BIM360 client
+        project_id: The real ID of the project
+        folder_ids: Real IDs of the folders to start from
+        file_type: Optional filter for file type (e.g., "rvt" for Revit files)
+        max_depth: Subfolder levels to descend into, defaults to APS_FOLDER_MAX_DEPTH (0 = no limit)
+        max_items: Stop once this many files were found, defaults to APS_FOLDER_MAX_ITEMS (0 = no limit)
+        concurrency: Folder listings in flight at once, defaults to APS_FOLDER_CONCURRENCY
+        force_refresh: List every folder from APS even if a cached listing is still fresh
+    
+    Returns:
+        (list of file items, True if max_depth or max_items cut the walk short)
+    """
+    max_depth = APS_FOLDER_MAX_DEPTH if max_depth is None else max_depth
+    max_items = APS_FOLDER_MAX_ITEMS if max_items is None else max_items
+    concurrency = max(1, concurrency or APS_FOLDER_CONCURRENCY)
+    
+    # (folder id, position in the depth-first order, depth)
+    queue = asyncio.Queue()
+    for index, folder_id in enumerate(folder_ids):
+        queue.put_nowait((folder_id, (index,), 0))
+    found = []  # (position, item)
+    limited = asyncio.Event()
+    truncated = False
+    
+    async def list_folder(entry):
+        nonlocal truncated
+        folder_id, position, depth = entry
+        contents = await aps_call(bim360, "get_folder_contents", project_id, folder_id, force_refresh=force_refresh)
+        if not contents or "data" not in contents:
+            return
+        
+        for index, item in enumerate(contents.get("data", [])):
+            if item.get("type") == "folders":
+                sub_folder_id = item.get("id")
+                # Register the folder ID mapping
+                id_masker.mask_folder_id(sub_folder_id)
+                if max_depth and depth >= max_depth:
+                    truncated = True
+                else:
+                    queue.put_nowait((sub_folder_id, position + (index,), depth + 1))
+            
+            elif item.get("type") == "items":
+                item_type = item.get("attributes", {}).get("fileType", "").lower()
+                # Register the item ID mapping
+                id_masker.mask_item_id(item.get("id"))
+                if not file_type or (item_type and file_type.lower() in item_type):
+                    found.append((position + (index,), item))
+        
+        if max_items and len(found) >= max_items:
+            truncated = True
+            limited.set()
+    
+    await drain_queue(queue, list_folder, concurrency, stop=limited)
+    
+    found.sort(key=lambda entry: entry[0])
+    items = [item for _, item in found]
+    if max_items and len(items) > max_items:
+        items = items[:max_items]
+    return items, truncated
+
+async def sync_folder_index(
+    bim360,
+    project_id: str,
+    folder_ids: List[str],
+    stamps: Optional[Dict[str, str]] = None,
+    force_refresh: bool = False,
+    concurrency: Optional[int] = None,
+) -> int:
+    """Bring the folder index of a project up to date below the given folders.
+    
+    The start folders are always listed. Below them, only folders whose
+    lastModifiedTime changed since they were indexed (or that were never
+    indexed) are listed again, `concurrency` at a time. That only notices a
+    change if APS updated the stamp of every folder above it; callers run a
+    force_refresh sync every APS_INDEX_MAX_AGE seconds for the changes it misses.
+    
+    Args:
+        bim360: BIM360 client
+        project_id: The real ID of the project
+        folder_ids: Real IDs of the folders to start from
+        stamps: lastModifiedTime of the start folders, where known
+        force_refresh: List every folder again
+        concurrency: Folder listings in flight at once, defaults to APS_FOLDER_CONCURRENCY
+    
+    Returns:
+        (number of folders listed, number of listings APS answered without data)
+    """
+    stamps = stamps or {}
+    queue = asyncio.Queue()
+    for folder_id in folder_ids:
+        queue.put_nowait((folder_id, stamps.get(folder_id)))
+    listed = 0
+    failed = 0
+    
+    async def list_folder(entry):
+        nonlocal listed, failed
+        folder_id, stamp = entry
+        # The index decides what changed, so never take the listing from the response cache
+        contents = await aps_call(bim360, "get_folder_contents", project_id, folder_id, force_refresh=True)
+        if not contents or "data" not in contents:
+            failed += 1
+            await run_blocking(folder_index.mark_failed, project_id, folder_id)
+            return
+        listed += 1
+        changed = await run_blocking(
+            folder_index.store_listing, project_id, folder_id, contents, stamp, time.time(), force_refresh
+        )
+        for sub_folder in changed:
+            queue.put_nowait(sub_folder)
+    
+    await drain_queue(queue, list_folder, max(1, concurrency or APS_FOLDER_CONCURRENCY))
+    return listed, failed
+
+async def sync_folder_index_if_due(
+    bim360,
+    project_id: str,
+    folder_ids: List[str],
+    stamps: Optional[Dict[str, str]] = None,
+    force_refresh: bool = False,
+) -> int:
+    """Sync the folder index below the start folders when it is older than the sync interval.
+    
+    A sync lists every folder again (force_refresh) when asked to or when the last
+    full one is older than APS_INDEX_MAX_AGE. One sync of the same start folders
+    runs at a time; a call that waited for it finds the index fresh and does not
+    sync again.
+    
+    Args:
+        bim360: BIM360 client
+        project_id: The real ID of the project
+        folder_ids: Real IDs of the folders to start from
+        stamps: lastModifiedTime of the start folders, where known
+        force_refresh: List every folder again
+    
+    Returns:
+        Number of folder listings that failed, 0 when no sync was due
+    """
+    key = (project_id, tuple(sorted(folder_ids)))
+    lock = index_sync_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Read under the lock, after any sync this call waited for
+        now = time.time()
+        synced_at = await run_blocking(folder_index.synced_at, project_id, folder_ids)
+        full_synced_at = await run_blocking(folder_index.synced_at, project_id, folder_ids, True)
+        full = force_refresh or bool(
+            APS_INDEX_MAX_AGE and (full_synced_at is None or now - full_synced_at > APS_INDEX_MAX_AGE)
+        )
+        if not full and synced_at is not None and now - synced_at <= APS_INDEX_SYNC_INTERVAL:
+            return 0
+        _, failed = await sync_folder_index(bim360, project_id, folder_ids, stamps, force_refresh=full)
+        if failed:
+            # Not a sync to rely on: the next call syncs again and reaches the failed folders
+            await run_blocking(folder_index.mark_unsynced, project_id, folder_ids)
+        else:
+            await run_blocking(folder_index.mark_synced, project_id, folder_ids, now, full)
+        return failed
+
 # Initialize FastMCP server
 mcp = FastMCP("acc")
 
+@mcp.resource("aps://metrics/http", mime_type="application/json")
+def get_http_metrics() -> str:
+    """Connection reuse of the pooled APS sessions: requests, new connections, reused ones and timeouts."""
+    return json.dumps(aps_clients.stats())
+
 # Tool implementation
 @mcp.tool()
-async def get_hubs() -> str:
-    """Get all available hubs the user has access to."""
-    token = authenticate()
-    bim360 = BIM360(token)
+async def get_hubs(force_refresh: bool = False) -> str:
+    """Get all available hubs the user has access to.
+    
+    Args:
+        force_refresh: Fetch from APS even if a cached response is still fresh
+    """
+    token = await run_blocking(authenticate)
+    bim360 = aps_clients.get(token)
     
-    data = bim360.get_hubs()
+    data = await aps_call(bim360, "get_hubs", force_refresh=force_refresh)
     
     if not data or "data" not in data: 
         return "Unable to fetch hubs or no hubs found."
@@ -218,14 +578,15 @@ async def get_hubs() -> str:
     return "\n---\n".join(hubs)
 
 @mcp.tool()
-async def get_projects(hub_id: str) -> str:
+async def get_projects(hub_id: str, force_refresh: bool = False) -> str:
     """Get all projects within a specified hub.
     
     Args:
         hub_id: The ID or masked ID of the hub to get projects from
+        force_refresh: Fetch from APS even if a cached response is still fresh
     """
-    token = authenticate()
-    bim360 = BIM360(token)
+    token = await run_blocking(authenticate)
+    bim360 = aps_clients.get(token)
     
     # Check if we need to unmask the hub ID
     if id_masker.is_masked_id(hub_id):
@@ -233,7 +594,7 @@ async def get_projects(hub_id: str) -> str:
     else:
         real_hub_id = hub_id
     
-    data = bim360.get_projects(real_hub_id)
+    data = await aps_call(bim360, "get_projects", real_hub_id, force_refresh=force_refresh)
     
     if not data or "data" not in data:
         return "Unable to fetch projects or no projects found."
@@ -249,16 +610,26 @@ async def get_projects(hub_id: str) -> str:
     return "\n---\n".join(projects)
 
 @mcp.tool()
-async def get_project_files(project_id: str, folder_id: Optional[str] = None, file_type: Optional[str] = None) -> str:
+async def get_project_files(
+    project_id: str,
+    folder_id: Optional[str] = None,
+    file_type: Optional[str] = None,
+    max_depth: Optional[int] = None,
+    max_items: Optional[int] = None,
+    force_refresh: bool = False,
+) -> str:
     """Get all files in a project recursively.
     
     Args:
         project_id: The ID or masked ID of the project
         folder_id: Optional folder ID or masked ID to start from (if not provided, finds "Project Files" folder)
         file_type: Optional filter for file type (e.g., "rvt" for Revit files)
+        max_depth: Optional number of subfolder levels to descend into (0 = no limit)
+        max_items: Optional maximum number of files to return (0 = no limit)
+        force_refresh: List every folder from APS again instead of reusing cached listings and the folder index
     """
-    token = authenticate()
-    bim360 = BIM360(token)
+    token = await run_blocking(authenticate)
+    bim360 = aps_clients.get(token)
     
     # Check if we need to unmask the project ID
     if id_masker.is_masked_id(project_id):
@@ -279,52 +650,18 @@ async def get_project_files(project_id: str, folder_id: Optional[str] = None, fi
         else:
             real_folder_id = folder_id
     
-    # Store all items found
-    all_items = []
-    
-    # Recursive function to process folders
-    def process_folder(folder_id, folder_name=""):
-        # Get folder contents
-        contents = bim360.get_folder_contents(real_project_id, folder_id)
-        
-        if not contents or "data" not in contents:
-            return
-        
-        for item in contents.get("data", []):
-            # If it's a folder, process it recursively
-            if item.get("type") == "folders":
-                folder_attributes = item.get("attributes", {})
-                sub_folder_name = folder_attributes.get("displayName", "Unknown Folder")
-                sub_folder_id = item.get("id")
-                
-                # Register the folder ID mapping
-                id_masker.mask_folder_id(sub_folder_id)
-                
-                # Process the subfolder recursively
-                process_folder(sub_folder_id, sub_folder_name)
-            
-            # If it's a file, check if it matches the filter
-            elif item.get("type") == "items":
-                item_attributes = item.get("attributes", {})
-                item_type = item_attributes.get("fileType", "").lower()
-                
-                # Register the item ID mapping
-                item_id = item.get("id")
-                id_masker.mask_item_id(item_id)
-                
-                # If no file_type filter or it matches, add it to our results
-                if not file_type or (item_type and file_type.lower() in item_type):
-                    all_items.append(item)
-    
     try:
+        # lastModifiedTime of the start folders, where known
+        stamps = {}
+        
         # If a specific folder ID was provided, use it directly
         if real_folder_id:
-            process_folder(real_folder_id)
+            start_folders = [real_folder_id]
             
         # Otherwise, find the "Project Files" folder
         else:
             # Get top folders
-            top_folders = bim360.get_top_folders(hub_id, real_project_id)
+            top_folders = await aps_call(bim360, "get_top_folders", hub_id, real_project_id, force_refresh=force_refresh)
             
             if not top_folders or "data" not in top_folders or not top_folders.get("data"):
                 return "No top folders found in this project."
@@ -337,6 +674,7 @@ async def get_project_files(project_id: str, folder_id: Optional[str] = None, fi
                 
                 # Register folder ID mapping
                 id_masker.mask_folder_id(folder_id)
+                stamps[folder_id] = folder.get("attributes", {}).get("lastModifiedTime")
                 
                 # Check if this is the "Project Files" folder
                 if folder_name == "Project Files":
@@ -345,35 +683,54 @@ async def get_project_files(project_id: str, folder_id: Optional[str] = None, fi
             
             # If "Project Files" folder was found, process it
             if project_files_folder_id:
-                process_folder(project_files_folder_id, "Project Files")
+                start_folders = [project_files_folder_id]
             else:
                 # If no "Project Files" folder, just process all top folders
-                for folder in top_folders.get("data", []):
-                    folder_name = folder.get("attributes", {}).get("displayName", "")
-                    folder_id = folder.get("id")
-                    process_folder(folder_id, folder_name)
+                start_folders = [folder.get("id") for folder in top_folders.get("data", [])]
+                stamps = {folder.get("id"): folder.get("attributes", {}).get("lastModifiedTime") for folder in top_folders.get("data", [])}
+        
+        max_depth = APS_FOLDER_MAX_DEPTH if max_depth is None else max_depth
+        max_items = APS_FOLDER_MAX_ITEMS if max_items is None else max_items
+        if APS_INDEX_ENABLED:
+            # Sync only what changed, then answer from the local index
+            failed = await sync_folder_index_if_due(bim360, real_project_id, start_folders, stamps, force_refresh)
+            all_items, truncated = await run_blocking(
+                folder_index.find_files, real_project_id, start_folders, file_type, max_depth, max_items
+            )
+        else:
+            all_items, truncated = await walk_folders(
+                bim360, real_project_id, start_folders, file_type,
+                max_depth=max_depth, max_items=max_items, force_refresh=force_refresh
+            )
         
         # Return the results
+        stale_msg = ""
+        if APS_INDEX_ENABLED and failed:
+            stale_msg = f"\n\n{failed} folders could not be listed from APS; their contents may be out of date or missing."
         if not all_items:
             filter_msg = f" matching type '{file_type}'" if file_type else ""
-            return f"No files{filter_msg} found in the project."
+            return f"No files{filter_msg} found in the project." + stale_msg
         
         items_formatted = [format_item(item) for item in all_items]
-        return f"Found {len(all_items)} files:\n\n" + "\n---\n".join(items_formatted)
+        result = f"Found {len(all_items)} files:\n\n" + "\n---\n".join(items_formatted)
+        if truncated:
+            result += "\n\nThe listing stopped at the depth or item limit; pass a folder_id to look further."
+        return result + stale_msg
     
     except Exception as e:
         return f"Error accessing project or folder: {str(e)}"
 
 @mcp.tool()
-async def get_versions(project_id: str, item_id: str) -> str:
+async def get_versions(project_id: str, item_id: str, force_refresh: bool = False) -> str:
     """Get version information for a specific item.
     
     Args:
         project_id: The ID or masked ID of the project
         item_id: The ID or masked ID of the item to get versions for
+        force_refresh: Fetch from APS even if a cached response is still fresh
     """
-    token = authenticate()
-    bim360 = BIM360(token)
+    token = await run_blocking(authenticate)
+    bim360 = aps_clients.get(token)
     
     # Check if we need to unmask the project ID
     if id_masker.is_masked_id(project_id):
@@ -389,7 +746,7 @@ async def get_versions(project_id: str, item_id: str) -> str:
         
     try:
         # Get all versions directly using get_item_versions
-        versions_data = bim360.get_item_versions(real_project_id, real_item_id)
+        versions_data = await aps_call(bim360, "get_item_versions", real_project_id, real_item_id, force_refresh=force_refresh)
         
         if not versions_data or "data" not in versions_data or not versions_data["data"]:
             return "No versions available for this item."
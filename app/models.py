@@ -7,7 +7,12 @@ from sqlalchemy import (
     Text,
     DateTime,
     Boolean,
+    Integer,
     ForeignKey,
+    DDL,
+    Index,
+    event,
+    text,
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship, declarative_base
@@ -22,6 +27,14 @@ class User(Base):
     name = Column(String(255), nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # User listing: ORDER BY created_at, id (keyset pages)
+        Index('ix_users_created_at_id', 'created_at', 'id'),
+        # Email prefix filter: LIKE 'prefix%' can only use a pattern_ops btree
+        # under a non-C collation, the unique index on email does not qualify
+        Index('ix_users_email_pattern', 'email', postgresql_ops={'email': 'varchar_pattern_ops'}),
+    )
+
     sent_messages = relationship('Message', back_populates='sender', cascade="all, delete-orphan")
     received_messages = relationship(
         'MessageRecipient',
@@ -33,6 +46,11 @@ class User(Base):
         return f"<User(id={self.id}, email={self.email}, name={self.name})>"
 
 
+# Text searched by the message search on PostgreSQL. 'simple' does no stemming
+# or stop words, which keeps it language-neutral.
+MESSAGE_SEARCH_DOCUMENT = "to_tsvector('simple', coalesce(subject, '') || ' ' || content)"
+
+
 class Message(Base):
     __tablename__ = 'messages'
 
@@ -41,6 +59,27 @@ class Message(Base):
     subject = Column(String(255), nullable=True)
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    # Message this one replies to, and the id of the first message of its conversation
+    # (a new conversation's thread_id is its own id)
+    in_reply_to = Column(UUID(as_uuid=True), ForeignKey('messages.id', ondelete='SET NULL'), nullable=True)
+    thread_id = Column(
+        UUID(as_uuid=True),
+        default=lambda context: context.get_current_parameters()['id'],
+        nullable=False
+    )
+
+    __table_args__ = (
+        # Sent listing: WHERE sender_id = ? ORDER BY timestamp DESC, id DESC (keyset pages)
+        Index('ix_messages_sender_timestamp', 'sender_id', 'timestamp', 'id'),
+        # Thread view: WHERE thread_id = ? ORDER BY timestamp, id
+        Index('ix_messages_thread', 'thread_id', 'timestamp', 'id'),
+        # Full-text search; queries must use MESSAGE_SEARCH_DOCUMENT verbatim to match it
+        Index(
+            'ix_messages_search',
+            text(f"({MESSAGE_SEARCH_DOCUMENT})"),
+            postgresql_using='gin',
+        ).ddl_if(dialect='postgresql'),
+    )
 
     sender = relationship('User', back_populates='sent_messages')
     recipients = relationship('MessageRecipient', back_populates='message', cascade="all, delete-orphan")
@@ -58,9 +97,96 @@ class MessageRecipient(Base):
     read = Column(Boolean, nullable=False, default=False)
     read_at = Column(DateTime(timezone=True), nullable=True)
 
+    __table_args__ = (
+        # Inbox listing; its leading column also serves plain recipient_id lookups
+        Index('ix_message_recipients_recipient_read', 'recipient_id', 'read'),
+        # Unread listing and counts only ever touch the unread rows
+        Index(
+            'ix_message_recipients_unread',
+            'recipient_id',
+            postgresql_where=text('read = false'),
+            sqlite_where=text('read = 0'),
+        ),
+        # markAsRead / message detail lookups, and message_id FK cascades
+        Index('ix_message_recipients_message_recipient', 'message_id', 'recipient_id'),
+    )
+
     message = relationship('Message', back_populates='recipients')
     recipient = relationship('User', back_populates='received_messages')
 
     def __repr__(self):
         return f"<MessageRecipient(id={self.id}, message_id={self.message_id}, recipient_id={self.recipient_id}, read={self.read})>"
 
+
+class FanoutJob(Base):
+    """Recipient rows of a large send, written batch by batch by a background worker."""
+    __tablename__ = 'fanout_jobs'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
+    message_id = Column(UUID(as_uuid=True), ForeignKey('messages.id', ondelete='CASCADE'), nullable=False)
+    # pending -> running -> done, or failed
+    status = Column(String(16), nullable=False, default='pending')
+    # JSON list of recipient user ids, delivered in this order
+    recipient_ids = Column(Text, nullable=False)
+    total = Column(Integer, nullable=False)
+    delivered = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Unfinished jobs picked up again at startup
+        Index('ix_fanout_jobs_status', 'status'),
+        Index('ix_fanout_jobs_message_id', 'message_id'),
+    )
+
+    def __repr__(self):
+        return f"<FanoutJob(id={self.id}, message_id={self.message_id}, status={self.status}, delivered={self.delivered}/{self.total})>"
+
+
+class IdempotencyKey(Base):
+    """Response of a sendMessage call, stored under the client's Idempotency-Key for replays."""
+    __tablename__ = 'idempotency_keys'
+
+    key = Column(String(255), primary_key=True)
+    # sha256 of the request, so a key reused for a different request is refused
+    fingerprint = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Expiry purge: WHERE created_at < ?
+        Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key={self.key}, created_at={self.created_at})>"
+
+
+class UnreadCount(Base):
+    """Unread message count per user, kept in step with message_recipients.read by the service layer."""
+    __tablename__ = 'unread_counts'
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    unread = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<UnreadCount(user_id={self.user_id}, unread={self.unread})>"
+
+
+# SQLite has no tsvector; an FTS5 table indexes the same columns instead,
+# kept in sync by triggers (external content table keyed on the messages rowid,
+# so rebuild it after a VACUUM, which may renumber rowids)
+MESSAGE_SEARCH_SQLITE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(subject, content, content='messages', content_rowid='rowid')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, subject, content) VALUES (new.rowid, new.subject, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, subject, content) VALUES ('delete', old.rowid, old.subject, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, subject, content) VALUES ('delete', old.rowid, old.subject, old.content); "
+    "INSERT INTO messages_fts(rowid, subject, content) VALUES (new.rowid, new.subject, new.content); END",
+]
+
+for statement in MESSAGE_SEARCH_SQLITE:
+    event.listen(Message.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
@@ -0,0 +1,79 @@
+# Fast JSON responses for large listings
+import json
+import os
+import uuid
+
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the json module
+    orjson = None
+
+load_dotenv()
+
+# Return service rows straight from the routes as JSON instead of building
+# Pydantic models that FastAPI then validates a second time
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _default(value):
+    # orjson only encodes exact uuid.UUID, asyncpg hands out a subclass
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return jsonable_encoder(value)
+
+
+def dumps(content):
+    """Encode content to JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, which encodes UUID and datetime natively.
+
+    Returning it from a route skips FastAPI's response_model validation, so only
+    hand it data the service layer produced in the response_model's shape.
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+def fields_of(model, obj):
+    """The fields of a Pydantic model read from a dict or an ORM object, without validation."""
+    if isinstance(obj, dict):
+        return {name: obj.get(name) for name in model.model_fields}
+    return {name: getattr(obj, name) for name in model.model_fields}
+
+
+# Bytes buffered before an NDJSON chunk is sent
+NDJSON_CHUNK_SIZE = 64 * 1024
+
+
+def ndjson_chunks(entries, chunk_size=NDJSON_CHUNK_SIZE):
+    """Encode an iterable of dicts as NDJSON, yielding chunks of about chunk_size bytes."""
+    buffer = bytearray()
+    for entry in entries:
+        buffer += dumps(entry) + b"\n"
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def ndjson_chunks_async(entries, chunk_size=NDJSON_CHUNK_SIZE):
+    """ndjson_chunks for an async iterable."""
+    buffer = bytearray()
+    async for entry in entries:
+        buffer += dumps(entry) + b"\n"
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
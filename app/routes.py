@@ -1,21 +1,67 @@
-from fastapi import APIRouter, HTTPException, Request
-from typing import List
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+import uuid
 
-from app.schemas import UserRead, UserCreate, EmailRequest, MessageCreate, MessageRead, ListMessageResponse, Message, ListInboxResponse, InboxMessage, Recipient, InboxMessageDetailSender, InboxMessageDetailRecipients, markAsRead  # Pydantic schemas
+from app.schemas import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, UserRead, UserCreate, UserImportResponse, normalize_email, EmailRequest, MailboxPageRequest, MessageCreate, MessageRead, FanoutJobAccepted, FanoutJobStatus, ListMessageResponse, Message, ListInboxResponse, InboxMessage, InboxSummaryRequest, InboxMessageSummary, ListInboxSummaryResponse, MessageSearchRequest, MessageSearchResult, ListMessageSearchResponse, ThreadRequest, ThreadMessage, ThreadResponse, ThreadSummary, ListThreadSummaryResponse, Recipient, InboxMessageDetailSender, InboxMessageDetailRecipients, markAsRead, markAsReadBulk, markAsReadBulkResponse, UnreadCountResponse  # Pydantic schemas
 from . import services
+from . import async_services
+from . import db
+from . import fanout
+from .cache import user_cache
+from .responses import FAST_JSON_RESPONSES, FastJSONResponse, fields_of, ndjson_chunks, ndjson_chunks_async
 
 router = APIRouter()
 
+async def run_service(name, *args, **kwargs):
+    """Call a service function on the backend selected by DB_BACKEND.
+
+    The sync backend keeps the blocking services.py functions on the threadpool,
+    the async backend awaits the async_services.py function of the same name.
+    """
+    if db.DB_BACKEND == "async":
+        return await getattr(async_services, name)(*args, **kwargs)
+    return await run_in_threadpool(getattr(services, name), *args, **kwargs)
+
+def list_response(response_model, item_model, items, **fields):
+    """Build a listing response whose rows go under "messages".
+
+    With FAST_JSON_RESPONSES the rows are dumped as they are with FastJSONResponse,
+    so FastAPI does not validate them again against response_model.
+    """
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse({**fields, "messages": [fields_of(item_model, item) for item in items]})
+    return response_model(messages=[item_model.from_orm(item) for item in items], **fields)
+
 @router.get("/users", response_model=List[UserRead])
-def get_users():
-    users_db = services.get_list_users()
-    return [UserRead.from_orm(user) for user in users_db]
+async def get_users(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    email_prefix: Optional[str] = None,
+    include_total: bool = False
+):
+    # The body stays a plain list; paging state travels in headers
+    try:
+        page = await run_service("find_users_page", limit, cursor, email_prefix=email_prefix, include_total=include_total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {}
+    if page["next_cursor"]:
+        headers["X-Next-Cursor"] = page["next_cursor"]
+    if page["total_estimate"] is not None:
+        headers["X-Total-Estimate"] = str(page["total_estimate"])
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse([fields_of(UserRead, user) for user in page["users"]], headers=headers)
+    response.headers.update(headers)
+    return [UserRead.from_orm(user) for user in page["users"]]
 
 @router.post("/users/byEmail", response_model=UserRead)
-def get_user_by_email(request: EmailRequest):
+async def get_user_by_email(request: EmailRequest):
     print(f"Query parameters: {request.email}")
     if request.email:
-        user = services.find_user_by_mail(request.email)
+        user = await run_service("find_user_by_mail", request.email)
         if user:
             return UserRead.from_orm(user)
         else:
@@ -24,97 +70,235 @@ def get_user_by_email(request: EmailRequest):
         raise HTTPException(status_code=400, detail="Email query parameter is required")
 
 @router.post("/users", response_model=UserRead)
-def create_user(user: UserCreate):
+async def create_user(user: UserCreate):
     print(f"Creating user with email: {user.email} and name: {user.name}")
     if not user.email or not user.name:
         raise HTTPException(status_code=400, detail="Email and name are required")
-    find_user = services.find_user_by_mail(user.email)
+    find_user = await run_service("find_user_by_mail", user.email)
     if find_user:
         print(f"User with email {find_user.email} already exists")
         raise HTTPException(status_code=400, detail="User with this email already exists")
     else:
-        new_user = services.create_user(user.email, user.name)
+        new_user = await run_service("create_user", user.email, user.name)
         return UserRead.from_orm(new_user)
 
-@router.post("/message/sendMessage", response_model=MessageRead)
-def send_message(message: MessageCreate):
+IMPORT_FORMATS = {"text/csv": "csv", "application/x-ndjson": "ndjson", "application/jsonl": "ndjson"}
+
+@router.post("/users/import", response_model=UserImportResponse)
+async def import_users(request: Request, format: Optional[str] = None):
+    # format wins over the Content-Type header, e.g. for clients that always send text/plain
+    fmt = format or IMPORT_FORMATS.get(request.headers.get("content-type", "").split(";")[0].strip())
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson, or set format=csv|ndjson")
+    body = (await request.body()).decode("utf-8-sig")
+    try:
+        rows, conflicts = await run_in_threadpool(services.parse_user_import, body, fmt, normalize_email)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    received = len(rows) + len(conflicts)
+    result = await run_service("import_users", rows)
+    if result is None:
+        raise HTTPException(status_code=500, detail="User import failed")
+    conflicts = sorted(conflicts + result["conflicts"], key=lambda conflict: conflict["line"])
+    return UserImportResponse(received=received, created=result["created"], conflicts=conflicts)
+
+def replay_response(stored, fingerprint):
+    """Response stored under an Idempotency-Key, 422 if the key was used for a different request.
+    A fan-out send is replayed as the same 202 FanoutJobAccepted, any other as its MessageRead.
+    """
+    if stored["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    response = stored["response"]
+    if "job_id" in response:
+        return FastJSONResponse(FanoutJobAccepted(**response).model_dump(), status_code=202)
+    return MessageRead(**response)
+
+@router.post("/message/sendMessage", response_model=MessageRead, responses={202: {"model": FanoutJobAccepted}})
+async def send_message(message: MessageCreate, idempotency_key: Optional[str] = Header(None, max_length=255)):
     if not message.sender_email or not message.recipient_email or not message.content:
         raise HTTPException(status_code=400, detail="Sender email, recipient email(s), and content are required")
 
-    sender = services.find_user_by_mail(message.sender_email)
+    idempotency = None
+    if idempotency_key:
+        # A retry is answered from the stored response, without reading users or messages
+        idempotency = (idempotency_key, services.request_fingerprint(message.model_dump(mode="json")))
+        stored = await run_service("find_idempotent_response", idempotency_key)
+        if stored:
+            return replay_response(stored, idempotency[1])
+
+    # Sender and every recipient are resolved with one query
+    resolved = await run_service("find_users_by_mails", [message.sender_email, *message.recipient_email])
+    sender = resolved["users"].get(message.sender_email)
 
     if not sender:
         raise HTTPException(status_code=404, detail="Sender user not found")
 
-    recipients = []
-    for email in message.recipient_email:
-        recipient = services.find_user_by_mail(email)
-        if recipient:
-            recipients.append(recipient)
-        else:
-            raise HTTPException(status_code=404, detail=f"Recipient user with email {email} not found")
+    if resolved["missing"]:
+        # The sender exists, so everything missing is a recipient; report the first in request order
+        raise HTTPException(status_code=404, detail=f"Recipient user with email {resolved['missing'][0]} not found")
+    # A recipient listed twice still gets the message once
+    recipients = [resolved["users"][email] for email in dict.fromkeys(message.recipient_email)]
 
-    new_message = services.create_message(sender, recipients, message.subject, message.content)
+    reply_to = None
+    if message.in_reply_to:
+        reply_to = await run_service("find_reply_thread", message.in_reply_to, sender.id)
+        if not reply_to:
+            raise HTTPException(status_code=404, detail="Message to reply to not found")
+
+    # Large audiences: write the message now, the recipient rows in the background
+    fan_out = fanout.FANOUT_THRESHOLD and len(recipients) >= fanout.FANOUT_THRESHOLD
+    if fan_out:
+        queued = await run_service("create_message_fanout", sender, recipients, message.subject, message.content, reply_to=reply_to, idempotency=idempotency)
+        new_message = queued["message"] if queued else None
+    else:
+        new_message = await run_service("create_message", sender, recipients, message.subject, message.content, reply_to=reply_to, idempotency=idempotency)
+    if new_message is None and idempotency:
+        # A concurrent request with the same key committed first
+        stored = await run_service("find_idempotent_response", idempotency_key)
+        if stored:
+            return replay_response(stored, idempotency[1])
+    if new_message is None:
+        raise HTTPException(status_code=500, detail="Could not send message")
+    if fan_out:
+        fanout.fanout_queue.put(queued["job_id"])
+        return FastJSONResponse(FanoutJobAccepted(**queued).model_dump(), status_code=202)
     # print(f"Message created with ID: {new_message.id}")
     return MessageRead.from_orm(new_message)
 
+@router.get("/message/jobs/{job_id}", response_model=FanoutJobStatus)
+async def get_fanout_job(job_id: uuid.UUID):
+    job = await run_service("find_fanout_job", job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @router.post("/message/byMail", response_model = ListMessageResponse)
-def get_message_by_mail(request: EmailRequest):
+async def get_message_by_mail(request: MailboxPageRequest):
     if not request.email:
         raise HTTPException(status_code=400, detail="Email query parameter is required")
     
     print(f"Query parameters: {request.email}")
-    messages = services.find_message_by_mail(request.email)
-    if messages!=[]:
-        return ListMessageResponse(
-            messages=[Message.from_orm(msg) for msg in messages],
-            sender=request.email
-            )
+    try:
+        page = await run_service("find_message_by_mail_page", request.email, request.limit, request.cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["messages"] != [] or request.cursor:
+        return list_response(ListMessageResponse, Message, page["messages"], sender=request.email, next_cursor=page["next_cursor"])
     else:
         raise HTTPException(status_code=404, detail="Message not found for the given email")
     
-@router.post("/message/inbox", response_model=ListInboxResponse)
-def get_inbox_messages(request: EmailRequest):
+async def get_inbox_page(request: MailboxPageRequest, unread_only):
     if not request.email:
         raise HTTPException(status_code=400, detail="Email query parameter is required")
     
     print(f"Query parameters: {request.email}")
 
-    inbox_messages = services.find_message_inbox(request.email)
-    if inbox_messages != []:
-        return ListInboxResponse(
-            messages=[InboxMessage.from_orm(msg) for msg in inbox_messages],
-            mailUser=request.email
-        )
+    try:
+        page = await run_service("find_message_inbox_page", request.email, request.limit, request.cursor, unread_only=unread_only)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["messages"] != [] or request.cursor:
+        return list_response(ListInboxResponse, InboxMessage, page["messages"], mailUser=request.email, next_cursor=page["next_cursor"])
     else:
         raise HTTPException(status_code=404, detail="No messages found in the inbox for the given email")
+
+@router.post("/message/inbox", response_model=ListInboxResponse)
+async def get_inbox_messages(request: MailboxPageRequest):
+    return await get_inbox_page(request, unread_only=False)
     
 @router.post("/message/inboxUnread", response_model=ListInboxResponse)
-def get_unread_inbox_messages(request: EmailRequest):
-    if not request.email:
-        raise HTTPException(status_code=400, detail="Email query parameter is required")
+async def get_unread_inbox_messages(request: MailboxPageRequest):
+    return await get_inbox_page(request, unread_only=True)
     
-    print(f"Query parameters: {request.email}")
-
-    inbox_messages = services.find_message_inbox_unread(request.email)
-    if inbox_messages != []:
-        return ListInboxResponse(
-            messages=[InboxMessage.from_orm(msg) for msg in inbox_messages],
-            mailUser=request.email
+@router.post("/message/inboxSummary", response_model=ListInboxSummaryResponse)
+async def get_inbox_summary(request: InboxSummaryRequest):
+    # List view: no content, at most preview_length characters of it; the body comes from the detail endpoints
+    try:
+        page = await run_service(
+            "find_message_inbox_summary_page", request.email, request.limit, request.cursor,
+            unread_only=request.unread_only, preview_length=request.preview_length
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["messages"] != [] or request.cursor:
+        return list_response(ListInboxSummaryResponse, InboxMessageSummary, page["messages"], mailUser=request.email, next_cursor=page["next_cursor"])
     else:
         raise HTTPException(status_code=404, detail="No messages found in the inbox for the given email")
-    
+
+@router.post("/message/search", response_model=ListMessageSearchResponse)
+async def search_messages(request: MessageSearchRequest):
+    # Ranked full-text search over the user's sent and received messages; no hits is an empty page
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Search query is required")
+    try:
+        page = await run_service("find_messages_search_page", request.email, request.query, request.limit, request.cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return list_response(
+        ListMessageSearchResponse, MessageSearchResult, page["messages"],
+        mailUser=request.email, query=request.query, next_cursor=page["next_cursor"]
+    )
+
+@router.post("/message/thread", response_model=ThreadResponse)
+async def get_thread(request: ThreadRequest):
+    try:
+        thread_id = uuid.UUID(request.thread_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid thread ID")
+    messages = await run_service("find_thread", request.email, thread_id)
+    if not messages:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse({"mailUser": request.email, "thread_id": thread_id, "messages": messages})
+    return ThreadResponse(mailUser=request.email, thread_id=thread_id, messages=[ThreadMessage.from_orm(m) for m in messages])
+
+@router.post("/message/threads", response_model=ListThreadSummaryResponse)
+async def get_thread_summaries(request: MailboxPageRequest):
+    # Inbox grouped by conversation: latest received message, message and unread counts per thread
+    try:
+        page = await run_service("find_thread_summaries_page", request.email, request.limit, request.cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse({"mailUser": request.email, "threads": page["threads"], "next_cursor": page["next_cursor"]})
+    return ListThreadSummaryResponse(
+        mailUser=request.email, threads=[ThreadSummary.from_orm(t) for t in page["threads"]], next_cursor=page["next_cursor"]
+    )
+
+@router.post("/message/unreadCount", response_model=UnreadCountResponse)
+async def get_unread_count(request: EmailRequest):
+    unread = await run_service("find_unread_count", request.email)
+    if unread is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return UnreadCountResponse(mailUser=request.email, unread=unread)
+
+@router.post("/message/export")
+async def export_mailbox(request: EmailRequest):
+    # One JSON object per line: every sent message with its recipients, then every received message
+    user = await run_service("find_user_by_mail", request.email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if db.DB_BACKEND == "async":
+        chunks = ndjson_chunks_async(async_services.export_mailbox(request.email))
+    else:
+        # Starlette iterates sync generators on the threadpool, one chunk at a time
+        chunks = ndjson_chunks(services.export_mailbox(request.email))
+    headers = {"Content-Disposition": f'attachment; filename="mailbox-{user.id}.ndjson"'}
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
+
 @router.get("/message/senderDetail/{message_id}", response_model=InboxMessageDetailSender)
-def get_message_by_id(message_id: str):
+async def get_message_by_id(message_id: str):
     if not message_id:
         raise HTTPException(status_code=400, detail="Message ID is required")
     
     print(f"Query parameters: {message_id}")
 
-    message = services.find_message_sender_detail(message_id)
+    message = await run_service("find_message_sender_detail", message_id)
 
-    if message:
+    if message and FAST_JSON_RESPONSES:
+        return FastJSONResponse(fields_of(InboxMessageDetailSender, message))
+    elif message:
         # Chuyển từng recipient dict thành đối tượng Recipient
         recipients = [Recipient(**r) for r in message["recipients"]]
 
@@ -134,16 +318,34 @@ def get_message_by_id(message_id: str):
         raise HTTPException(status_code=404, detail="Message not found")
     
 @router.post("/message/markAsRead", response_model=InboxMessageDetailRecipients)
-def mark_message_as_read(markAsRead: markAsRead):
+async def mark_message_as_read(markAsRead: markAsRead):
     print(f"Received markAsRead: {markAsRead}")
     if not markAsRead.message_id or not markAsRead.recipient_id:
         raise HTTPException(status_code=400, detail="Message ID and recipient email are required")
     
     print(f"Marking message {markAsRead.message_id} as read for recipient {markAsRead.recipient_id}")
 
-    updated_message = services.find_message_recipient_detail(message_id=markAsRead.message_id, recipient_id=markAsRead.recipient_id)
+    updated_message = await run_service("find_message_recipient_detail", message_id=markAsRead.message_id, recipient_id=markAsRead.recipient_id)
 
     if updated_message:
         return InboxMessageDetailRecipients.from_orm(updated_message)
     else:
-        raise HTTPException(status_code=404, detail="Message or recipient not found")
\ No newline at end of file
+        raise HTTPException(status_code=404, detail="Message or recipient not found")
+
+@router.post("/message/markAsReadBulk", response_model=markAsReadBulkResponse)
+async def mark_messages_as_read(request: markAsReadBulk):
+    try:
+        marked = await run_service("mark_messages_read", request.recipient_id, message_ids=request.message_ids, before=request.before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if marked is None:
+        raise HTTPException(status_code=500, detail="Could not mark messages as read")
+    return markAsReadBulkResponse(recipient_id=request.recipient_id, updated=len(marked), messages=marked)
+
+@router.get("/metrics/db")
+async def get_db_metrics():
+    return db.pool_metrics()
+
+@router.get("/metrics/cache")
+async def get_cache_metrics():
+    return {"users": user_cache.stats()}
@@ -1,6 +1,6 @@
 # Pydantic models
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, TypeAdapter, ValidationError, model_validator
 from uuid import UUID
 from datetime import datetime
 from typing import List
@@ -24,14 +24,50 @@ class UserUpdate(BaseModel):
     email: EmailStr = None
     name: str = None
 
+_email_adapter = TypeAdapter(EmailStr)
+
+def normalize_email(value):
+    """Validate an email the way EmailStr fields do and return it, raising ValueError otherwise."""
+    try:
+        return _email_adapter.validate_python(value)
+    except ValidationError as e:
+        raise ValueError(e.errors()[0]["msg"])
+
+class UserImportConflict(BaseModel):
+    line: int
+    email: Optional[str] = None
+    reason: str
+
+class UserImportResponse(BaseModel):
+    received: int
+    created: int
+    conflicts: List[UserImportConflict] = []
+
 class EmailRequest(BaseModel):
     email: EmailStr
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+class MailboxPageRequest(EmailRequest):
+    limit: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None  # next_cursor from the previous page
+
+MAX_PREVIEW_LENGTH = 1000
+
+class InboxSummaryRequest(MailboxPageRequest):
+    unread_only: bool = False
+    preview_length: int = Field(0, ge=0, le=MAX_PREVIEW_LENGTH)  # 0 leaves the preview out
+
+class MessageSearchRequest(MailboxPageRequest):
+    query: str = Field(..., min_length=1, max_length=200)
+
 class MessageCreate(BaseModel):
     sender_email: EmailStr
     recipient_email: List[EmailStr]
     subject: str
     content: str
+    in_reply_to: Optional[UUID] = None  # id of a message in the sender's mailbox
 
     class Config:
         from_attributes = True
@@ -50,6 +86,7 @@ class Message(BaseModel):
 class ListMessageResponse(BaseModel):
     sender: EmailStr
     messages: List[Message]
+    next_cursor: Optional[str] = None
 
 
 class MessageRead(BaseModel):
@@ -59,11 +96,66 @@ class MessageRead(BaseModel):
     content: str
     timestamp: datetime
     recipients: List[EmailStr] = []
+    in_reply_to: Optional[UUID] = None
+    thread_id: Optional[UUID] = None
 
     class Config:
         from_attributes = True
         orm_mode = True  # Enable ORM mode for compatibility with SQLAlchemy models
 
+class FanoutJobAccepted(BaseModel):
+    job_id: UUID
+    status: str
+    message: MessageRead
+
+class FanoutJobStatus(BaseModel):
+    job_id: UUID
+    message_id: UUID
+    status: str
+    total: int
+    delivered: int
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class ThreadRequest(EmailRequest):
+    thread_id: str
+
+class ThreadMessage(BaseModel):
+    id: UUID
+    sender: EmailStr
+    subject: Optional[str] = None
+    content: str
+    timestamp: datetime
+    in_reply_to: Optional[UUID] = None
+    read: Optional[bool] = None  # None for messages the user sent
+    read_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ThreadResponse(BaseModel):
+    mailUser: EmailStr
+    thread_id: UUID
+    messages: List[ThreadMessage]
+
+class ThreadSummary(BaseModel):
+    thread_id: UUID
+    last_message_id: UUID
+    sender: EmailStr
+    subject: Optional[str] = None
+    timestamp: datetime
+    messages: int
+    unread: int
+
+    class Config:
+        from_attributes = True
+
+class ListThreadSummaryResponse(BaseModel):
+    mailUser: EmailStr
+    threads: List[ThreadSummary]
+    next_cursor: Optional[str] = None
+
 class InboxMessage(BaseModel):
     id: UUID
     sender: EmailStr
@@ -80,11 +172,49 @@ class InboxMessage(BaseModel):
 class ListInboxResponse(BaseModel):
     mailUser: EmailStr
     messages: List[InboxMessage]
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
         orm_mode = True  # Enable ORM mode for compatibility with SQLAlchemy models
 
+class InboxMessageSummary(BaseModel):
+    id: UUID
+    sender: EmailStr
+    subject: str
+    preview: Optional[str] = None
+    timestamp: datetime
+    read: bool = False
+    read_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ListInboxSummaryResponse(BaseModel):
+    mailUser: EmailStr
+    messages: List[InboxMessageSummary]
+    next_cursor: Optional[str] = None
+
+class MessageSearchResult(BaseModel):
+    id: UUID
+    sender: EmailStr
+    subject: Optional[str] = None
+    timestamp: datetime
+    rank: float
+
+    class Config:
+        from_attributes = True
+
+class ListMessageSearchResponse(BaseModel):
+    mailUser: EmailStr
+    query: str
+    messages: List[MessageSearchResult]
+    next_cursor: Optional[str] = None
+
+class UnreadCountResponse(BaseModel):
+    mailUser: EmailStr
+    unread: int
+
 class Recipient(BaseModel):
     recipient_email: EmailStr
     recipient_name: str
@@ -111,6 +241,28 @@ class markAsRead(BaseModel):
     message_id: str
     recipient_id: str
 
+MAX_BULK_READ = 1000
+
+class markAsReadBulk(BaseModel):
+    recipient_id: str
+    message_ids: Optional[List[str]] = Field(None, max_length=MAX_BULK_READ)
+    before: Optional[datetime] = None  # mark everything received before this time
+
+    @model_validator(mode="after")
+    def check_selection(self):
+        if (self.message_ids is None) == (self.before is None):
+            raise ValueError("Provide either message_ids or before")
+        return self
+
+class MarkedRead(BaseModel):
+    message_id: UUID
+    read_at: datetime
+
+class markAsReadBulkResponse(BaseModel):
+    recipient_id: UUID
+    updated: int
+    messages: List[MarkedRead] = []
+
 class InboxMessageDetailRecipients(BaseModel):
     id: UUID
     sender: EmailStr
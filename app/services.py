@@ -1,19 +1,36 @@
-from datetime import datetime
+import base64
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from itertools import groupby
+from sqlalchemy import Double, case, cast, delete, exists, func, insert, literal_column, or_, select, table, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from . import models  # Assuming your User model is in models.py
 from . import db
+from .cache import IDEMPOTENCY_TTL, idempotency_cache, user_cache
 import uuid
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+# Rows fetched per round trip by the streaming mailbox export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Largest file accepted by the bulk user import
+USER_IMPORT_MAX_ROWS = int(os.getenv("USER_IMPORT_MAX_ROWS", "100000"))
+# Rows per multi-row INSERT when COPY is not available
+USER_IMPORT_BATCH_SIZE = 1000
+# Recipient rows written per transaction by a fan-out job
+FANOUT_BATCH_SIZE = int(os.getenv("FANOUT_BATCH_SIZE", "1000"))
 
-SessionLocal = db.connect_to_postgresql(user='postgres', password='postgres', host=os.getenv("HOST"), port=5432, database = 'postgres').get('SessionLocal')
-engine = db.connect_to_postgresql(user='postgres', password='postgres', host=os.getenv('HOST'), port=5432, database = 'postgres').get('engine')
-
-# Create tables if they don't exist
-models.Base.metadata.create_all(bind=engine)
+# Process-wide session factory from the db registry (one pool per DSN).
+# Tables are created once at startup, see db.bootstrap_schema.
+SessionLocal = db.SessionLocal
 
 def get_list_users():
     """
@@ -21,7 +38,6 @@ def get_list_users():
 
     :return: List of User objects or an empty list if no users found
     """
-    models.Base.metadata.create_all(bind=engine)
     session = SessionLocal()
     try:
         users = session.query(models.User).all()
@@ -32,26 +48,102 @@ def get_list_users():
     finally:
         session.close()
         
-def create_user(email, name, created_at = datetime.utcnow()):
+def escape_like(value):
+    """Escape LIKE wildcards so value only matches literally (use with escape="\\")."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def email_prefix_clause(email_prefix):
+    """WHERE clause matching emails that start with email_prefix (case-sensitive)."""
+    return models.User.email.like(escape_like(email_prefix) + "%", escape="\\")
+
+def users_query(limit=None, after=None, email_prefix=None):
+    """Build the keyset-paginated user listing, oldest first.
+    :param limit: Maximum number of rows
+    :param after: (created_at, id) position to continue after
+    :param email_prefix: Only users whose email starts with this (case-sensitive)
+    :return: Select statement yielding User objects
+    """
+    query = select(models.User)
+    if email_prefix:
+        query = query.where(email_prefix_clause(email_prefix))
+    if after:
+        query = query.where(tuple_(models.User.created_at, models.User.id) > after)
+    query = query.order_by(models.User.created_at, models.User.id)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def reltuples_estimate(value):
+    # reltuples is -1 until the table is first vacuumed or analyzed
+    return int(value) if value is not None and value >= 0 else None
+
+def plan_rows_estimate(plan):
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def users_estimate_query(session, email_prefix=None):
+    """Statement estimating how many users users_query would list, without COUNT(*).
+    PostgreSQL reads the planner statistics: pg_class.reltuples for the whole table, the
+    planned row count of an EXPLAIN for a prefix. Other databases fall back to COUNT(*).
+    :return: (statement, function turning its scalar result into an int or None)
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        query = select(func.count()).select_from(models.User)
+        if email_prefix:
+            query = query.where(email_prefix_clause(email_prefix))
+        return query, int
+    if not email_prefix:
+        return text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass"), reltuples_estimate
+    statement = text("EXPLAIN (FORMAT JSON) SELECT 1 FROM users WHERE email LIKE :pattern ESCAPE '\\'")
+    return statement.bindparams(pattern=escape_like(email_prefix) + "%"), plan_rows_estimate
+
+def find_users_page(limit, cursor=None, email_prefix=None, include_total=False):
+    """Retrieve one page of users, oldest first.
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :param email_prefix: Only users whose email starts with this
+    :param include_total: Also return an estimate of the number of matching users
+    :return: dict with "users", "next_cursor" (None on the last page) and "total_estimate"
+        (None unless requested and available)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    session = SessionLocal()
+    try:
+        users = session.execute(users_query(limit + 1, after, email_prefix)).scalars().all()
+        page = page_of(users, limit, lambda user: (user.created_at, user.id), key="users")
+        page["total_estimate"] = None
+        if include_total:
+            statement, convert = users_estimate_query(session, email_prefix)
+            page["total_estimate"] = convert(session.execute(statement).scalar())
+        return page
+    except Exception as e:
+        print(f"Error retrieving users: {e}")
+        return {"users": [], "next_cursor": None, "total_estimate": None}
+    finally:
+        session.close()
+
+def create_user(email, name, created_at=None):
     """
     Create a new user in the users table.
 
     :param email: Email of the user (must be unique)
     :param name: Name of the user
+    :param created_at: Creation time, defaults to now
     :return: UUID of the newly created user or None if an error occurred
     """
-    models.Base.metadata.create_all(bind=engine)
     session = SessionLocal()
     try:
         new_user = models.User(
             id=uuid.uuid4(),  # Generate a new UUID for the user
             email=email,
             name=name,
-            created_at = created_at
+            created_at=created_at or datetime.utcnow()
         )
         session.add(new_user)
         session.commit()
         session.refresh(new_user)  # Refresh to get the updated user object with ID
+        user_cache.invalidate(user_id=new_user.id, email=new_user.email)
         print(f"User  created with id: {new_user.id}")
         return new_user
     except IntegrityError:
@@ -72,10 +164,13 @@ def find_user_by_mail(email):
     :param email: Email of the user to find
     :return: User object if found, None otherwise
     """
-    models.Base.metadata.create_all(bind=engine)
+    cached = user_cache.get_by_email(email)
+    if cached is not None:
+        return cached
     session = SessionLocal()
     try:
         user = session.query(models.User).filter(models.User.email == email).first()
+        user_cache.put(user)
         return user
     except Exception as e:
         print(f"Error finding user by email: {e}")
@@ -83,6 +178,47 @@ def find_user_by_mail(email):
     finally:
         session.close()
 
+def find_users_by_mails(emails):
+    """
+    Resolve many email addresses to users with a single query.
+
+    :param emails: Iterable of email addresses (duplicates allowed)
+    :return: dict with "users" (email -> User) and "missing" (emails without a user, in input order)
+    """
+    emails = list(dict.fromkeys(emails))
+    users, uncached = cached_users(emails)
+    if uncached:
+        session = SessionLocal()
+        try:
+            found = session.execute(select(models.User).where(models.User.email.in_(uncached))).scalars().all()
+            for user in found:
+                user_cache.put(user)
+            users.extend(found)
+        except Exception as e:
+            print(f"Error finding users by email: {e}")
+        finally:
+            session.close()
+    return resolved_users(emails, users)
+
+def cached_users(emails):
+    """Split emails into users already in the user cache and emails still to query."""
+    users, uncached = [], []
+    for email in emails:
+        user = user_cache.get_by_email(email)
+        if user is None:
+            uncached.append(email)
+        else:
+            users.append(user)
+    return users, uncached
+
+def resolved_users(emails, users):
+    """Shape the result of find_users_by_mails."""
+    by_email = {user.email: user for user in users}
+    return {
+        "users": by_email,
+        "missing": [email for email in emails if email not in by_email]
+    }
+
 def update_user(user_id, email=None, name=None):
     """
     Update an existing user in the users table.
@@ -92,7 +228,6 @@ def update_user(user_id, email=None, name=None):
     :param name: New name for the user (optional)
     :return: Updated User object or None if an error occurred
     """
-    models.Base.metadata.create_all(bind=engine)
     session = SessionLocal()
     try:
         user = session.query(models.User).filter(models.User.id == user_id).first()
@@ -100,12 +235,17 @@ def update_user(user_id, email=None, name=None):
             print("User not found")
             return None
         
+        # The id record may already be evicted, so the old email key is dropped by name
+        old_email = user.email
         if email:
             user.email = email
         if name:
             user.name = name
         
         session.commit()
+        user_cache.invalidate(user_id=user_id, email=old_email)
+        if email:
+            user_cache.invalidate(email=email)
         return user
     except Exception as e:
         session.rollback()
@@ -114,58 +254,453 @@ def update_user(user_id, email=None, name=None):
     finally:
         session.close()
 
-def create_message(sender, recipients, subject, content):
+def parse_user_import(body, fmt, validate_email):
+    """Parse a bulk user import file into rows to insert and per-line rejections.
+    CSV needs an "email,name" header, NDJSON one {"email": ..., "name": ...} object per line.
+    Line numbers count the CSV header, so they match what an editor shows.
+    :param body: File content as text
+    :param fmt: "csv" or "ndjson"
+    :param validate_email: Callable returning the normalised email or raising ValueError
+    :return: (rows, conflicts), rows are {"line", "email", "name"} dicts,
+        conflicts are {"line", "email", "reason"} dicts
+    :raises ValueError: on an unknown format, a missing CSV header or too many rows
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(body))
+        if not reader.fieldnames or not {"email", "name"} <= set(reader.fieldnames):
+            raise ValueError("CSV header must contain email and name")
+        records = ((reader.line_num, record) for record in reader)
+    elif fmt == "ndjson":
+        records = ((number, line) for number, line in enumerate(body.splitlines(), start=1) if line.strip())
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    rows, conflicts, seen = [], [], set()
+    for line, record in records:
+        if len(rows) + len(conflicts) >= USER_IMPORT_MAX_ROWS:
+            raise ValueError(f"Import is limited to {USER_IMPORT_MAX_ROWS} rows")
+        try:
+            if fmt == "ndjson":
+                record = json.loads(record)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+            email = str(record.get("email") or "").strip()
+            name = str(record.get("name") or "").strip()
+            if not email or not name:
+                raise ValueError("email and name are required")
+            email = validate_email(email)
+        except ValueError as e:
+            email = record.get("email") if isinstance(record, dict) else None
+            conflicts.append({"line": line, "email": email, "reason": f"invalid: {e}"})
+            continue
+        if email in seen:
+            conflicts.append({"line": line, "email": email, "reason": "duplicate in file"})
+            continue
+        seen.add(email)
+        rows.append({"line": line, "email": email, "name": name})
+    return rows, conflicts
+
+def user_import_records(rows):
+    """users table values for parsed import rows, all stamped with the same created_at."""
+    created_at = datetime.utcnow()
+    return [{"id": uuid.uuid4(), "email": row["email"], "name": row["name"], "created_at": created_at} for row in rows]
+
+def user_import_batches(session, records):
+    """Multi-row INSERT ... ON CONFLICT (email) DO NOTHING RETURNING email statements, one per batch."""
+    table = models.User.__table__
+    for start in range(0, len(records), USER_IMPORT_BATCH_SIZE):
+        statement = upsert_insert(session, table).values(records[start:start + USER_IMPORT_BATCH_SIZE])
+        yield statement.on_conflict_do_nothing(index_elements=[table.c.email]).returning(table.c.email)
+
+# Staging table for COPY, dropped when the import transaction ends
+USER_IMPORT_STAGING = text("CREATE TEMP TABLE user_import (LIKE users INCLUDING DEFAULTS) ON COMMIT DROP")
+USER_IMPORT_FROM_STAGING = text(
+    "INSERT INTO users (id, email, name, created_at) "
+    "SELECT id, email, name, created_at FROM user_import "
+    "ON CONFLICT (email) DO NOTHING RETURNING email"
+)
+
+def user_import_report(rows, created):
+    """Import result: rows whose email was not inserted already existed."""
+    created = set(created)
+    return {
+        "created": len(created),
+        "conflicts": [
+            {"line": row["line"], "email": row["email"], "reason": "already exists"}
+            for row in rows if row["email"] not in created
+        ]
+    }
+
+def import_users(rows):
+    """Insert many users in one transaction, skipping emails that already exist.
+    On PostgreSQL (psycopg2) the rows are COPYed into a temporary table and moved over with a single
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING; elsewhere multi-row INSERT ... ON CONFLICT DO NOTHING
+    statements are used.
+    :param rows: Rows from parse_user_import
+    :return: dict with "created" (count) and "conflicts" (rows that already existed), None on error
+    """
+    if not rows:
+        return {"created": 0, "conflicts": []}
+    records = user_import_records(rows)
+    session = SessionLocal()
+    try:
+        if session.get_bind().dialect.driver == "psycopg2":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for record in records:
+                writer.writerow([record["id"], record["email"], record["name"], record["created_at"].isoformat()])
+            buffer.seek(0)
+            session.execute(USER_IMPORT_STAGING)
+            with session.connection().connection.cursor() as cursor:
+                cursor.copy_expert("COPY user_import (id, email, name, created_at) FROM STDIN WITH (FORMAT csv)", buffer)
+            created = session.execute(USER_IMPORT_FROM_STAGING).scalars().all()
+        else:
+            created = []
+            for statement in user_import_batches(session, records):
+                created.extend(session.execute(statement).scalars().all())
+        session.commit()
+        print(f"Imported {len(created)} users")
+        return user_import_report(rows, created)
+    except Exception as e:
+        session.rollback()
+        print(f"Error importing users: {e}")
+        return None
+    finally:
+        session.close()
+
+def message_rows(sender, recipients, subject, content, reply_to=None):
+    """Build the messages row and its message_recipients rows for one send.
+    :param reply_to: (message id, thread id) of the message replied to, None to start a thread
+    :return: (message values dict, list of recipient values dicts)
+    """
+    message_id = uuid.uuid4()
+    in_reply_to, thread_id = reply_to or (None, message_id)
+    message = {
+        "id": message_id,
+        "sender_id": sender.id,
+        "subject": subject,
+        "content": content,
+        "timestamp": datetime.utcnow(),
+        "in_reply_to": in_reply_to,
+        "thread_id": thread_id
+    }
+    recipient_rows = [{
+        "id": uuid.uuid4(),
+        "message_id": message["id"],
+        "recipient_id": recipient.id,
+        "read": False
+    } for recipient in recipients]
+    return message, recipient_rows
+
+def created_message(message, sender, recipients):
+    """Response dict for a message written by create_message."""
+    return {
+        "id": message["id"],
+        "sender": sender.email,
+        "subject": message["subject"],
+        "content": message["content"],
+        "timestamp": message["timestamp"],
+        "recipients": [recipient.email for recipient in recipients],
+        "in_reply_to": message["in_reply_to"],
+        "thread_id": message["thread_id"]
+    }
+
+def upsert_insert(session, table):
+    """INSERT construct with ON CONFLICT support for the database behind session."""
+    if session.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+def unread_increment(session, recipient_rows):
+    """Statement and parameters adding new recipient rows to the unread counters.
+    Rows are sorted by user so concurrent sends lock counters in the same order.
+    """
+    table = models.UnreadCount.__table__
+    per_user = Counter(row["recipient_id"] for row in recipient_rows)
+    params = [{"user_id": user_id, "unread": count} for user_id, count in sorted(per_user.items(), key=lambda item: str(item[0]))]
+    statement = upsert_insert(session, table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={"unread": table.c.unread + statement.excluded.unread}
+    )
+    return statement, params
+
+def unread_decrement(user_id, count):
+    """Statement taking count newly read messages off a user's unread counter, never below zero."""
+    return update(models.UnreadCount).where(models.UnreadCount.user_id == user_id).values(
+        unread=case((models.UnreadCount.unread > count, models.UnreadCount.unread - count), else_=0)
+    )
+
+def mark_read_statement(message_recipient_id):
+    """Flip one message_recipients row to read; matches nothing if it already was."""
+    return update(models.MessageRecipient).where(
+        models.MessageRecipient.id == message_recipient_id,
+        models.MessageRecipient.read == False
+    ).values(read=True, read_at=datetime.utcnow())
+
+def mark_read_bulk_statement(recipient_id, message_ids=None, before=None):
+    """Flip a recipient's unread rows to read in one UPDATE ... RETURNING.
+    Rows are picked by message id, or by message timestamp strictly before a point in time.
+    """
+    statement = update(models.MessageRecipient).where(
+        models.MessageRecipient.recipient_id == recipient_id,
+        models.MessageRecipient.read == False
+    )
+    if message_ids is not None:
+        statement = statement.where(models.MessageRecipient.message_id.in_(message_ids))
+    else:
+        statement = statement.where(models.MessageRecipient.message_id.in_(
+            select(models.Message.id).where(models.Message.timestamp < before)
+        ))
+    return statement.values(read=True, read_at=datetime.utcnow()).returning(
+        models.MessageRecipient.message_id, models.MessageRecipient.read_at
+    ).execution_options(synchronize_session=False)
+
+def bulk_read_args(recipient_id, message_ids=None, before=None):
+    """Validate and normalise the arguments of mark_messages_read.
+    :raises ValueError: on a malformed id or when not exactly one of message_ids/before is given
+    """
+    if (message_ids is None) == (before is None):
+        raise ValueError("Provide either message_ids or before")
+    recipient_id = recipient_id if isinstance(recipient_id, uuid.UUID) else uuid.UUID(str(recipient_id))
+    if message_ids is not None:
+        message_ids = [value if isinstance(value, uuid.UUID) else uuid.UUID(str(value)) for value in message_ids]
+    return recipient_id, message_ids
+
+def request_fingerprint(*parts):
+    """sha256 over the parts of a request, to tell a retry from a different request under the same key."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+def idempotency_record(key, fingerprint, response):
+    """idempotency_keys values storing a create_message response dict."""
+    payload = json.dumps(response, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+    return {"key": key, "fingerprint": fingerprint, "response": payload, "created_at": datetime.utcnow()}
+
+def idempotency_entry(record):
+    """Cache/lookup form of an idempotency_keys row: {"fingerprint", "response" (dict)}."""
+    return {"fingerprint": record["fingerprint"], "response": json.loads(record["response"])}
+
+def idempotency_cutoff():
+    """created_at before which an idempotency key has expired."""
+    return datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL)
+
+def idempotency_ttl_left(created_at):
+    """Seconds until an idempotency key created at created_at expires, so a cached copy never outlives the row."""
+    if created_at.tzinfo is not None:
+        # PostgreSQL hands timestamptz back aware, keys are written as naive UTC
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return (created_at - idempotency_cutoff()).total_seconds()
+
+def idempotency_query(key):
+    """Statement loading an unexpired idempotency_keys row."""
+    return select(
+        models.IdempotencyKey.fingerprint, models.IdempotencyKey.response, models.IdempotencyKey.created_at
+    ).where(models.IdempotencyKey.key == key, models.IdempotencyKey.created_at >= idempotency_cutoff())
+
+def expired_idempotency_key(key):
+    """Statement deleting the row of an expired key that purge_idempotency_keys has not removed yet,
+    so the key can be used again."""
+    return delete(models.IdempotencyKey).where(
+        models.IdempotencyKey.key == key, models.IdempotencyKey.created_at < idempotency_cutoff()
+    )
+
+def find_idempotent_response(key):
+    """Look up the stored sendMessage response for an Idempotency-Key, in-process cache first.
+    :param key: Idempotency-Key header value
+    :return: dict with "fingerprint" and "response" (message dict as JSON types), None if unknown or expired
+    """
+    entry = idempotency_cache.get(key)
+    if entry is not None:
+        return entry
+    session = SessionLocal()
+    try:
+        row = session.execute(idempotency_query(key)).first()
+        if row is None:
+            return None
+        entry = idempotency_entry(row._mapping)
+        idempotency_cache.set(key, entry, ttl=idempotency_ttl_left(row.created_at))
+        return entry
+    except Exception as e:
+        print(f"Error finding idempotency key: {e}")
+        return None
+    finally:
+        session.close()
+
+def purge_idempotency_keys():
+    """Delete idempotency keys older than IDEMPOTENCY_TTL.
+    :return: Number of deleted keys
+    """
+    session = SessionLocal()
+    try:
+        result = session.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.created_at < idempotency_cutoff()))
+        session.commit()
+        return result.rowcount
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def in_mailbox_clause(user_id):
+    """WHERE clause for messages the user sent or received."""
+    return or_(
+        models.Message.sender_id == user_id,
+        exists().where(
+            models.MessageRecipient.message_id == models.Message.id,
+            models.MessageRecipient.recipient_id == user_id
+        )
+    )
+
+def find_reply_thread(message_id, user_id):
+    """Look up the thread a reply joins; users can only reply to messages in their own mailbox.
+    :param message_id: UUID of the message replied to
+    :param user_id: UUID of the user replying
+    :return: (message id, thread id) to pass to create_message as reply_to, None if not found
+    """
+    session = SessionLocal()
+    try:
+        thread_id = session.execute(
+            select(models.Message.thread_id).where(models.Message.id == message_id, in_mailbox_clause(user_id))
+        ).scalar()
+        return (message_id, thread_id) if thread_id else None
+    except Exception as e:
+        print(f"Error finding reply thread: {e}")
+        return None
+    finally:
+        session.close()
+
+def create_message(sender, recipients, subject, content, reply_to=None, idempotency=None):
     """Create a new message and associate it with the sender and recipients.
+    The message, every message_recipients row and the recipients' unread counters are
+    written in one transaction; the recipient rows go out as a single executemany
+    (batched multi-row INSERT).
     :param sender: User object representing the sender
     :param recipients: List of User objects representing the recipients
     :param subject: Subject of the message
     :param content: Content of the message
-    :return: Message object if created successfully, None otherwise
+    :param reply_to: (message id, thread id) from find_reply_thread, None to start a thread
+    :param idempotency: (Idempotency-Key, request fingerprint) to store the response under, in the
+        same transaction; a key taken by a concurrent request makes the whole send fail
+    :return: Message dict if created successfully, None otherwise
     """
-    """Create a new message and associate it with the sender and recipients.
+    message, recipient_rows = message_rows(sender, recipients, subject, content, reply_to)
+    response = created_message(message, sender, recipients)
+    record = idempotency_record(*idempotency, response) if idempotency else None
+    session = SessionLocal()
+    try:
+        if record:
+            # First, so a concurrent retry blocks on the key and then fails before writing anything
+            session.execute(expired_idempotency_key(record["key"]))
+            session.execute(insert(models.IdempotencyKey).values(**record))
+        session.execute(insert(models.Message).values(**message))
+        if recipient_rows:
+            session.execute(insert(models.MessageRecipient), recipient_rows)
+            session.execute(*unread_increment(session, recipient_rows))
+        session.commit()
+        if record:
+            idempotency_cache.set(record["key"], idempotency_entry(record), ttl=idempotency_ttl_left(record["created_at"]))
+        return response
+
+    except IntegrityError:
+        session.rollback()
+        print("Error: A message with this ID or idempotency key already exists.")
+        return None
+
+    except Exception as e:
+        session.rollback()
+        print(f"Error creating message: {e}")
+        return None
+    finally:
+        session.close()
+
+def fanout_job_record(message_id, recipients):
+    """fanout_jobs values delivering a message to recipients, in order."""
+    now = datetime.utcnow()
+    return {
+        "id": uuid.uuid4(),
+        "message_id": message_id,
+        "status": "pending",
+        "recipient_ids": json.dumps([str(recipient.id) for recipient in recipients]),
+        "total": len(recipients),
+        "delivered": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+
+def fanout_batch(job, batch_size):
+    """Next message_recipients rows of a fan-out job and the job's progress once they are written.
+    :return: (list of recipient values dicts, fanout_jobs values dict)
+    """
+    recipient_ids = json.loads(job.recipient_ids)[job.delivered:job.delivered + batch_size]
+    rows = [{
+        "id": uuid.uuid4(),
+        "message_id": job.message_id,
+        "recipient_id": uuid.UUID(recipient_id),
+        "read": False
+    } for recipient_id in recipient_ids]
+    delivered = job.delivered + len(rows)
+    progress = {"delivered": delivered, "status": "done" if delivered >= job.total else "running", "updated_at": datetime.utcnow()}
+    return rows, progress
+
+def fanout_job_entry(job):
+    """Status dict of a fan-out job (everything but the recipient list)."""
+    return {
+        "job_id": job.id,
+        "message_id": job.message_id,
+        "status": job.status,
+        "total": job.total,
+        "delivered": job.delivered,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at
+    }
+
+def locked_fanout_job(job_id):
+    """Statement loading a fan-out job with a row lock, so two workers never deliver the same batch."""
+    return select(models.FanoutJob).where(models.FanoutJob.id == job_id).with_for_update()
+
+def fanout_failed(job_id, error):
+    """Statement marking a fan-out job as failed."""
+    return update(models.FanoutJob).where(models.FanoutJob.id == job_id).values(
+        status="failed", error=str(error), updated_at=datetime.utcnow()
+    )
+
+def pending_fanout_query():
+    """Statement listing the ids of unfinished fan-out jobs, oldest first."""
+    return select(models.FanoutJob.id).where(models.FanoutJob.status.in_(("pending", "running"))).order_by(models.FanoutJob.created_at)
+
+def create_message_fanout(sender, recipients, subject, content, reply_to=None, idempotency=None):
+    """Create a message and a fan-out job for its recipient rows instead of writing them now.
+    The message, the job (and the idempotency key) are written in one transaction; the
+    recipients see the message once run_fanout_job has delivered their batch.
     :param sender: User object representing the sender
     :param recipients: List of User objects representing the recipients
     :param subject: Subject of the message
     :param content: Content of the message
-    :return: Message object if created successfully, None otherwise
+    :param reply_to: (message id, thread id) from find_reply_thread, None to start a thread
+    :param idempotency: (Idempotency-Key, request fingerprint) to store the accepted response under
+    :return: dict with "message" (as create_message returns it), "job_id" and "status", None otherwise
     """
-    models.Base.metadata.create_all(bind=engine)
+    message, _ = message_rows(sender, [], subject, content, reply_to)
+    job = fanout_job_record(message["id"], recipients)
+    accepted = {"job_id": job["id"], "status": job["status"], "message": created_message(message, sender, recipients)}
+    # A retry gets the same 202 back, job_id included
+    record = idempotency_record(*idempotency, accepted) if idempotency else None
     session = SessionLocal()
     try:
-        new_message = models.Message(
-            id=uuid.uuid4(),
-            sender_id=sender.id,
-            subject=subject,
-            content=content,
-            timestamp=datetime.utcnow()
-        )
-        session.add(new_message)
+        if record:
+            session.execute(expired_idempotency_key(record["key"]))
+            session.execute(insert(models.IdempotencyKey).values(**record))
+        session.execute(insert(models.Message).values(**message))
+        session.execute(insert(models.FanoutJob).values(**job))
         session.commit()
-
-        # Add recipients
-        for recipient in recipients:
-            message_recipient = models.MessageRecipient(
-                id=uuid.uuid4(),
-                message_id=new_message.id,
-                recipient_id=recipient.id
-            )
-            session.add(message_recipient)
-
-        session.commit()
-
-        session.refresh(new_message)
-        return {
-            "id": new_message.id,
-            "sender": sender.email,
-            "subject": new_message.subject,
-            "content": new_message.content,
-            "timestamp": new_message.timestamp,
-            "recipients": [recipient.email for recipient in recipients]
-        }
+        if record:
+            idempotency_cache.set(record["key"], idempotency_entry(record), ttl=idempotency_ttl_left(record["created_at"]))
+        return accepted
 
     except IntegrityError:
         session.rollback()
-        print("Error: A message with this ID already exists.")
+        print("Error: A message with this ID or idempotency key already exists.")
         return None
 
     except Exception as e:
@@ -175,6 +710,77 @@ def create_message(sender, recipients, subject, content):
     finally:
         session.close()
 
+def deliver_fanout_batch(job_id, batch_size=None):
+    """Write the next batch of a fan-out job's recipient rows and unread counters, with its progress.
+    :param job_id: ID of the fan-out job
+    :param batch_size: Recipients per transaction, defaults to FANOUT_BATCH_SIZE
+    :return: Number of recipients delivered, 0 once the job is finished
+    """
+    session = SessionLocal()
+    try:
+        job = session.execute(locked_fanout_job(job_id)).scalars().first()
+        if job is None or job.status in ("done", "failed"):
+            session.rollback()
+            return 0
+        rows, progress = fanout_batch(job, batch_size or FANOUT_BATCH_SIZE)
+        if rows:
+            session.execute(insert(models.MessageRecipient), rows)
+            session.execute(*unread_increment(session, rows))
+        session.execute(update(models.FanoutJob).where(models.FanoutJob.id == job_id).values(**progress))
+        session.commit()
+        return len(rows)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def run_fanout_job(job_id, batch_size=None):
+    """Deliver a fan-out job batch by batch until every recipient has the message.
+    Progress is committed with each batch, so a job interrupted by a restart resumes where it stopped.
+    :param job_id: ID of the fan-out job
+    :param batch_size: Recipients per transaction, defaults to FANOUT_BATCH_SIZE
+    :return: Status dict of the job, None if it does not exist
+    """
+    try:
+        while deliver_fanout_batch(job_id, batch_size):
+            pass
+    except Exception as e:
+        print(f"Error delivering fan-out job {job_id}: {e}")
+        session = SessionLocal()
+        try:
+            session.execute(fanout_failed(job_id, e))
+            session.commit()
+        finally:
+            session.close()
+    return find_fanout_job(job_id)
+
+def find_fanout_job(job_id):
+    """Retrieve the status of a fan-out job.
+    :param job_id: ID of the fan-out job
+    :return: Status dict if found, None otherwise
+    """
+    session = SessionLocal()
+    try:
+        job = session.get(models.FanoutJob, job_id)
+        return fanout_job_entry(job) if job else None
+    except Exception as e:
+        print(f"Error finding fan-out job: {e}")
+        return None
+    finally:
+        session.close()
+
+def pending_fanout_jobs():
+    """IDs of the fan-out jobs not finished yet, oldest first."""
+    session = SessionLocal()
+    try:
+        return list(session.execute(pending_fanout_query()).scalars())
+    except Exception as e:
+        print(f"Error listing fan-out jobs: {e}")
+        return []
+    finally:
+        session.close()
+
 def find_message_by_mail(email):
     """Retrieve messages sent by a user with a given email address.
     :param email: Email of the sender
@@ -184,7 +790,6 @@ def find_message_by_mail(email):
     :param email: Email of the sender
     :return: List of Message objects if found, empty list otherwise
     """
-    models.Base.metadata.create_all(bind=engine)
     session = SessionLocal()
     try:
         user = session.query(models.User).filter(models.User.email == email).first()
@@ -203,43 +808,175 @@ def find_message_by_mail(email):
     finally:
         session.close()
 
-def find_message_inbox(email):
-    """Retrieve inbox messages for a given email address.
-    :param email: Email of the recipient
-    :return: List of MessageRecipient objects if found, empty list otherwise
+def encode_cursor(timestamp, row_id):
+    """Encode a (timestamp, id) keyset position as an opaque cursor string."""
+    payload = json.dumps({"ts": timestamp.isoformat(), "id": str(row_id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor.
+    :param cursor: Opaque cursor string
+    :return: (timestamp, id) tuple
+    :raises ValueError: if the cursor is malformed
     """
-    """Retrieve inbox messages for a given email address.
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["ts"]), uuid.UUID(payload["id"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def encode_search_cursor(rank, row_id):
+    """Encode a (rank, id) search position as an opaque cursor string."""
+    payload = json.dumps({"rank": rank, "id": str(row_id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor):
+    """Decode a cursor from encode_search_cursor.
+    :param cursor: Opaque cursor string
+    :return: (rank, id) tuple
+    :raises ValueError: if the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(payload["rank"]), uuid.UUID(payload["id"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def sent_query(email, limit=None, after=None):
+    """Build the keyset-paginated query for messages sent by a user, newest first.
+    :param email: Email of the sender
+    :param limit: Maximum number of rows
+    :param after: (timestamp, message id) position to continue after
+    :return: Select statement yielding Message objects
+    """
+    query = (
+        select(models.Message)
+        .join(models.User, models.Message.sender_id == models.User.id)
+        .where(models.User.email == email)
+        .order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+    )
+    if after:
+        query = query.where(tuple_(models.Message.timestamp, models.Message.id) < after)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def page_of(rows, limit, position, key="messages", encode=None):
+    """Trim a limit + 1 result to one page and compute its next_cursor.
+    :param rows: Rows fetched with limit + 1
+    :param limit: Page size
+    :param position: Function returning the (timestamp, id) of a row
+    :param key: Name of the rows entry in the result
+    :param encode: Cursor encoder for the position, defaults to encode_cursor
+    :return: dict with the rows under key, and "next_cursor"
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (encode or encode_cursor)(*position(rows[-1]))
+    return {key: rows, "next_cursor": next_cursor}
+
+def find_message_by_mail_page(email, limit, cursor=None):
+    """Retrieve one page of messages sent by a user, newest first.
+    Pages are keyed on (timestamp, id), so messages sent while paging never shift later pages.
+    :param email: Email of the sender
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: dict with "messages" (Message objects) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    session = SessionLocal()
+    try:
+        messages = session.execute(sent_query(email, limit=limit + 1, after=after)).scalars().all()
+        return page_of(messages, limit, lambda message: (message.timestamp, message.id))
+    except Exception as e:
+        print(f"Error retrieving message by email: {e}")
+        return {"messages": [], "next_cursor": None}
+    finally:
+        session.close()
+
+def inbox_query(email, unread_only=False, limit=None, after=None, preview_length=None):
+    """Build the single joined query behind the inbox listings, newest first.
+    Recipient, message and sender are joined in SQL so no relationship is lazy loaded per row.
     :param email: Email of the recipient
-    :return: List of MessageRecipient objects if found, empty list otherwise
+    :param unread_only: Only return rows that are not read yet
+    :param limit: Maximum number of rows
+    :param after: (timestamp, message_recipients id) position to continue after
+    :param preview_length: None selects the full content; a number selects only that many
+        leading characters as "preview" (0 skips the content entirely)
+    :return: Select statement yielding inbox rows
     """
+    Recipient = aliased(models.User)
+    Sender = aliased(models.User)
+    if preview_length is None:
+        body = [models.Message.content]
+    elif preview_length:
+        body = [func.substr(models.Message.content, 1, preview_length).label("preview")]
+    else:
+        body = []
+    query = (
+        select(
+            models.Message.id,
+            Sender.email.label("sender"),
+            models.Message.subject,
+            *body,
+            models.Message.timestamp,
+            models.MessageRecipient.read,
+            models.MessageRecipient.read_at,
+            models.MessageRecipient.id.label("entry_id"),
+        )
+        .select_from(models.MessageRecipient)
+        .join(Recipient, models.MessageRecipient.recipient_id == Recipient.id)
+        .join(models.Message, models.MessageRecipient.message_id == models.Message.id)
+        .join(Sender, models.Message.sender_id == Sender.id)
+        .where(Recipient.email == email)
+    )
+    if unread_only:
+        query = query.where(models.MessageRecipient.read == False)
+    # A recipient row is unique even when one message lists the same user twice
+    query = query.order_by(models.Message.timestamp.desc(), models.MessageRecipient.id.desc())
+    if after:
+        query = query.where(tuple_(models.Message.timestamp, models.MessageRecipient.id) < after)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def inbox_entry(row):
+    """Convert a row of inbox_query into the inbox message dict."""
+    return {
+        "id": row.id,
+        "sender": row.sender,
+        "subject": row.subject,
+        "content": row.content,
+        "timestamp": row.timestamp,
+        "read": row.read if row.read else False,
+        "read_at": row.read_at
+    }
+
+def inbox_summary_entry(row):
+    """Convert a row of inbox_query(preview_length=...) into the inbox summary dict."""
+    return {
+        "id": row.id,
+        "sender": row.sender,
+        "subject": row.subject,
+        "preview": row._mapping.get("preview"),
+        "timestamp": row.timestamp,
+        "read": row.read if row.read else False,
+        "read_at": row.read_at
+    }
+
+def find_message_inbox(email):
     """Retrieve inbox messages for a given email address.
     :param email: Email of the recipient
-    :return: List of MessageRecipient objects if found, empty list otherwise
+    :return: List of inbox message dicts if found, empty list otherwise
     """
-    models.Base.metadata.create_all(bind=engine)
     session = SessionLocal()
     try:
-        user = session.query(models.User).filter(models.User.email == email).first()
-        if not user:
-            print("Recipient user not found")
-            return []
-        
-        message_recipients = session.query(models.MessageRecipient).filter(models.MessageRecipient.recipient_id == user.id).all()
-        # messages = [recipient.message for recipient in message_recipients]
-
-        if message_recipients:
-            message_recipients = [{
-                "id": recipient.message.id,
-                "sender": recipient.message.sender.email,
-                "subject": recipient.message.subject,
-                "content": recipient.message.content,
-                "timestamp": recipient.message.timestamp,
-                # "recipients": [recipient.recipient.email for recipient in message.recipients],
-                "read": recipient.read if recipient.read else False,
-                "read_at": recipient.read_at
-            } for recipient in message_recipients]
-            
-        return message_recipients
+        rows = session.execute(inbox_query(email)).all()
+        return [inbox_entry(row) for row in rows]
     except Exception as e:
         print(f"Error retrieving inbox messages: {e}")
         return []
@@ -249,44 +986,337 @@ def find_message_inbox(email):
 def find_message_inbox_unread(email):
     """Retrieve unread messages in the inbox for a given email address.
     :param email: Email of the recipient
-    :return: List of unread Message objects if found, empty list otherwise
+    :return: List of unread inbox message dicts if found, empty list otherwise
     """
-    """Retrieve unread messages in the inbox for a given email address.
+    session = SessionLocal()
+    try:
+        rows = session.execute(inbox_query(email, unread_only=True)).all()
+        return [inbox_entry(row) for row in rows]
+    except Exception as e:
+        print(f"Error retrieving unread inbox messages: {e}")
+        return []
+    finally:
+        session.close()
+
+def find_message_inbox_page(email, limit, cursor=None, unread_only=False):
+    """Retrieve one page of inbox messages for a recipient, newest first.
+    Pages are keyed on (timestamp, id), so messages arriving while paging never shift later pages.
     :param email: Email of the recipient
-    :return: List of unread Message objects if found, empty list otherwise
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :param unread_only: Only list unread messages
+    :return: dict with "messages" (inbox message dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
     """
-    models.Base.metadata.create_all(bind=engine)
+    after = decode_cursor(cursor) if cursor else None
     session = SessionLocal()
     try:
-        user = session.query(models.User).filter(models.User.email == email).first()
-        if not user:
-            print("Recipient user not found")
-            return []
-        
-        message_recipients = session.query(models.MessageRecipient).filter(
-            models.MessageRecipient.recipient_id == user.id,
-            models.MessageRecipient.read == False
-        ).all()
-
-        if message_recipients:
-            message_recipients = [{
-                "id": recipient.message.id,
-                "sender": recipient.message.sender.email,
-                "subject": recipient.message.subject,
-                "content": recipient.message.content,
-                "timestamp": recipient.message.timestamp,
-                # "recipients": [recipient.recipient.email for recipient in message.recipients],
-                "read": recipient.read if recipient.read else False,
-                "read_at": recipient.read_at
-            } for recipient in message_recipients]
-            
-        return message_recipients
+        rows = session.execute(inbox_query(email, unread_only=unread_only, limit=limit + 1, after=after)).all()
+        page = page_of(rows, limit, lambda row: (row.timestamp, row.entry_id))
+        page["messages"] = [inbox_entry(row) for row in page["messages"]]
+        return page
     except Exception as e:
-        print(f"Error retrieving unread inbox messages: {e}")
+        print(f"Error retrieving inbox messages: {e}")
+        return {"messages": [], "next_cursor": None}
+    finally:
+        session.close()
+
+def find_message_inbox_summary_page(email, limit, cursor=None, unread_only=False, preview_length=0):
+    """Retrieve one page of the inbox as summaries, without the message content.
+    Only the listed columns (and at most preview_length characters of the content) are read.
+    :param email: Email of the recipient
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :param unread_only: Only list unread messages
+    :param preview_length: Number of leading content characters to return as preview, 0 for none
+    :return: dict with "messages" (inbox summary dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    session = SessionLocal()
+    try:
+        query = inbox_query(email, unread_only=unread_only, limit=limit + 1, after=after, preview_length=preview_length)
+        page = page_of(session.execute(query).all(), limit, lambda row: (row.timestamp, row.entry_id))
+        page["messages"] = [inbox_summary_entry(row) for row in page["messages"]]
+        return page
+    except Exception as e:
+        print(f"Error retrieving inbox summaries: {e}")
+        return {"messages": [], "next_cursor": None}
+    finally:
+        session.close()
+
+def sent_export_query(email):
+    """Build the query behind the sent half of a mailbox export, one row per recipient, newest first.
+    Rows of one message are adjacent so they can be grouped while streaming.
+    """
+    Sender = aliased(models.User)
+    Recipient = aliased(models.User)
+    return (
+        select(
+            models.Message.id,
+            models.Message.subject,
+            models.Message.content,
+            models.Message.timestamp,
+            Recipient.email.label("recipient"),
+            models.MessageRecipient.read,
+            models.MessageRecipient.read_at,
+        )
+        .join(Sender, models.Message.sender_id == Sender.id)
+        .outerjoin(models.MessageRecipient, models.MessageRecipient.message_id == models.Message.id)
+        .outerjoin(Recipient, models.MessageRecipient.recipient_id == Recipient.id)
+        .where(Sender.email == email)
+        .order_by(models.Message.timestamp.desc(), models.Message.id.desc(), models.MessageRecipient.id)
+    )
+
+def sent_export_entries(rows):
+    """Fold the rows of sent_export_query into one export dict per message."""
+    for message_id, group in groupby(rows, key=lambda row: row.id):
+        group = list(group)
+        yield {
+            "direction": "sent",
+            "id": message_id,
+            "subject": group[0].subject,
+            "content": group[0].content,
+            "timestamp": group[0].timestamp,
+            "recipients": [
+                {"email": row.recipient, "read": row.read if row.read else False, "read_at": row.read_at}
+                for row in group if row.recipient is not None
+            ]
+        }
+
+def received_export_entry(row):
+    """Convert a row of inbox_query into a received export dict."""
+    return {"direction": "received", **inbox_entry(row)}
+
+def export_mailbox(email, batch_size=None):
+    """Stream every message a user sent and received, sent first, newest first within each half.
+    Rows come from a server-side cursor batch_size at a time, so memory does not grow with the mailbox.
+    The session stays open until the generator is exhausted or closed.
+    :param email: Email of the user
+    :param batch_size: Rows per fetch, defaults to EXPORT_BATCH_SIZE
+    :return: Generator of export dicts with a "direction" of "sent" or "received"
+    """
+    options = {"yield_per": batch_size or EXPORT_BATCH_SIZE}
+    session = SessionLocal()
+    try:
+        yield from sent_export_entries(session.execute(sent_export_query(email), execution_options=options))
+        for row in session.execute(inbox_query(email), execution_options=options):
+            yield received_export_entry(row)
+    except Exception as e:
+        print(f"Error exporting mailbox: {e}")
+        raise
+    finally:
+        session.close()
+
+def fts5_match(terms):
+    """Quote every word of a search so FTS5 ANDs them instead of parsing its query syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in terms.split())
+
+def search_query(dialect, email, terms, limit=None, after=None):
+    """Build the ranked full-text search over the messages a user sent or received, best match first.
+    PostgreSQL matches MESSAGE_SEARCH_DOCUMENT (served by the ix_messages_search GIN index) against
+    websearch_to_tsquery and ranks with ts_rank; SQLite uses the messages_fts FTS5 table and bm25.
+    :param dialect: Name of the database dialect
+    :param email: Email of the user whose mailbox is searched
+    :param terms: Search text as typed by the user
+    :param limit: Maximum number of rows
+    :param after: (rank, message id) position to continue after
+    :return: Select statement yielding search rows
+    """
+    Sender = aliased(models.User)
+    in_mailbox = in_mailbox_clause(select(models.User.id).where(models.User.email == email).scalar_subquery())
+    columns = [models.Message.id, Sender.email.label("sender"), models.Message.subject, models.Message.timestamp]
+    if dialect == "sqlite":
+        fts = table("messages_fts")
+        query = (
+            select(*columns, (-func.bm25(literal_column("messages_fts"))).label("rank"))
+            .select_from(models.Message)
+            .join(fts, literal_column("messages_fts.rowid") == literal_column("messages.rowid"))
+            .where(literal_column("messages_fts").op("MATCH")(fts5_match(terms)))
+        )
+    else:
+        # Literal SQL, so the expression matches the indexed one exactly
+        document = literal_column(models.MESSAGE_SEARCH_DOCUMENT)
+        tsquery = func.websearch_to_tsquery(literal_column("'simple'"), terms)
+        # ts_rank is a real; as double precision the value handed out in cursors compares back exactly
+        rank = cast(func.ts_rank(document, tsquery), Double)
+        query = select(*columns, rank.label("rank")).where(document.op("@@")(tsquery))
+    inner = query.join(Sender, models.Message.sender_id == Sender.id).where(in_mailbox).subquery()
+
+    query = select(inner).order_by(inner.c.rank.desc(), inner.c.id.desc())
+    if after:
+        query = query.where(tuple_(inner.c.rank, inner.c.id) < after)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def search_entry(row):
+    """Convert a row of search_query into the search result dict."""
+    return {
+        "id": row.id,
+        "sender": row.sender,
+        "subject": row.subject,
+        "timestamp": row.timestamp,
+        "rank": row.rank
+    }
+
+def find_messages_search_page(email, terms, limit, cursor=None):
+    """Search the messages a user sent or received, best match first, one page at a time.
+    :param email: Email of the user
+    :param terms: Search text; every word must match
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: dict with "messages" (search result dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_search_cursor(cursor) if cursor else None
+    session = SessionLocal()
+    try:
+        query = search_query(session.get_bind().dialect.name, email, terms, limit=limit + 1, after=after)
+        rows = session.execute(query).all()
+        page = page_of(rows, limit, lambda row: (row.rank, row.id), encode=encode_search_cursor)
+        page["messages"] = [search_entry(row) for row in page["messages"]]
+        return page
+    except Exception as e:
+        print(f"Error searching messages: {e}")
+        return {"messages": [], "next_cursor": None}
+    finally:
+        session.close()
+
+def thread_query(email, thread_id):
+    """Build the query for every message of a thread in a user's mailbox, oldest first.
+    Served by ix_messages_thread; read state is the user's own (None for messages they sent).
+    :param email: Email of the user
+    :param thread_id: UUID of the thread
+    :return: Select statement yielding thread rows
+    """
+    User = aliased(models.User)
+    Sender = aliased(models.User)
+    user_id = select(User.id).where(User.email == email).scalar_subquery()
+    return (
+        select(
+            models.Message.id,
+            Sender.email.label("sender"),
+            models.Message.subject,
+            models.Message.content,
+            models.Message.timestamp,
+            models.Message.in_reply_to,
+            models.MessageRecipient.read,
+            models.MessageRecipient.read_at,
+        )
+        .join(Sender, models.Message.sender_id == Sender.id)
+        .outerjoin(models.MessageRecipient, (models.MessageRecipient.message_id == models.Message.id)
+                   & (models.MessageRecipient.recipient_id == user_id))
+        .where(models.Message.thread_id == thread_id)
+        .where(or_(models.Message.sender_id == user_id, models.MessageRecipient.id.is_not(None)))
+        .order_by(models.Message.timestamp, models.Message.id)
+    )
+
+def thread_entry(row):
+    """Convert a row of thread_query into the thread message dict."""
+    return {
+        "id": row.id,
+        "sender": row.sender,
+        "subject": row.subject,
+        "content": row.content,
+        "timestamp": row.timestamp,
+        "in_reply_to": row.in_reply_to,
+        "read": row.read,
+        "read_at": row.read_at
+    }
+
+def find_thread(email, thread_id):
+    """Retrieve a whole conversation as the user sees it, in one query.
+    :param email: Email of the user
+    :param thread_id: UUID of the thread
+    :return: List of thread message dicts, oldest first; empty if the thread is not in the mailbox
+    """
+    thread_id = thread_id if isinstance(thread_id, uuid.UUID) else uuid.UUID(str(thread_id))
+    session = SessionLocal()
+    try:
+        return [thread_entry(row) for row in session.execute(thread_query(email, thread_id))]
+    except Exception as e:
+        print(f"Error retrieving thread: {e}")
         return []
     finally:
         session.close()
 
+def thread_summary_query(email, limit=None, after=None):
+    """Build the per-thread inbox summary: latest received message, message and unread counts.
+    Window functions over the user's inbox rows pick each thread's latest message in one pass;
+    threads are ordered by that message, newest first.
+    :param email: Email of the recipient
+    :param limit: Maximum number of threads
+    :param after: (timestamp, thread id) position to continue after
+    :return: Select statement yielding thread summary rows
+    """
+    Recipient = aliased(models.User)
+    Sender = aliased(models.User)
+    newest_first = (models.Message.timestamp.desc(), models.Message.id.desc())
+    inbox = (
+        select(
+            models.Message.thread_id,
+            models.Message.id.label("last_message_id"),
+            Sender.email.label("sender"),
+            models.Message.subject,
+            models.Message.timestamp,
+            func.row_number().over(partition_by=models.Message.thread_id, order_by=newest_first).label("position"),
+            func.count().over(partition_by=models.Message.thread_id).label("messages"),
+            func.sum(case((models.MessageRecipient.read == False, 1), else_=0))
+                .over(partition_by=models.Message.thread_id).label("unread"),
+        )
+        .select_from(models.MessageRecipient)
+        .join(Recipient, models.MessageRecipient.recipient_id == Recipient.id)
+        .join(models.Message, models.MessageRecipient.message_id == models.Message.id)
+        .join(Sender, models.Message.sender_id == Sender.id)
+        .where(Recipient.email == email)
+        .subquery()
+    )
+    query = (
+        select(inbox.c.thread_id, inbox.c.last_message_id, inbox.c.sender, inbox.c.subject,
+               inbox.c.timestamp, inbox.c.messages, inbox.c.unread)
+        .where(inbox.c.position == 1)
+        .order_by(inbox.c.timestamp.desc(), inbox.c.thread_id.desc())
+    )
+    if after:
+        query = query.where(tuple_(inbox.c.timestamp, inbox.c.thread_id) < after)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def thread_summary_entry(row):
+    """Convert a row of thread_summary_query into the thread summary dict."""
+    return {
+        "thread_id": row.thread_id,
+        "last_message_id": row.last_message_id,
+        "sender": row.sender,
+        "subject": row.subject,
+        "timestamp": row.timestamp,
+        "messages": row.messages,
+        "unread": int(row.unread or 0)
+    }
+
+def find_thread_summaries_page(email, limit, cursor=None):
+    """Retrieve one page of the inbox grouped by thread, most recently active first.
+    :param email: Email of the recipient
+    :param limit: Page size
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: dict with "threads" (thread summary dicts) and "next_cursor" (None on the last page)
+    :raises ValueError: if the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    session = SessionLocal()
+    try:
+        rows = session.execute(thread_summary_query(email, limit=limit + 1, after=after)).all()
+        page = page_of(rows, limit, lambda row: (row.timestamp, row.thread_id), key="threads")
+        page["threads"] = [thread_summary_entry(row) for row in page["threads"]]
+        return page
+    except Exception as e:
+        print(f"Error retrieving thread summaries: {e}")
+        return {"threads": [], "next_cursor": None}
+    finally:
+        session.close()
+
 def find_message_sender_detail(message_id):
     """Retrieve detailed information about a specific message by message ID.
     :param message_id: UUID of the message
@@ -296,7 +1326,6 @@ def find_message_sender_detail(message_id):
     :param message_id: UUID of the message
     :return: Message detail with sender and recipient information if found, None otherwise
     """
-    models.Base.metadata.create_all(bind=engine)
     session = SessionLocal()
     try:
         message = session.query(models.Message).filter(models.Message.id == message_id).first()
@@ -342,7 +1371,6 @@ def find_message_recipient_detail(message_id, recipient_id):
     :param recipient_id: UUID of the recipient
     :return: Message detail with recipient information if found, None otherwise
     """
-    models.Base.metadata.create_all(bind=engine)
     session = SessionLocal()
     try:
         message = session.query(models.Message).filter(models.Message.id == message_id).first()
@@ -362,8 +1390,10 @@ def find_message_recipient_detail(message_id, recipient_id):
             return None
         
         if(message_recipient.read == False):
-            message_recipient.read = True
-            message_recipient.read_at = datetime.utcnow()
+            # Conditional UPDATE so two concurrent reads decrement the counter only once
+            result = session.execute(mark_read_statement(message_recipient.id))
+            if result.rowcount:
+                session.execute(unread_decrement(user.id, result.rowcount))
             session.commit()
             # Refresh the message_recipient to get the updated values
             # This is necessary to ensure that the read and read_at fields are updated in the response
@@ -396,4 +1426,88 @@ def find_message_recipient_detail(message_id, recipient_id):
         print(f"Error retrieving message detail: {e}")
         return None
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+def mark_messages_read(recipient_id, message_ids=None, before=None):
+    """Mark many messages as read for one recipient with a single UPDATE statement.
+    Messages that were already read, or were not sent to the recipient, are left out of the result.
+    :param recipient_id: UUID of the recipient
+    :param message_ids: List of message UUIDs to mark, or None
+    :param before: Mark every message with a timestamp before this datetime, or None
+    :return: List of {"message_id", "read_at"} dicts for the messages that changed
+    :raises ValueError: on malformed ids or when not exactly one of message_ids/before is given
+    """
+    recipient_id, message_ids = bulk_read_args(recipient_id, message_ids, before)
+    if message_ids == []:
+        return []
+    session = SessionLocal()
+    try:
+        rows = session.execute(mark_read_bulk_statement(recipient_id, message_ids, before)).all()
+        if rows:
+            session.execute(unread_decrement(recipient_id, len(rows)))
+        session.commit()
+        return [{"message_id": row.message_id, "read_at": row.read_at} for row in rows]
+    except Exception as e:
+        session.rollback()
+        print(f"Error marking messages as read: {e}")
+        return None
+    finally:
+        session.close()
+
+def find_unread_count(email):
+    """Read a user's maintained unread counter (a primary key lookup, independent of inbox size).
+    :param email: Email of the user
+    :return: Number of unread messages, or None if the user does not exist
+    """
+    session = SessionLocal()
+    try:
+        row = session.execute(unread_count_query(email)).first()
+        return row.unread if row else None
+    except Exception as e:
+        print(f"Error retrieving unread count: {e}")
+        return None
+    finally:
+        session.close()
+
+def unread_count_query(email):
+    return (
+        select(func.coalesce(models.UnreadCount.unread, 0).label("unread"))
+        .select_from(models.User)
+        .outerjoin(models.UnreadCount, models.UnreadCount.user_id == models.User.id)
+        .where(models.User.email == email)
+    )
+
+def rebuild_unread_counts(repair=True):
+    """Compare every unread counter with message_recipients and optionally fix the drifted ones.
+    On PostgreSQL the counters table is locked for the duration; writers always touch
+    message_recipients before unread_counts, so no concurrent send or read is lost.
+    :param repair: Write the recomputed values, otherwise only report
+    :return: dict with "checked" and "mismatched" user counts and whether they were "repaired"
+    """
+    session = SessionLocal()
+    try:
+        if session.get_bind().dialect.name == "postgresql":
+            session.execute(text("LOCK TABLE unread_counts IN SHARE ROW EXCLUSIVE MODE"))
+        actual = dict(session.execute(
+            select(models.MessageRecipient.recipient_id, func.count())
+            .where(models.MessageRecipient.read == False)
+            .group_by(models.MessageRecipient.recipient_id)
+        ).all())
+        stored = dict(session.execute(select(models.UnreadCount.user_id, models.UnreadCount.unread)).all())
+        mismatched = [user_id for user_id in actual.keys() | stored.keys() if actual.get(user_id, 0) != stored.get(user_id, 0)]
+
+        if repair and mismatched:
+            table = models.UnreadCount.__table__
+            statement = upsert_insert(session, table)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.user_id],
+                set_={"unread": statement.excluded.unread}
+            )
+            session.execute(statement, [{"user_id": user_id, "unread": actual.get(user_id, 0)} for user_id in mismatched])
+        session.commit()
+        return {"checked": len(actual.keys() | stored.keys()), "mismatched": len(mismatched), "repaired": repair}
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,70 @@
+# Send throughput of services.create_message for 1, 100 and 10k recipients,
+# against the previous two-commit, one-INSERT-per-recipient implementation.
+# "fanout" is the request-path cost of create_message_fanout (message and job
+# row only); its recipient rows are written later by run_fanout_job.
+#
+# Usage: DATABASE_URL=postgresql://... python -m benchmarks.bench_create_message
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app import db, models, services
+
+
+def legacy_create_message(sender, recipients, subject, content):
+    """create_message as it was: commit the message, add recipients one by one, commit again."""
+    session = services.SessionLocal()
+    try:
+        new_message = models.Message(
+            id=uuid.uuid4(), sender_id=sender.id, subject=subject, content=content, timestamp=datetime.utcnow()
+        )
+        session.add(new_message)
+        session.commit()
+        for recipient in recipients:
+            session.add(models.MessageRecipient(id=uuid.uuid4(), message_id=new_message.id, recipient_id=recipient.id))
+        session.commit()
+        session.refresh(new_message)
+        return new_message.id
+    finally:
+        session.close()
+
+def make_users(count):
+    tag = uuid.uuid4().hex[:8]
+    rows = [{
+        "id": uuid.uuid4(),
+        "email": f"bench-{tag}-{i}@example.com",
+        "name": f"Bench {i}",
+        "created_at": datetime.utcnow()
+    } for i in range(count)]
+    session = services.SessionLocal()
+    try:
+        session.execute(insert(models.User), rows)
+        session.commit()
+    finally:
+        session.close()
+    return [models.User(**row) for row in rows]
+
+def measure(create, sender, recipients, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        create(sender, recipients, "Benchmark", "Benchmark body")
+    return (time.perf_counter() - start) / repeat
+
+def main(sizes=(1, 100, 10000)):
+    db.bootstrap_schema(models.Base.metadata)
+    users = make_users(max(sizes) + 1)
+    sender, audience = users[0], users[1:]
+    print(f"{'recipients':>10} {'impl':>8} {'ms/send':>10} {'rows/s':>12}")
+    for size in sizes:
+        recipients = audience[:size]
+        repeat = 20 if size <= 100 else 2
+        for label, create in (("legacy", legacy_create_message), ("bulk", services.create_message), ("fanout", services.create_message_fanout)):
+            seconds = measure(create, sender, recipients, repeat)
+            print(f"{size:>10} {label:>8} {seconds * 1000:>10.2f} {size / seconds:>12.0f}")
+
+
+if __name__ == "__main__":
+    main(tuple(int(size) for size in sys.argv[1:]) or (1, 100, 10000))
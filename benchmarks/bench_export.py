@@ -0,0 +1,68 @@
+# Peak Python memory of a full mailbox export: building the inbox list in memory
+# (find_message_inbox + one JSON document) against streaming NDJSON from
+# services.export_mailbox, for growing mailbox sizes.
+#
+# Usage: DATABASE_URL=postgresql://... python -m benchmarks.bench_export [sizes...]
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import db, models, services
+from app.responses import dumps, ndjson_chunks
+from benchmarks.bench_create_message import make_users
+
+
+def fill_inbox(sender, recipient, count, batch=5000):
+    start = datetime.utcnow()
+    session = services.SessionLocal()
+    try:
+        for offset in range(0, count, batch):
+            messages = [{
+                "id": uuid.uuid4(),
+                "sender_id": sender.id,
+                "subject": f"Export {i}",
+                "content": "Lorem ipsum dolor sit amet " * 20,
+                "timestamp": start - timedelta(seconds=i)
+            } for i in range(offset, min(offset + batch, count))]
+            session.execute(insert(models.Message), messages)
+            session.execute(insert(models.MessageRecipient), [{
+                "id": uuid.uuid4(), "message_id": message["id"], "recipient_id": recipient.id, "read": False
+            } for message in messages])
+        session.commit()
+    finally:
+        session.close()
+
+def in_memory(email):
+    return len(dumps({"messages": services.find_message_inbox(email)}))
+
+def streamed(email):
+    return sum(len(chunk) for chunk in ndjson_chunks(services.export_mailbox(email)))
+
+def measure(export, email):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = export(email)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, size
+
+def main(sizes=(1000, 10000, 50000)):
+    db.bootstrap_schema(models.Base.metadata)
+    print(f"{'messages':>9} {'impl':>9} {'seconds':>8} {'peak MiB':>9} {'bytes':>11}")
+    filled = 0
+    sender, recipient = make_users(2)
+    for size in sizes:
+        fill_inbox(sender, recipient, size - filled)
+        filled = size
+        for label, export in (("in-memory", in_memory), ("streamed", streamed)):
+            seconds, peak, written = measure(export, recipient.email)
+            print(f"{size:>9} {label:>9} {seconds:>8.2f} {peak / 2 ** 20:>9.1f} {written:>11}")
+
+
+if __name__ == "__main__":
+    main(tuple(int(size) for size in sys.argv[1:]) or (1000, 10000, 50000))
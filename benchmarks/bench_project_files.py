@@ -0,0 +1,104 @@
+# Folder traversal of mcp_server.get_project_files against a fake BIM360 whose
+# get_folder_contents sleeps like a network round trip: the previous one-call-
+# at-a-time depth-first walk versus walk_folders at several concurrency levels,
+# then a walk served from the APS response cache. Finally the folder index on a
+# ~100k-file tree: first sync, repeated queries and a sync after one change.
+#
+# Usage: python -m benchmarks.bench_project_files [latency_ms] [branching] [depth]
+import asyncio
+import sys
+import time
+
+from app import mcp_server
+from app.aps_index import FolderIndex
+
+
+class FakeBIM360:
+    """BIM360 stand-in serving a regular folder tree with a fixed latency per listing."""
+
+    def __init__(self, latency=0.05, branching=4, depth=3, files=5):
+        self.latency = latency
+        self.branching = branching
+        self.depth = depth
+        self.files = files
+        self.calls = 0
+        # lastModifiedTime per folder id
+        self.stamps = {}
+
+    def get_folder_contents(self, project_id, folder_id):
+        self.calls += 1
+        time.sleep(self.latency)
+        level = folder_id.count("/")
+        data = [{
+            "type": "items",
+            "id": f"{folder_id}:file{i}",
+            "attributes": {"displayName": f"file{i}.rvt", "fileType": "rvt"}
+        } for i in range(self.files)]
+        if level < self.depth:
+            data += [{
+                "type": "folders",
+                "id": f"{folder_id}/{i}",
+                "attributes": {"displayName": f"Folder {i}", "lastModifiedTime": self.stamps.get(f"{folder_id}/{i}", "v1")}
+            } for i in range(self.branching)]
+        return {"data": data}
+
+
+def legacy_walk(bim360, project_id, folder_id):
+    """The previous process_folder: one blocking listing at a time, depth first."""
+    items = []
+
+    def process_folder(folder_id):
+        contents = bim360.get_folder_contents(project_id, folder_id)
+        for item in contents.get("data", []):
+            if item.get("type") == "folders":
+                process_folder(item.get("id"))
+            elif item.get("type") == "items":
+                items.append(item)
+
+    process_folder(folder_id)
+    return items
+
+def timed(label, coroutine_or_call, calls_before, bim360):
+    start = time.perf_counter()
+    result = asyncio.run(coroutine_or_call) if asyncio.iscoroutine(coroutine_or_call) else coroutine_or_call()
+    print(f"{label:>24} {(time.perf_counter() - start) * 1000:>10.1f} {bim360.calls - calls_before:>8}")
+    return result
+
+def bench_index(latency_ms):
+    # 10 x 10 x 10 folders with 90 files each: 1111 folders, ~100k files
+    bim360 = FakeBIM360(latency=latency_ms / 1000, branching=10, depth=3, files=90)
+    mcp_server.folder_index = index = FolderIndex()
+    print(f"\nfolder index, {latency_ms} ms per listing")
+    print(f"{'step':>24} {'ms':>10} {'listings':>8}")
+    timed("first sync", mcp_server.sync_folder_index(bim360, "project", ["root"]), bim360.calls, bim360)
+    items, _ = timed("query all", lambda: index.find_files("project", ["root"]), bim360.calls, bim360)
+    timed("query rvt, 100 items", lambda: index.find_files("project", ["root"], "rvt", max_items=100), bim360.calls, bim360)
+    timed("query dwg, no match", lambda: index.find_files("project", ["root"], "dwg"), bim360.calls, bim360)
+    bim360.stamps.update({"root/3": "v2", "root/3/4": "v2"})
+    timed("sync after one change", mcp_server.sync_folder_index(bim360, "project", ["root"]), bim360.calls, bim360)
+    print(f"{len(items)} files indexed")
+
+def main(latency_ms=50, branching=4, depth=3):
+    # The fake client has no user behind it to look up
+    mcp_server.fetch_token_identity = lambda token: "bench"
+    bim360 = FakeBIM360(latency=latency_ms / 1000, branching=branching, depth=depth)
+    start = time.perf_counter()
+    expected = legacy_walk(bim360, "project", "root")
+    print(f"{bim360.calls} folders, {len(expected)} files, {latency_ms} ms per listing")
+    print(f"{'impl':>14} {'seconds':>9}")
+    print(f"{'legacy':>14} {time.perf_counter() - start:>9.2f}")
+    for concurrency in (1, 8, 32):
+        start = time.perf_counter()
+        walk = mcp_server.walk_folders(bim360, "project", ["root"], concurrency=concurrency, force_refresh=True)
+        items, _ = asyncio.run(walk)
+        seconds = time.perf_counter() - start
+        assert items == expected
+        print(f"{f'concurrent={concurrency}':>14} {seconds:>9.2f}")
+    start = time.perf_counter()
+    asyncio.run(mcp_server.walk_folders(bim360, "project", ["root"]))
+    print(f"{'cached':>14} {time.perf_counter() - start:>9.2f}")
+    bench_index(latency_ms)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
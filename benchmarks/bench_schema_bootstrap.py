@@ -0,0 +1,61 @@
+# Per-request latency saved by bootstrapping the schema once instead of
+# calling metadata.create_all before every service call.
+#
+# Usage: DATABASE_URL=postgresql://... python -m benchmarks.bench_schema_bootstrap [requests]
+import statistics
+import sys
+import time
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import db, models, services
+from app.main import app
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def timed_requests(client, path, payload, count, create_all_per_call):
+    engine = db.get_engine()
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        if create_all_per_call:
+            # What every service function used to do before touching the DB
+            models.Base.metadata.create_all(bind=engine)
+        response = client.post(path, json=payload)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.text
+    return samples
+
+def report(label, samples):
+    print(f"{label:<32} mean={statistics.mean(samples):7.3f}ms "
+          f"p50={percentile(samples, 0.50):7.3f}ms p95={percentile(samples, 0.95):7.3f}ms")
+
+def main(count=200):
+    with TestClient(app) as client:
+        tag = uuid.uuid4().hex[:8]
+        sender = services.create_user(f"bench-sender-{tag}@example.com", "Bench Sender")
+        recipient = services.create_user(f"bench-recipient-{tag}@example.com", "Bench Recipient")
+        for i in range(20):
+            services.create_message(sender, [recipient], f"Subject {i}", "Benchmark body")
+
+        endpoints = [
+            ("/api/users/byEmail", {"email": recipient.email}),
+            ("/api/message/inbox", {"email": recipient.email}),
+        ]
+        for path, payload in endpoints:
+            # Warm the pool and caches before measuring
+            timed_requests(client, path, payload, 10, create_all_per_call=False)
+            before = timed_requests(client, path, payload, count, create_all_per_call=True)
+            after = timed_requests(client, path, payload, count, create_all_per_call=False)
+            print(path)
+            report("  create_all per request", before)
+            report("  bootstrap once", after)
+            print(f"  saved per request: {statistics.mean(before) - statistics.mean(after):.3f}ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,59 @@
+# Response time of a 10k-row ListInboxResponse through FastAPI, building
+# InboxMessage models that FastAPI validates again (the from_orm path) against
+# returning the rows with FastJSONResponse. No database involved.
+#
+# Usage: python -m benchmarks.bench_serialization [rows]
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.responses import FastJSONResponse, fields_of
+from app.schemas import InboxMessage, ListInboxResponse
+
+
+def make_rows(count):
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": uuid.uuid4(),
+        "sender": f"sender{i % 50}@example.com",
+        "subject": f"Subject {i}",
+        "content": "Lorem ipsum dolor sit amet " * 8,
+        "timestamp": now,
+        "read": bool(i % 3),
+        "read_at": now if i % 3 else None
+    } for i in range(count)]
+
+def make_app(rows):
+    app = FastAPI()
+
+    @app.get("/models", response_model=ListInboxResponse)
+    async def models():
+        return ListInboxResponse(messages=[InboxMessage.from_orm(row) for row in rows], mailUser="user@example.com")
+
+    @app.get("/fast", response_model=ListInboxResponse)
+    async def fast():
+        return FastJSONResponse({"mailUser": "user@example.com", "messages": [fields_of(InboxMessage, row) for row in rows], "next_cursor": None})
+
+    return app
+
+def measure(client, path, repeat):
+    client.get(path)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = client.get(path).content
+    return (time.perf_counter() - start) / repeat, len(body)
+
+def main(count=10000, repeat=10):
+    client = TestClient(make_app(make_rows(count)))
+    print(f"{'rows':>6} {'path':>8} {'ms/response':>12} {'bytes':>10}")
+    for path in ("/models", "/fast"):
+        seconds, size = measure(client, path, repeat)
+        print(f"{count:>6} {path.strip('/'):>8} {seconds * 1000:>12.2f} {size:>10}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,31 @@
+# Shared test fixtures
+import pytest
+
+
+@pytest.fixture(scope="module")
+def app_lifespan(request):
+    """Run the module's TestClient inside the app lifespan.
+
+    Startup bootstraps the schema, and every request shares one event loop,
+    which pooled async connections require.
+    """
+    with request.module.client:
+        yield
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Point both service layers at a fresh SQLite database and return its engine."""
+    from app import async_services, db, models, services
+    from app.cache import idempotency_cache, user_cache
+
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = db.get_engine(url)
+    models.Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(services, "SessionLocal", db.get_sessionmaker(url))
+    monkeypatch.setattr(async_services, "AsyncSessionLocal", db.get_async_sessionmaker(db.async_database_url(url)))
+    user_cache.clear()
+    idempotency_cache.clear()
+    yield engine
+    user_cache.clear()
+    idempotency_cache.clear()
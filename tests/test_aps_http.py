@@ -0,0 +1,97 @@
+# Test the pooled HTTP sessions behind the MCP server's BIM360 clients
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from app import aps_http
+from app.aps_http import ClientRegistry
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like APS
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this each reused connection waits on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(0.5)
+        body = json.dumps({"data": [], "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalClient:
+    """Calls requests.get at module level, the way aps_toolkit's BIM360 does."""
+
+    def __init__(self, token, url):
+        self.token = token
+        self.url = url
+
+    def get_hubs(self, path="/hubs"):
+        return requests.get(self.url + path).json()
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def registry(server_url, monkeypatch):
+    monkeypatch.setattr(sys.modules[__name__], "requests", aps_http.router)
+    registry = ClientRegistry(lambda token: LocalClient(token, server_url), pool_size=2, read_timeout=0.2)
+    yield registry
+    registry.close()
+
+def test_calls_reuse_one_connection(registry):
+    client = registry.get("token-1")
+    for _ in range(5):
+        assert registry.call(client, "get_hubs") == {"data": [], "path": "/hubs"}
+    assert registry.get("token-1") is client
+
+    stats = registry.stats()
+    assert stats["requests"] == 5
+    assert stats["connects"] == 1
+    assert stats["reused"] == 4
+    assert stats["clients_built"] == 1
+
+def test_rotated_token_rebuilds_client(registry):
+    client = registry.get("token-1")
+    registry.call(client, "get_hubs")
+
+    rotated = registry.get("token-2")
+    assert rotated is not client and rotated.token == "token-2"
+    registry.call(rotated, "get_hubs")
+    registry.call(rotated, "get_hubs")
+
+    stats = registry.stats()
+    assert stats["clients"] == 1
+    assert stats["clients_built"] == 2
+    assert stats["connects"] == 2
+    assert stats["reused"] == 1
+
+def test_unbound_calls_fall_through_to_requests(registry):
+    client = registry.get("token-1")
+    assert client.get_hubs() == {"data": [], "path": "/hubs"}
+    assert registry.stats()["requests"] == 0
+
+def test_default_read_timeout(registry):
+    client = registry.get("token-1")
+    with pytest.raises(requests.Timeout):
+        registry.call(client, "get_hubs", "/slow")
+    assert registry.stats()["errors"] == 1
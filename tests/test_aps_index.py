@@ -0,0 +1,62 @@
+# Test the local folder index used by get_project_files
+from app.aps_index import FolderIndex
+
+
+def listing(*entries):
+    data = []
+    for kind, item_id, extra in entries:
+        if kind == "folder":
+            data.append({"type": "folders", "id": item_id, "attributes": {"displayName": item_id, "lastModifiedTime": extra}})
+        else:
+            data.append({"type": "items", "id": item_id, "attributes": {"displayName": item_id, "fileType": extra}})
+    return {"data": data}
+
+def ids(items):
+    return [item["id"] for item in items]
+
+def test_store_listing_reports_changed_subfolders():
+    index = FolderIndex()
+    root = listing(("file", "a.rvt", "rvt"), ("folder", "f1", "v1"), ("folder", "f2", "v1"), ("file", "b.pdf", "pdf"))
+    assert index.store_listing("p", "root", root, None, 1.0) == [("f1", "v1"), ("f2", "v1")]
+    index.store_listing("p", "f1", listing(("file", "c.rvt", "rvt"), ("folder", "f1a", "v1")), "v1", 1.0)
+    index.store_listing("p", "f1a", listing(("file", "d.rvt", "RVT")), "v1", 1.0)
+    index.store_listing("p", "f2", listing(("file", "e.dwg", "dwg")), "v1", 1.0)
+
+    # Depth-first order, as the folders were listed
+    assert ids(index.find_files("p", ["root"])[0]) == ["a.rvt", "c.rvt", "d.rvt", "e.dwg", "b.pdf"]
+    assert ids(index.find_files("p", ["root"], file_type="rvt")[0]) == ["a.rvt", "c.rvt", "d.rvt"]
+    items, truncated = index.find_files("p", ["root"], max_depth=1)
+    assert ids(items) == ["a.rvt", "c.rvt", "e.dwg", "b.pdf"]
+    assert truncated is True
+    assert ids(index.find_files("p", ["root"], max_items=2)[0]) == ["a.rvt", "c.rvt"]
+    assert index.find_files("p", ["root"], max_items=5)[1] is False
+
+    # f2 changed, f1 did not; f3 is new
+    relisted = listing(("file", "a.rvt", "rvt"), ("folder", "f1", "v1"), ("folder", "f2", "v2"), ("folder", "f3", "v1"))
+    assert index.store_listing("p", "root", relisted, None, 2.0) == [("f2", "v2"), ("f3", "v1")]
+    assert index.store_listing("p", "root", relisted, None, 2.0, force=True) == [("f1", "v1"), ("f2", "v2"), ("f3", "v1")]
+
+def test_removed_folders_drop_their_subtree():
+    index = FolderIndex()
+    index.store_listing("p", "root", listing(("folder", "f1", "v1")), None, 1.0)
+    index.store_listing("p", "f1", listing(("folder", "f1a", "v1"), ("file", "x", "rvt")), "v1", 1.0)
+    index.store_listing("p", "f1a", listing(("file", "y", "rvt")), "v1", 1.0)
+    assert ids(index.find_files("p", ["f1"])[0]) == ["y", "x"]
+
+    index.store_listing("p", "root", listing(("file", "z", "rvt")), None, 2.0)
+    assert ids(index.find_files("p", ["root"])[0]) == ["z"]
+    assert index.find_files("p", ["f1a"])[0] == []
+
+def test_sync_times(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    index = FolderIndex(path)
+    index.mark_synced("p", ["a"], 10.0)
+    assert index.synced_at("p", ["a", "b"]) is None
+    index.mark_synced("p", ["b"], 20.0)
+    # Persisted between restarts
+    assert FolderIndex(path).synced_at("p", ["a", "b"]) == 10.0
+    # Only a full sync counts as one
+    assert index.synced_at("p", ["a"], full=True) is None
+    index.mark_synced("p", ["a"], 30.0, full=True)
+    assert index.synced_at("p", ["a"], full=True) == 30.0
+    assert index.synced_at("p", ["a"]) == 30.0
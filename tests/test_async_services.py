@@ -0,0 +1,163 @@
+# Test the async service layer against a throwaway SQLite database
+import pytest
+
+from app import async_services
+
+
+@pytest.mark.asyncio
+async def test_user_roundtrip(sqlite_db):
+    user = await async_services.create_user("async1@example.com", "Async One")
+    assert user.email == "async1@example.com"
+    found = await async_services.find_user_by_mail("async1@example.com")
+    assert found.id == user.id
+    assert await async_services.create_user("async1@example.com", "Duplicate") is None
+    updated = await async_services.update_user(user.id, name="Renamed")
+    assert updated.name == "Renamed"
+    assert len(await async_services.get_list_users()) == 1
+
+@pytest.mark.asyncio
+async def test_message_flow(sqlite_db):
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipient = await async_services.create_user("recipient@example.com", "Recipient")
+    created = await async_services.create_message(sender, [recipient], "Hello", "Body")
+    assert created["recipients"] == ["recipient@example.com"]
+
+    sent = await async_services.find_message_by_mail("sender@example.com")
+    assert [message.id for message in sent] == [created["id"]]
+
+    inbox = await async_services.find_message_inbox("recipient@example.com")
+    assert inbox[0]["sender"] == "sender@example.com"
+    assert len(await async_services.find_message_inbox_unread("recipient@example.com")) == 1
+
+    detail = await async_services.find_message_recipient_detail(created["id"], recipient.id)
+    assert detail["read"] is True
+    assert detail["recipients"][0]["recipient_email"] == "recipient@example.com"
+    assert await async_services.find_message_inbox_unread("recipient@example.com") == []
+
+    sender_detail = await async_services.find_message_sender_detail(str(created["id"]))
+    assert sender_detail["recipients"][0]["read"] is True
+    assert await async_services.find_message_sender_detail("invalid-id") is None
+
+@pytest.mark.asyncio
+async def test_unread_count(sqlite_db):
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipient = await async_services.create_user("recipient@example.com", "Recipient")
+    created = await async_services.create_message(sender, [recipient], "Hello", "Body")
+    assert await async_services.find_unread_count("recipient@example.com") == 1
+    detail = await async_services.find_message_recipient_detail(created["id"], recipient.id)
+    assert detail["read"] is True and detail["read_at"] is not None
+    assert await async_services.find_unread_count("recipient@example.com") == 0
+
+@pytest.mark.asyncio
+async def test_mark_messages_read(sqlite_db):
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipient = await async_services.create_user("recipient@example.com", "Recipient")
+    created = [await async_services.create_message(sender, [recipient], f"Subject {i}", "Body") for i in range(3)]
+    marked = await async_services.mark_messages_read(recipient.id, message_ids=[created[0]["id"]])
+    assert [entry["message_id"] for entry in marked] == [created[0]["id"]]
+    marked = await async_services.mark_messages_read(recipient.id, before=created[2]["timestamp"])
+    assert [entry["message_id"] for entry in marked] == [created[1]["id"]]
+    assert await async_services.find_unread_count("recipient@example.com") == 1
+
+@pytest.mark.asyncio
+async def test_inbox_summary(sqlite_db):
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipient = await async_services.create_user("recipient@example.com", "Recipient")
+    await async_services.create_message(sender, [recipient], "Hello", "A long body")
+    page = await async_services.find_message_inbox_summary_page("recipient@example.com", 10, preview_length=6)
+    assert page["messages"][0]["preview"] == "A long"
+    assert "content" not in page["messages"][0]
+
+@pytest.mark.asyncio
+async def test_export_mailbox(sqlite_db):
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipients = [await async_services.create_user(f"r{i}@example.com", f"R{i}") for i in range(3)]
+    first = await async_services.create_message(sender, recipients, "To three", "Body")
+    second = await async_services.create_message(sender, recipients[:1], "To one", "Body")
+    reply = await async_services.create_message(recipients[0], [sender], "Reply", "Body")
+
+    entries = [entry async for entry in async_services.export_mailbox("sender@example.com", batch_size=2)]
+    assert [(entry["direction"], entry["id"]) for entry in entries] == [
+        ("sent", second["id"]), ("sent", first["id"]), ("received", reply["id"])
+    ]
+    assert len(entries[1]["recipients"]) == 3
+
+@pytest.mark.asyncio
+async def test_import_users(sqlite_db):
+    await async_services.create_user("existing@example.com", "Existing")
+    rows = [
+        {"line": 2, "email": "new@example.com", "name": "New"},
+        {"line": 3, "email": "existing@example.com", "name": "Existing"},
+    ]
+    result = await async_services.import_users(rows)
+    assert result["created"] == 1
+    assert [conflict["line"] for conflict in result["conflicts"]] == [3]
+    assert (await async_services.find_user_by_mail("new@example.com")).name == "New"
+
+@pytest.mark.asyncio
+async def test_users_page(sqlite_db):
+    for name in ("ann", "bob", "bea"):
+        await async_services.create_user(f"{name}@example.com", name.title())
+    page = await async_services.find_users_page(2, include_total=True)
+    assert [user.email for user in page["users"]] == ["ann@example.com", "bob@example.com"]
+    assert page["total_estimate"] == 3
+    rest = await async_services.find_users_page(2, page["next_cursor"], email_prefix="b")
+    assert [user.email for user in rest["users"]] == ["bea@example.com"]
+
+@pytest.mark.asyncio
+async def test_search_messages(sqlite_db):
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipient = await async_services.create_user("recipient@example.com", "Recipient")
+    created = await async_services.create_message(sender, [recipient], "Quarterly budget", "Budget review")
+    await async_services.create_message(sender, [recipient], "Lunch", "Tomorrow")
+    page = await async_services.find_messages_search_page("recipient@example.com", "budget", 10)
+    assert [entry["id"] for entry in page["messages"]] == [created["id"]]
+    assert page["messages"][0]["rank"] > 0
+
+@pytest.mark.asyncio
+async def test_threads(sqlite_db):
+    alice = await async_services.create_user("alice@example.com", "Alice")
+    bob = await async_services.create_user("bob@example.com", "Bob")
+    first = await async_services.create_message(alice, [bob], "Plan", "Shall we?")
+    reply_to = await async_services.find_reply_thread(first["id"], bob.id)
+    reply = await async_services.create_message(bob, [alice], "Re: Plan", "Yes", reply_to=reply_to)
+    thread = await async_services.find_thread("alice@example.com", first["id"])
+    assert [entry["id"] for entry in thread] == [first["id"], reply["id"]]
+    page = await async_services.find_thread_summaries_page("alice@example.com", 10)
+    assert [(t["thread_id"], t["unread"]) for t in page["threads"]] == [(first["id"], 1)]
+
+@pytest.mark.asyncio
+async def test_idempotent_create_message(sqlite_db):
+    from app.cache import idempotency_cache
+
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipient = await async_services.create_user("recipient@example.com", "Recipient")
+    created = await async_services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", "f" * 64))
+    assert await async_services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", "f" * 64)) is None
+    idempotency_cache.clear()
+    stored = await async_services.find_idempotent_response("key-1")
+    assert stored["response"]["id"] == str(created["id"])
+    assert len(await async_services.find_message_inbox("recipient@example.com")) == 1
+
+@pytest.mark.asyncio
+async def test_expired_idempotency_key_is_reused_before_purge(sqlite_db, monkeypatch):
+    from app import services
+    from app.cache import idempotency_cache
+
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipient = await async_services.create_user("recipient@example.com", "Recipient")
+    first = await async_services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", "f" * 64))
+    idempotency_cache.clear()
+    monkeypatch.setattr(services, "IDEMPOTENCY_TTL", -1)
+    second = await async_services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", "f" * 64))
+    assert second is not None and second["id"] != first["id"]
+
+@pytest.mark.asyncio
+async def test_fanout_job(sqlite_db):
+    sender = await async_services.create_user("sender@example.com", "Sender")
+    recipients = [await async_services.create_user(f"r{i}@example.com", f"R{i}") for i in range(3)]
+    queued = await async_services.create_message_fanout(sender, recipients, "Broadcast", "Body")
+    assert await async_services.pending_fanout_jobs() == [queued["job_id"]]
+    job = await async_services.run_fanout_job(queued["job_id"], 2)
+    assert (job["status"], job["delivered"], job["total"]) == ("done", 3, 3)
+    assert len(await async_services.find_message_inbox("r2@example.com")) == 1
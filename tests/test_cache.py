@@ -0,0 +1,118 @@
+# Test the user cache and its invalidation
+from app import services
+from app.cache import LRUTTLCache, PersistentLRUTTLCache, UserCache, user_cache
+from tests.test_services import count_queries
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUTTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUTTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_per_entry_ttl():
+    clock = FakeClock()
+    cache = LRUTTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("short", 1, ttl=1)
+    cache.set("default", 2)
+    clock.now = 2
+    assert cache.get("short") is None
+    assert cache.get("default") == 2
+
+def test_maxbytes_bounds_total_size():
+    cache = LRUTTLCache(maxsize=100, ttl=60, maxbytes=30)
+    cache.set("a", "x" * 10)  # 12 bytes as JSON
+    cache.set("b", "y" * 10)
+    assert cache.bytes == 24
+    cache.set("c", "z" * 10)
+    # Over 30 bytes: the least recently used entry goes, however few entries there are
+    assert cache.get("a") is None
+    assert (cache.get("b"), cache.get("c")) == ("y" * 10, "z" * 10)
+    cache.set("b", "short")
+    assert cache.bytes == 19
+    # Larger than the whole cache: not stored, and nothing else is evicted for it
+    cache.set("big", "w" * 50)
+    assert cache.get("big") is None
+    assert len(cache) == 2
+    cache.clear()
+    assert cache.bytes == 0
+
+def test_persistent_cache_survives_restart(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "cache.json")
+    cache = PersistentLRUTTLCache(maxsize=2, ttl=10, path=path, clock=clock)
+    cache.set("old", {"data": 1})
+    cache.set("a", {"data": 2}, ttl=1)
+    cache.set("b", {"data": [3]})
+    cache.save()
+
+    clock.now = 5
+    restored = PersistentLRUTTLCache(maxsize=2, ttl=10, path=path, clock=clock)
+    # "old" was evicted before saving, "a" expired since
+    assert restored.get("old") is None
+    assert restored.get("a") is None
+    assert restored.get("b") == {"data": [3]}
+    assert len(restored) == 1
+
+    # Loaded entries count towards maxbytes too
+    small = PersistentLRUTTLCache(maxsize=2, ttl=10, path=path, clock=clock, maxbytes=16)
+    assert small.bytes == len('{"data":[3]}')
+
+def test_user_cache_counts_and_invalidates_both_keys():
+    cache = UserCache(LRUTTLCache(maxsize=10, ttl=60))
+    user = services.models.User(id="u1", email="a@example.com", name="A", created_at=None)
+    assert cache.get_by_email("a@example.com") is None
+    cache.put(user)
+    assert cache.get_by_id("u1").email == "a@example.com"
+    cache.invalidate(user_id="u1")
+    assert cache.get_by_email("a@example.com") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+def test_find_user_by_mail_reads_through(sqlite_db):
+    created = services.create_user("cached@example.com", "Cached")
+    services.find_user_by_mail("cached@example.com")
+    with count_queries(sqlite_db) as statements:
+        user = services.find_user_by_mail("cached@example.com")
+        resolved = services.find_users_by_mails(["cached@example.com"])
+    assert statements == []
+    assert user.id == created.id
+    assert resolved["users"]["cached@example.com"].id == created.id
+    assert user_cache.stats()["hits"] == 2
+
+def test_update_user_invalidates(sqlite_db):
+    created = services.create_user("before@example.com", "Before")
+    services.find_user_by_mail("before@example.com")
+    services.update_user(created.id, email="after@example.com", name="After")
+    assert services.find_user_by_mail("before@example.com") is None
+    assert services.find_user_by_mail("after@example.com").name == "After"
+
+def test_update_user_drops_old_email_when_id_was_evicted(sqlite_db):
+    created = services.create_user("before@example.com", "Before")
+    services.find_user_by_mail("before@example.com")
+    # LRU dropped the id key, the email key is still cached
+    user_cache.backend.delete(f"id:{created.id}")
+    services.update_user(created.id, email="after@example.com")
+    assert services.find_user_by_mail("before@example.com") is None
+    assert services.find_user_by_mail("after@example.com").email == "after@example.com"
@@ -0,0 +1,41 @@
+# Test the shared engine registry and pool metrics
+from sqlalchemy import create_engine, text
+
+from app import db
+
+
+def test_get_engine_is_shared_per_dsn(tmp_path):
+    url = f"sqlite:///{tmp_path / 'registry.db'}"
+    assert db.get_engine(url) is db.get_engine(url)
+    assert db.get_sessionmaker(url) is db.get_sessionmaker(url)
+    assert db.get_engine(f"sqlite:///{tmp_path / 'other.db'}") is not db.get_engine(url)
+
+def test_pool_metrics_counts_checkouts(tmp_path):
+    url = f"sqlite:///{tmp_path / 'metrics.db'}"
+    engine = db.get_engine(url)
+    for _ in range(3):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    metrics = db.pool_metrics(url)
+    assert metrics["checkouts"] == 3
+    assert metrics["checkins"] == 3
+
+def test_pool_metrics_unknown_dsn():
+    assert db.pool_metrics("sqlite:///never-built.db") == {}
+
+def test_metered_pool_records_wait(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'wait.db'}",
+        poolclass=db.MeteredQueuePool,
+        pool_size=1,
+        max_overflow=0,
+    )
+    engine.pool.metrics = db.PoolMetrics()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    engine.dispose()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    snapshot = engine.pool.metrics.snapshot()
+    assert snapshot["wait_max_ms"] >= 0
+    assert engine.pool.metrics.wait_total > 0
@@ -0,0 +1,54 @@
+# Check the planner uses the message indexes (PostgreSQL only)
+import json
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from app import db, models
+
+pytestmark = pytest.mark.skipif(
+    not db.database_url().startswith("postgresql"),
+    reason="EXPLAIN checks need PostgreSQL"
+)
+
+HOT_QUERIES = {
+    "ix_message_recipients_recipient_read":
+        "SELECT message_id, read, read_at FROM message_recipients WHERE recipient_id = :user_id",
+    "ix_message_recipients_unread":
+        "SELECT message_id FROM message_recipients WHERE recipient_id = :user_id AND read = false",
+    "ix_message_recipients_message_recipient":
+        "SELECT id FROM message_recipients WHERE message_id = :message_id AND recipient_id = :user_id",
+    "ix_messages_sender_timestamp":
+        "SELECT id FROM messages WHERE sender_id = :user_id ORDER BY timestamp DESC, id DESC LIMIT 50",
+    "ix_users_created_at_id":
+        "SELECT id FROM users WHERE (created_at, id) > (now(), :user_id) ORDER BY created_at, id LIMIT 50",
+    "ix_messages_thread":
+        "SELECT id FROM messages WHERE thread_id = :message_id ORDER BY timestamp, id",
+    "ix_messages_search":
+        "SELECT id FROM messages WHERE to_tsvector('simple', coalesce(subject, '') || ' ' || content)"
+        " @@ websearch_to_tsquery('simple', 'budget')",
+    "ix_users_email_pattern":
+        "SELECT id FROM users WHERE email LIKE 'user1%'",
+}
+
+def plan_indexes(node):
+    found = {node["Index Name"]} if "Index Name" in node else set()
+    for child in node.get("Plans", []):
+        found |= plan_indexes(child)
+    return found
+
+@pytest.mark.parametrize("index_name, query", HOT_QUERIES.items())
+def test_hot_queries_use_indexes(index_name, query):
+    db.bootstrap_schema(models.Base.metadata)
+    with db.get_engine().connect() as conn:
+        # Test tables are tiny; forbid seq scans so the plan shows which index is usable
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = conn.execute(
+            text(f"EXPLAIN (FORMAT JSON) {query}"),
+            {"user_id": uuid.uuid4(), "message_id": uuid.uuid4()}
+        ).scalar()
+        conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    assert index_name in plan_indexes(plan[0]["Plan"])
@@ -0,0 +1,379 @@
+# Test the MCP server's folder traversal against a fake BIM360 client
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import mcp_server
+from app.aps_index import FolderIndex
+
+# The autouse fixture replaces it, so no test reaches the real userinfo endpoint
+fetch_token_identity = mcp_server.fetch_token_identity
+
+
+class FakeBIM360:
+    """Serves a regular folder tree: `branching` subfolders and two files per folder."""
+
+    def __init__(self, branching=3, depth=2, latency=0.0):
+        self.branching = branching
+        self.depth = depth
+        self.latency = latency
+        # lastModifiedTime per folder id, and files added to folders
+        self.stamps = {}
+        self.added = {}
+        # Folders APS answers with an error instead of a listing
+        self.failing = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _request(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def get_folder_contents(self, project_id, folder_id):
+        with self._request():
+            if folder_id == "broken":
+                raise RuntimeError("listing failed")
+            if folder_id in self.failing:
+                return {"errors": [{"status": "503"}]}
+            data = [
+                {"type": "items", "id": f"{folder_id}:a", "attributes": {"fileType": "rvt"}},
+                {"type": "items", "id": f"{folder_id}:b", "attributes": {"fileType": "pdf"}},
+            ]
+            data += self.added.get(folder_id, [])
+            if folder_id.count("/") < self.depth:
+                data += [{
+                    "type": "folders",
+                    "id": f"{folder_id}/{i}",
+                    "attributes": {"lastModifiedTime": self.stamps.get(f"{folder_id}/{i}", "v1")}
+                } for i in range(self.branching)]
+            return {"data": data}
+
+@pytest.fixture(autouse=True)
+def empty_aps_cache(monkeypatch):
+    mcp_server.aps_cache.clear()
+    mcp_server.token_identities.clear()
+    # Tokens of the same user, as userinfo would report them
+    users = {"test-token": "user-1", "refreshed-token": "user-1"}
+    monkeypatch.setattr(mcp_server, "fetch_token_identity", lambda token: f"user:{users.get(token, token)}")
+    monkeypatch.setattr(mcp_server, "folder_index", FolderIndex())
+    monkeypatch.setattr(mcp_server, "index_sync_locks", {})
+    yield
+    mcp_server.aps_cache.clear()
+    mcp_server.aps_clients.close()
+
+def depth_first(bim360, folder_id):
+    items = []
+    for item in bim360.get_folder_contents("project", folder_id)["data"]:
+        if item["type"] == "folders":
+            items += depth_first(bim360, item["id"])
+        else:
+            items.append(item)
+    return items
+
+@pytest.mark.asyncio
+async def test_walk_folders_matches_depth_first_order():
+    bim360 = FakeBIM360(latency=0.005)
+    items, truncated = await mcp_server.walk_folders(bim360, "project", ["root"], concurrency=4)
+    assert [item["id"] for item in items] == [item["id"] for item in depth_first(FakeBIM360(), "root")]
+    assert len(items) == 2 * (1 + 3 + 9)
+    assert truncated is False
+    assert 1 < bim360.max_in_flight <= 4
+
+    rvt, _ = await mcp_server.walk_folders(bim360, "project", ["root"], file_type="RVT", concurrency=4)
+    assert {item["id"][-2:] for item in rvt} == {":a"}
+    # Every listing came from the cache the second time
+    assert bim360.calls == 13
+
+@pytest.mark.asyncio
+async def test_walk_folders_limits():
+    bim360 = FakeBIM360()
+    items, truncated = await mcp_server.walk_folders(bim360, "project", ["root"], max_depth=1, concurrency=2)
+    assert bim360.calls == 1 + 3
+    assert len(items) == 2 * 4
+    assert truncated is True
+
+    items, truncated = await mcp_server.walk_folders(FakeBIM360(), "project", ["root"], max_items=5, concurrency=1)
+    # Breadth-first, so the cap keeps the files nearest to the start folder
+    assert [item["id"] for item in items] == ["root:a", "root:b", "root/0:a", "root/0:b", "root/1:a"]
+    assert truncated is True
+
+@pytest.mark.asyncio
+async def test_walk_folders_propagates_errors():
+    with pytest.raises(RuntimeError):
+        await mcp_server.walk_folders(FakeBIM360(), "project", ["root", "broken"], concurrency=2)
+
+class SlowBIM360(FakeBIM360):
+    """Every call blocks for `latency` seconds, like a real HTTP round trip."""
+
+    def get_hubs(self):
+        with self._request():
+            return {"data": [{"id": "hub-1", "attributes": {"name": "Hub"}}]}
+
+    def get_projects(self, hub_id):
+        with self._request():
+            return {"data": [{"id": f"{hub_id}-project", "attributes": {"name": "Project"}}]}
+
+    def get_item_versions(self, project_id, item_id):
+        with self._request():
+            return {"data": [{"id": f"{item_id}-v1", "attributes": {"versionNumber": 1}}]}
+
+@pytest.fixture
+def slow_bim360(monkeypatch):
+    bim360 = SlowBIM360(latency=0.3)
+    bim360.built = 0
+
+    def client(token):
+        bim360.token = token
+        bim360.built += 1
+        return bim360
+
+    monkeypatch.setattr(mcp_server, "BIM360", client)
+    monkeypatch.setattr(mcp_server, "APS_TOKEN", "test-token")
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "token", None)
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "expires_at", 0)
+    return bim360
+
+@pytest.mark.asyncio
+async def test_tool_calls_overlap(slow_bim360):
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        mcp_server.get_hubs(),
+        mcp_server.get_projects("hub-1"),
+        mcp_server.get_versions("project", "item"),
+        mcp_server.get_hubs(),
+    )
+    elapsed = time.perf_counter() - start
+    ticking.cancel()
+    assert "Hub" in results[0] and "Project" in results[1] and "Version 1" in results[2]
+    # Four 0.3 s calls run side by side, and the event loop kept running meanwhile
+    assert slow_bim360.max_in_flight == 4
+    assert elapsed < 0.3 * 2
+    assert ticks > 10
+
+@pytest.mark.asyncio
+async def test_executor_bounds_blocking_calls(slow_bim360, monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(mcp_server, "aps_executor", executor)
+    try:
+        await asyncio.gather(*(mcp_server.get_hubs() for _ in range(4)))
+    finally:
+        executor.shutdown()
+    assert slow_bim360.max_in_flight == 2
+
+@pytest.mark.asyncio
+async def test_responses_are_cached_per_user(slow_bim360, monkeypatch):
+    slow_bim360.latency = 0
+    await mcp_server.get_hubs()
+    await mcp_server.get_projects("hub-1")
+    await mcp_server.get_hubs()
+    await mcp_server.get_projects("hub-1")
+    assert slow_bim360.calls == 2
+
+    await mcp_server.get_hubs(force_refresh=True)
+    assert slow_bim360.calls == 3
+
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "token", "other-token")
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "expires_at", time.time() + 60)
+    await mcp_server.get_hubs()
+    assert slow_bim360.calls == 4
+
+    # A refreshed token of the first user still finds its responses
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "token", "refreshed-token")
+    await mcp_server.get_hubs()
+    await mcp_server.get_projects("hub-1")
+    assert slow_bim360.calls == 4
+
+class UserinfoHandler(BaseHTTPRequestHandler):
+    """userinfo for "Bearer user-token", 401 for "Bearer revoked-token", 403 (no user-profile:read) otherwise."""
+
+    def do_GET(self):
+        if self.headers["Authorization"] == "Bearer revoked-token":
+            self.send_error(401)
+            return
+        if self.headers["Authorization"] != "Bearer user-token":
+            self.send_error(403)
+            return
+        body = b'{"sub": "APS-USER-1"}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def userinfo(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UserinfoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(mcp_server, "APS_USERINFO_URL", f"http://127.0.0.1:{server.server_port}/userinfo")
+    monkeypatch.setattr(mcp_server, "fetch_token_identity", fetch_token_identity)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_token_identity_from_userinfo(userinfo):
+    assert fetch_token_identity("user-token") == "user:APS-USER-1"
+    assert fetch_token_identity("revoked-token") is None
+    # userinfo cannot tell: the token is its own identity
+    assert fetch_token_identity("scopeless-token") == "token:scopeless-token"
+    userinfo.shutdown()
+    userinfo.server_close()
+    assert fetch_token_identity("user-token") == "token:user-token"
+
+@pytest.mark.asyncio
+async def test_rejected_tokens_never_share_cached_responses(userinfo, slow_bim360, monkeypatch):
+    slow_bim360.latency = 0
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "expires_at", time.time() + 60)
+    for token in ("scopeless-a", "scopeless-b"):
+        monkeypatch.setitem(mcp_server.TOKEN_CACHE, "token", token)
+        await mcp_server.get_hubs()
+        await mcp_server.get_hubs()
+    # Each token fetched once and then hit only its own entry
+    assert slow_bim360.calls == 2
+
+    # A revoked token is never answered from the cache
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "token", "revoked-token")
+    await mcp_server.get_hubs()
+    await mcp_server.get_hubs()
+    assert slow_bim360.calls == 4
+    assert mcp_server.token_identities.get("revoked-token") is None
+
+@pytest.mark.asyncio
+async def test_tools_share_one_client_per_token(slow_bim360, monkeypatch):
+    slow_bim360.latency = 0
+    await mcp_server.get_hubs(force_refresh=True)
+    await mcp_server.get_projects("hub-1", force_refresh=True)
+    await mcp_server.get_versions("project", "item", force_refresh=True)
+    assert slow_bim360.built == 1
+
+    # A rotated token rebuilds the client once
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "token", "rotated-token")
+    monkeypatch.setitem(mcp_server.TOKEN_CACHE, "expires_at", time.time() + 60)
+    await mcp_server.get_hubs(force_refresh=True)
+    await mcp_server.get_hubs(force_refresh=True)
+    assert slow_bim360.built == 2
+    assert slow_bim360.token == "rotated-token"
+    assert mcp_server.aps_clients.stats()["clients"] == 1
+
+@pytest.mark.asyncio
+async def test_project_files_relists_only_changed_folders(monkeypatch):
+    bim360 = FakeBIM360()
+    monkeypatch.setattr(mcp_server, "BIM360", lambda token: bim360)
+    monkeypatch.setattr(mcp_server, "APS_TOKEN", "test-token")
+    mcp_server.id_masker.register_project_hub("project", "hub")
+
+    result = await mcp_server.get_project_files("project", folder_id="root")
+    assert result.startswith("Found 26 files")
+    assert bim360.calls == 13
+    # Within APS_INDEX_SYNC_INTERVAL the index answers alone
+    assert (await mcp_server.get_project_files("project", folder_id="root", file_type="pdf")).startswith("Found 13 files")
+    assert bim360.calls == 13
+
+    monkeypatch.setattr(mcp_server, "APS_INDEX_SYNC_INTERVAL", 0)
+    bim360.added["root/1/2"] = [{"type": "items", "id": "root/1/2:new", "attributes": {"fileType": "dwg"}}]
+    # Assuming APS moves the stamps of every folder above the change
+    bim360.stamps.update({"root/1": "v2", "root/1/2": "v2"})
+    result = await mcp_server.get_project_files("project", folder_id="root", file_type="dwg")
+    assert result.startswith("Found 1 files")
+    # The start folder, then only the two folders whose stamp changed
+    assert bim360.calls == 13 + 3
+
+    await mcp_server.get_project_files("project", folder_id="root", force_refresh=True)
+    assert bim360.calls == 16 + 13
+
+@pytest.mark.asyncio
+async def test_project_files_full_resync_after_max_age(monkeypatch):
+    bim360 = FakeBIM360()
+    monkeypatch.setattr(mcp_server, "BIM360", lambda token: bim360)
+    monkeypatch.setattr(mcp_server, "APS_TOKEN", "test-token")
+    monkeypatch.setattr(mcp_server, "APS_INDEX_SYNC_INTERVAL", 0)
+    mcp_server.id_masker.register_project_hub("project", "hub")
+    await mcp_server.get_project_files("project", folder_id="root")
+    assert bim360.calls == 13
+
+    # A change two levels down whose stamp did not reach root/1: stamps alone miss it
+    bim360.added["root/1/2"] = [{"type": "items", "id": "root/1/2:new", "attributes": {"fileType": "dwg"}}]
+    bim360.stamps["root/1/2"] = "v2"
+    assert (await mcp_server.get_project_files("project", folder_id="root", file_type="dwg")).startswith("No files")
+    assert bim360.calls == 13 + 1
+
+    # Past APS_INDEX_MAX_AGE the whole tree is listed again
+    monkeypatch.setattr(mcp_server, "APS_INDEX_MAX_AGE", 1e-6)
+    assert (await mcp_server.get_project_files("project", folder_id="root", file_type="dwg")).startswith("Found 1 files")
+    assert bim360.calls == 13 + 1 + 13
+
+@pytest.mark.asyncio
+async def test_project_files_failed_listing_is_not_a_sync(monkeypatch):
+    bim360 = FakeBIM360()
+    monkeypatch.setattr(mcp_server, "BIM360", lambda token: bim360)
+    monkeypatch.setattr(mcp_server, "APS_TOKEN", "test-token")
+    mcp_server.id_masker.register_project_hub("project", "hub")
+
+    # The first, full sync fails below the start folder: neither sync is recorded
+    bim360.failing.add("root/2")
+    result = await mcp_server.get_project_files("project", folder_id="root")
+    assert "1 folders could not be listed" in result
+    assert mcp_server.folder_index.synced_at("project", ["root"]) is None
+    assert mcp_server.folder_index.synced_at("project", ["root"], full=True) is None
+    bim360.failing.clear()
+    assert (await mcp_server.get_project_files("project", folder_id="root")).startswith("Found 26 files")
+    calls = bim360.calls
+
+    # A changed folder two levels down fails after its parent stored the new stamp
+    monkeypatch.setattr(mcp_server, "APS_INDEX_SYNC_INTERVAL", 0)
+    bim360.added["root/1/2"] = [{"type": "items", "id": "root/1/2:new", "attributes": {"fileType": "dwg"}}]
+    bim360.stamps.update({"root/1": "v2", "root/1/2": "v2"})
+    bim360.failing.add("root/1/2")
+    result = await mcp_server.get_project_files("project", folder_id="root", file_type="dwg")
+    assert "could not be listed" in result
+    assert mcp_server.folder_index.synced_at("project", ["root"]) is None
+
+    # The next sync still finds its way down to it, stamps unchanged
+    monkeypatch.setattr(mcp_server, "APS_INDEX_SYNC_INTERVAL", 60)
+    bim360.failing.clear()
+    calls = bim360.calls
+    result = await mcp_server.get_project_files("project", folder_id="root", file_type="dwg")
+    assert result.startswith("Found 1 files") and "could not be listed" not in result
+    assert bim360.calls == calls + 3
+
+@pytest.mark.asyncio
+async def test_concurrent_project_files_share_one_sync(monkeypatch):
+    bim360 = FakeBIM360(latency=0.01)
+    monkeypatch.setattr(mcp_server, "BIM360", lambda token: bim360)
+    monkeypatch.setattr(mcp_server, "APS_TOKEN", "test-token")
+    mcp_server.id_masker.register_project_hub("project", "hub")
+
+    results = await asyncio.gather(*(mcp_server.get_project_files("project", folder_id="root") for _ in range(4)))
+    assert all(result.startswith("Found 26 files") for result in results)
+    # One sync of the 13 folders, the other calls answered from the index it built
+    assert bim360.calls == 13
+
+    # force_refresh still syncs again
+    await asyncio.gather(*(mcp_server.get_project_files("project", folder_id="root", force_refresh=True) for _ in range(2)))
+    assert bim360.calls == 13 * 3
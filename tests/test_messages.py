@@ -1,9 +1,15 @@
 # Test message-related functionality
+import json
+import time
+import uuid
+
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 
 # app = FastAPI()
 client = TestClient(app)
+pytestmark = pytest.mark.usefixtures("app_lifespan")
 
 ### Test Cases
 def send_message(sender_email, recipient_emails, subject, content):
@@ -30,6 +36,16 @@ def test_send_message():
     assert data["sender"] == "user1@gmail.com"
     assert data["subject"] == "Test Subject"
     assert data["content"] == "This is a test message."
+def test_send_message_unknown_recipient():
+    response = send_message(
+        sender_email="user1@gmail.com",
+        recipient_emails=["user2@gmail.com", "nobody-here@gmail.com"],
+        subject="Test Subject",
+        content="This is a test message."
+    )
+    assert response.status_code == 404
+    data = response.json()
+    assert data["detail"] == "Recipient user with email nobody-here@gmail.com not found"
 def test_send_message_invalid_sender():
     response = send_message(
         sender_email="user1",
@@ -191,6 +207,22 @@ def test_get_inbox_messages_empty_email():
     data = response.json()
     assert "detail" in data
     assert "email" in data["detail"][0]["loc"]
+def test_get_inbox_messages_invalid_cursor():
+    response = client.post(
+        "/api/message/inbox",
+        json={"email": "user2@gmail.com", "cursor": "not-a-cursor"}
+    )
+    assert response.status_code == 400
+    data = response.json()
+    assert data["detail"] == "Invalid cursor"
+def test_get_inbox_messages_invalid_limit():
+    response = client.post(
+        "/api/message/inbox",
+        json={"email": "user2@gmail.com", "limit": 0}
+    )
+    assert response.status_code == 422
+    data = response.json()
+    assert "limit" in data["detail"][0]["loc"]
 def test_get_unread_inbox_messages():
     response = client.post(
         "/api/message/inboxUnread",
@@ -221,6 +253,22 @@ def test_get_unread_inbox_messages_nonexistent_email():
     data = response.json()
     assert "detail" in data
     assert data["detail"] == "No messages found in the inbox for the given email"
+def test_get_unread_count():
+    response = client.post(
+        "/api/message/unreadCount",
+        json={"email": "user2@gmail.com"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["mailUser"] == "user2@gmail.com"
+    assert data["unread"] > 0
+def test_get_unread_count_nonexistent_email():
+    response = client.post(
+        "/api/message/unreadCount",
+        json={"email": "alice.smithdsads@example.com"}
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "User not found"
 def test_get_message_with_all_recipients():
     response = client.get(
         "/api/message/senderDetail/899c237d-3303-4709-b7f4-6473d289ec2b"
@@ -272,3 +320,213 @@ def test_mark_message_as_read_missing_fields():
     assert "message_id" in data["detail"][0]["loc"]
     assert "recipient_id" in data["detail"][1]["loc"]
 
+def test_mark_messages_as_read_bulk():
+    response = client.post(
+        "/api/message/markAsReadBulk",
+        json={
+    "recipient_id": "a7ecbe2a-d72d-434a-8dc5-80e1d076a204",
+    "before": "2000-01-01T00:00:00"
+}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["updated"] == 0
+    assert data["messages"] == []
+def test_mark_messages_as_read_bulk_invalid():
+    response = client.post(
+        "/api/message/markAsReadBulk",
+        json={
+    "recipient_id": "a7ecbe2a-d72d-434a-8dc5-80e1d076a204"
+}
+    )
+    assert response.status_code == 422
+    response = client.post(
+        "/api/message/markAsReadBulk",
+        json={
+    "recipient_id": "invalid-id",
+    "message_ids": []
+}
+    )
+    assert response.status_code == 400
+def test_get_inbox_summary():
+    response = client.post(
+        "/api/message/inboxSummary",
+        json={"email": "user2@gmail.com", "preview_length": 5}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["mailUser"] == "user2@gmail.com"
+    assert "content" not in data["messages"][0]
+    assert len(data["messages"][0]["preview"]) <= 5
+def test_export_mailbox():
+    response = client.post(
+        "/api/message/export",
+        json={"email": "user2@gmail.com"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert "received" in {line["direction"] for line in lines}
+    assert all("content" in line for line in lines)
+def test_export_mailbox_nonexistent_email():
+    response = client.post(
+        "/api/message/export",
+        json={"email": "alice.smithdsads@example.com"}
+    )
+    assert response.status_code == 404
+def test_search_messages():
+    response = client.post(
+        "/api/message/search",
+        json={"email": "user2@gmail.com", "query": "Test"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["query"] == "Test"
+    assert data["messages"] != []
+    ranks = [message["rank"] for message in data["messages"]]
+    assert ranks == sorted(ranks, reverse=True)
+def test_search_messages_no_match():
+    response = client.post(
+        "/api/message/search",
+        json={"email": "user2@gmail.com", "query": "zzzunmatchedzzz"}
+    )
+    assert response.status_code == 200
+    assert response.json()["messages"] == []
+def test_reply_and_get_thread():
+    original = send_message("user1@gmail.com", ["user2@gmail.com"], "Thread start", "First").json()
+    response = client.post(
+        "/api/message/sendMessage",
+        json={
+            "sender_email": "user2@gmail.com",
+            "recipient_email": ["user1@gmail.com"],
+            "subject": "Re: Thread start",
+            "content": "Second",
+            "in_reply_to": original["id"]
+        }
+    )
+    assert response.status_code == 200
+    reply = response.json()
+    assert reply["thread_id"] == original["id"]
+    assert reply["in_reply_to"] == original["id"]
+
+    response = client.post("/api/message/thread", json={"email": "user1@gmail.com", "thread_id": original["id"]})
+    assert response.status_code == 200
+    assert [message["content"] for message in response.json()["messages"]] == ["First", "Second"]
+
+    response = client.post("/api/message/threads", json={"email": "user2@gmail.com"})
+    assert response.status_code == 200
+    threads = {thread["thread_id"]: thread for thread in response.json()["threads"]}
+    assert threads[original["id"]]["messages"] == 1
+def test_reply_to_unknown_message():
+    response = client.post(
+        "/api/message/sendMessage",
+        json={
+            "sender_email": "user3@gmail.com",
+            "recipient_email": ["user1@gmail.com"],
+            "subject": "Re",
+            "content": "Hi",
+            "in_reply_to": "899c237d-3303-4709-b7f4-6473d289ec2b"
+        }
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Message to reply to not found"
+def test_get_thread_invalid_id():
+    response = client.post("/api/message/thread", json={"email": "user1@gmail.com", "thread_id": "invalid-id"})
+    assert response.status_code == 400
+def test_send_message_idempotency_key():
+    key = f"test-{uuid.uuid4()}"
+    body = {
+        "sender_email": "user1@gmail.com",
+        "recipient_email": ["user2@gmail.com"],
+        "subject": "Idempotent",
+        "content": "Sent once"
+    }
+    first = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert first.status_code == 200
+    retry = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    sent = client.post("/api/message/byMail", json={"email": "user1@gmail.com", "limit": 100}).json()["messages"]
+    assert [message["subject"] for message in sent].count("Idempotent") == 1
+
+    response = client.post(
+        "/api/message/sendMessage", json={**body, "content": "Something else"}, headers={"Idempotency-Key": key}
+    )
+    assert response.status_code == 422
+def test_send_message_reuses_expired_idempotency_key(monkeypatch):
+    from datetime import timedelta
+    from app import async_services, services
+    from app.cache import LRUTTLCache
+
+    # Time passes for the database through the cutoff, for the cache through its clock
+    elapsed = [0.0]
+    cutoff = services.idempotency_cutoff
+    monkeypatch.setattr(services, "idempotency_cutoff", lambda: cutoff() + timedelta(seconds=elapsed[0]))
+    cache = LRUTTLCache(100, services.IDEMPOTENCY_TTL, clock=lambda: elapsed[0])
+    monkeypatch.setattr(services, "idempotency_cache", cache)
+    monkeypatch.setattr(async_services, "idempotency_cache", cache)
+
+    key = f"test-{uuid.uuid4()}"
+    body = {
+        "sender_email": "user1@gmail.com",
+        "recipient_email": ["user2@gmail.com"],
+        "subject": "Expiring key",
+        "content": "Sent twice"
+    }
+    first = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert first.status_code == 200
+
+    # Read from the database 2 s before the key expires: cached for those 2 s only
+    cache.clear()
+    elapsed[0] = services.IDEMPOTENCY_TTL - 2
+    retry = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert retry.json()["id"] == first.json()["id"]
+
+    # Expired but not purged yet: a new send under the same key
+    elapsed[0] = services.IDEMPOTENCY_TTL + 1
+    retry = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert retry.status_code == 200
+    assert retry.json()["id"] != first.json()["id"]
+def test_send_message_fanout(monkeypatch):
+    from app import fanout
+
+    monkeypatch.setattr(fanout, "FANOUT_THRESHOLD", 2)
+    response = send_message("user1@gmail.com", ["user2@gmail.com", "user3@gmail.com"], "Fan-out", "To everyone")
+    assert response.status_code == 202
+    accepted = response.json()
+    assert accepted["status"] == "pending"
+    assert accepted["message"]["recipients"] == ["user2@gmail.com", "user3@gmail.com"]
+
+    for _ in range(50):
+        job = client.get(f"/api/message/jobs/{accepted['job_id']}").json()
+        if job["status"] == "done":
+            break
+        time.sleep(0.05)
+    assert (job["status"], job["delivered"], job["total"]) == ("done", 2, 2)
+    assert job["message_id"] == accepted["message"]["id"]
+    inbox = client.post("/api/message/inbox", json={"email": "user3@gmail.com", "limit": 100}).json()["messages"]
+    assert accepted["message"]["id"] in [message["id"] for message in inbox]
+def test_send_message_fanout_idempotency_key(monkeypatch):
+    from app import fanout
+    from app.cache import idempotency_cache
+
+    monkeypatch.setattr(fanout, "FANOUT_THRESHOLD", 2)
+    key = f"test-{uuid.uuid4()}"
+    body = {
+        "sender_email": "user1@gmail.com",
+        "recipient_email": ["user2@gmail.com", "user3@gmail.com"],
+        "subject": "Idempotent fan-out",
+        "content": "Queued once"
+    }
+    first = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert first.status_code == 202
+    # Replayed from the in-process cache, then from the database
+    retry = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert (retry.status_code, retry.json()) == (202, first.json())
+    idempotency_cache.clear()
+    retry = client.post("/api/message/sendMessage", json=body, headers={"Idempotency-Key": key})
+    assert (retry.status_code, retry.json()) == (202, first.json())
+    assert client.get(f"/api/message/jobs/{first.json()['job_id']}").status_code == 200
+def test_fanout_job_not_found():
+    response = client.get(f"/api/message/jobs/{uuid.uuid4()}")
+    assert response.status_code == 404
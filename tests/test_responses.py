@@ -0,0 +1,46 @@
+# The fast JSON path must produce the same payloads as the validated models
+import pytest
+from fastapi.testclient import TestClient
+
+from app import db, routes, services
+from app.main import app
+from app.responses import FastJSONResponse, fields_of
+from app.schemas import InboxMessage
+from tests.test_services import make_users
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def seeded(sqlite_db, monkeypatch):
+    # TestClient without lifespan runs every request on a new loop, keep to the sync services
+    monkeypatch.setattr(db, "DB_BACKEND", "sync")
+    sender, alice, bob = make_users("sender", "alice", "bob")
+    created = [services.create_message(sender, [alice, bob], f"Subject {i}", f"Body {i}") for i in range(3)]
+    services.find_message_recipient_detail(created[0]["id"], alice.id)
+    return created
+
+def fetch_both(monkeypatch, method, url, **kwargs):
+    bodies = []
+    for fast in (False, True):
+        monkeypatch.setattr(routes, "FAST_JSON_RESPONSES", fast)
+        response = client.request(method, url, **kwargs)
+        assert response.status_code == 200
+        bodies.append(response.json())
+    return bodies
+
+@pytest.mark.parametrize("method, url, body", [
+    ("GET", "/api/users", None),
+    ("POST", "/api/message/byMail", {"email": "sender@example.com", "limit": 2}),
+    ("POST", "/api/message/inbox", {"email": "alice@example.com"}),
+    ("POST", "/api/message/inboxUnread", {"email": "bob@example.com"}),
+    ("POST", "/api/message/inboxSummary", {"email": "alice@example.com", "preview_length": 3}),
+])
+def test_fast_path_matches_models(seeded, monkeypatch, method, url, body):
+    validated, fast = fetch_both(monkeypatch, method, url, json=body)
+    assert fast == validated
+
+def test_fast_response_renders_uuid_and_datetime(seeded):
+    entry = services.find_message_inbox("alice@example.com")[0]
+    body = FastJSONResponse(fields_of(InboxMessage, entry)).body
+    assert InboxMessage.model_validate_json(body) == InboxMessage.from_orm(entry)
@@ -0,0 +1,365 @@
+# Test the sync service layer against a throwaway SQLite database
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import services
+
+
+@contextmanager
+def count_queries(engine):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+def make_users(*names):
+    return [services.create_user(f"{name}@example.com", name.title()) for name in names]
+
+def test_inbox_query_count_is_constant(sqlite_db):
+    sender, other, recipient = make_users("sender", "other", "recipient")
+    counts = []
+    for batch in (1, 25):
+        for i in range(batch):
+            services.create_message(sender if i % 2 else other, [recipient], f"Subject {i}", "Body")
+        with count_queries(sqlite_db) as statements:
+            inbox = services.find_message_inbox(recipient.email)
+        counts.append(len(statements))
+    assert len(inbox) == 26
+    assert counts == [1, 1]
+
+    with count_queries(sqlite_db) as statements:
+        unread = services.find_message_inbox_unread(recipient.email)
+    assert len(unread) == 26
+    assert len(statements) == 1
+    assert {entry["sender"] for entry in unread} == {sender.email, other.email}
+
+def test_inbox_unknown_recipient(sqlite_db):
+    assert services.find_message_inbox("nobody@example.com") == []
+    assert services.find_message_inbox_unread("nobody@example.com") == []
+
+def collect_pages(fetch, limit):
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = fetch(limit, cursor)
+        seen.extend(page["messages"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen, pages
+
+def test_inbox_keyset_pagination(sqlite_db):
+    sender, recipient = make_users("sender", "recipient")
+    for i in range(7):
+        services.create_message(sender, [recipient], f"Subject {i}", "Body")
+
+    first = services.find_message_inbox_page(recipient.email, 3)
+    assert len(first["messages"]) == 3
+    # A message arriving between pages must not shift the following pages
+    services.create_message(sender, [recipient], "Late", "Body")
+    rest, pages = collect_pages(
+        lambda limit, cursor: services.find_message_inbox_page(recipient.email, limit, cursor or first["next_cursor"]), 3
+    )
+    subjects = [entry["subject"] for entry in first["messages"] + rest]
+    assert subjects == [f"Subject {i}" for i in reversed(range(7))]
+    assert pages == 2
+
+    unread, _ = collect_pages(
+        lambda limit, cursor: services.find_message_inbox_page(recipient.email, limit, cursor, unread_only=True), 5
+    )
+    assert len(unread) == 8
+
+def test_sent_keyset_pagination(sqlite_db):
+    sender, recipient = make_users("sender", "recipient")
+    created = [services.create_message(sender, [recipient], f"Subject {i}", "Body")["id"] for i in range(5)]
+    messages, pages = collect_pages(lambda limit, cursor: services.find_message_by_mail_page(sender.email, limit, cursor), 2)
+    assert [message.id for message in messages] == list(reversed(created))
+    assert pages == 3
+
+def test_invalid_cursor(sqlite_db):
+    with pytest.raises(ValueError):
+        services.find_message_inbox_page("someone@example.com", 10, "not-a-cursor")
+
+def test_create_message_single_transaction(sqlite_db):
+    sender, *recipients = make_users("sender", "r1", "r2", "r3")
+    with count_queries(sqlite_db) as statements:
+        created = services.create_message(sender, recipients, "Broadcast", "Body")
+    inserts = [statement for statement in statements if statement.startswith("INSERT")]
+    # One INSERT for the message, one batched INSERT for all recipient rows
+    # and one batched upsert of the unread counters
+    assert len(inserts) == 3
+    assert created["recipients"] == [recipient.email for recipient in recipients]
+    for recipient in recipients:
+        inbox = services.find_message_inbox(recipient.email)
+        assert [entry["id"] for entry in inbox] == [created["id"]]
+        assert inbox[0]["read"] is False
+
+def test_idempotent_create_message(sqlite_db, monkeypatch):
+    from app.cache import idempotency_cache
+
+    sender, recipient = make_users("sender", "recipient")
+    fingerprint = services.request_fingerprint("sender", "hello")
+    created = services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", fingerprint))
+    # Same key again: the stored row makes the whole send fail, nothing is written twice
+    assert services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", fingerprint)) is None
+    assert len(services.find_message_inbox(recipient.email)) == 1
+    assert services.find_unread_count(recipient.email) == 1
+
+    idempotency_cache.clear()
+    with count_queries(sqlite_db) as statements:
+        stored = services.find_idempotent_response("key-1")
+        assert services.find_idempotent_response("key-1") == stored
+    # Second lookup served from the cache
+    assert len(statements) == 1
+    assert stored["fingerprint"] == fingerprint
+    assert stored["response"]["id"] == str(created["id"])
+    assert stored["response"]["recipients"] == [recipient.email]
+
+    idempotency_cache.clear()
+    monkeypatch.setattr(services, "IDEMPOTENCY_TTL", -1)
+    assert services.find_idempotent_response("key-1") is None
+    assert services.purge_idempotency_keys() == 1
+
+def test_expired_idempotency_key_is_reused_before_purge(sqlite_db, monkeypatch):
+    from app.cache import idempotency_cache
+
+    sender, recipient = make_users("sender", "recipient")
+    fingerprint = services.request_fingerprint("sender", "hello")
+    first = services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", fingerprint))
+    idempotency_cache.clear()
+    # Expired but still in the table: the send goes through and takes the key over
+    monkeypatch.setattr(services, "IDEMPOTENCY_TTL", -1)
+    second = services.create_message(sender, [recipient], "Hello", "Body", idempotency=("key-1", fingerprint))
+    assert second is not None and second["id"] != first["id"]
+
+    idempotency_cache.clear()
+    monkeypatch.setattr(services, "IDEMPOTENCY_TTL", 60)
+    assert services.find_idempotent_response("key-1")["response"]["id"] == str(second["id"])
+    assert services.purge_idempotency_keys() == 0
+
+def test_fanout_job_delivers_in_batches(sqlite_db):
+    sender, *recipients = make_users("sender", "r1", "r2", "r3", "r4", "r5")
+    queued = services.create_message_fanout(sender, recipients, "Broadcast", "Body")
+    assert queued["message"]["recipients"] == [recipient.email for recipient in recipients]
+    assert services.find_message_inbox(recipients[0].email) == []
+    assert services.pending_fanout_jobs() == [queued["job_id"]]
+
+    assert services.deliver_fanout_batch(queued["job_id"], 2) == 2
+    job = services.find_fanout_job(queued["job_id"])
+    assert (job["status"], job["delivered"], job["total"]) == ("running", 2, 5)
+
+    job = services.run_fanout_job(queued["job_id"], 2)
+    assert (job["status"], job["delivered"]) == ("done", 5)
+    assert services.pending_fanout_jobs() == []
+    # A finished job is never delivered twice
+    assert services.deliver_fanout_batch(queued["job_id"], 2) == 0
+    for recipient in recipients:
+        assert [entry["id"] for entry in services.find_message_inbox(recipient.email)] == [queued["message"]["id"]]
+        assert services.find_unread_count(recipient.email) == 1
+
+def test_find_users_by_mails_single_query(sqlite_db):
+    make_users("alice", "bob")
+    emails = ["bob@example.com", "ghost@example.com", "alice@example.com", "bob@example.com", "nobody@example.com"]
+    with count_queries(sqlite_db) as statements:
+        resolved = services.find_users_by_mails(emails)
+    assert len(statements) == 1
+    assert set(resolved["users"]) == {"alice@example.com", "bob@example.com"}
+    assert resolved["missing"] == ["ghost@example.com", "nobody@example.com"]
+
+def test_unread_count_is_maintained(sqlite_db):
+    sender, alice, bob = make_users("sender", "alice", "bob")
+    first = services.create_message(sender, [alice, bob], "One", "Body")
+    services.create_message(sender, [alice], "Two", "Body")
+    assert services.find_unread_count(alice.email) == 2
+    assert services.find_unread_count(bob.email) == 1
+    assert services.find_unread_count(sender.email) == 0
+    assert services.find_unread_count("nobody@example.com") is None
+
+    services.find_message_recipient_detail(first["id"], alice.id)
+    # Reading the same message again must not decrement twice
+    services.find_message_recipient_detail(first["id"], alice.id)
+    assert services.find_unread_count(alice.email) == 1
+
+    with count_queries(sqlite_db) as statements:
+        services.find_unread_count(alice.email)
+    assert len(statements) == 1
+
+def test_rebuild_unread_counts(sqlite_db):
+    sender, alice = make_users("sender", "alice")
+    services.create_message(sender, [alice], "One", "Body")
+    assert services.rebuild_unread_counts(repair=False)["mismatched"] == 0
+
+    with sqlite_db.begin() as conn:
+        conn.execute(services.update(services.models.UnreadCount).values(unread=7))
+    report = services.rebuild_unread_counts(repair=False)
+    assert report["mismatched"] == 1
+    assert services.find_unread_count(alice.email) == 7
+
+    services.rebuild_unread_counts()
+    assert services.find_unread_count(alice.email) == 1
+
+def test_mark_messages_read_by_ids(sqlite_db):
+    sender, alice, bob = make_users("sender", "alice", "bob")
+    created = [services.create_message(sender, [alice, bob], f"Subject {i}", "Body")["id"] for i in range(4)]
+    with count_queries(sqlite_db) as statements:
+        marked = services.mark_messages_read(alice.id, message_ids=[str(created[0]), created[1]])
+    # One UPDATE ... RETURNING plus the counter update
+    assert len(statements) == 2
+    assert {entry["message_id"] for entry in marked} == set(created[:2])
+    assert services.find_unread_count(alice.email) == 2
+    assert services.find_unread_count(bob.email) == 4
+
+    # Already read ids and messages of someone else are skipped
+    again = services.mark_messages_read(alice.id, message_ids=created[:3])
+    assert [entry["message_id"] for entry in again] == [created[2]]
+    assert services.mark_messages_read(sender.id, message_ids=created) == []
+    assert services.find_unread_count(alice.email) == 1
+
+def test_mark_messages_read_before(sqlite_db):
+    sender, alice = make_users("sender", "alice")
+    created = [services.create_message(sender, [alice], f"Subject {i}", "Body") for i in range(3)]
+    marked = services.mark_messages_read(alice.id, before=created[2]["timestamp"])
+    assert {entry["message_id"] for entry in marked} == {created[0]["id"], created[1]["id"]}
+    unread = services.find_message_inbox_unread(alice.email)
+    assert [entry["id"] for entry in unread] == [created[2]["id"]]
+    assert services.find_unread_count(alice.email) == 1
+
+def test_mark_messages_read_invalid_arguments(sqlite_db):
+    with pytest.raises(ValueError):
+        services.mark_messages_read("not-a-uuid", message_ids=[])
+    with pytest.raises(ValueError):
+        services.mark_messages_read("a7ecbe2a-d72d-434a-8dc5-80e1d076a204")
+
+def test_inbox_summary_skips_content(sqlite_db):
+    sender, recipient = make_users("sender", "recipient")
+    for i in range(3):
+        services.create_message(sender, [recipient], f"Subject {i}", f"{i} " + "x" * 500)
+
+    with count_queries(sqlite_db) as statements:
+        page = services.find_message_inbox_summary_page(recipient.email, 2)
+    assert "content" not in statements[0].split("FROM")[0]
+    assert [entry["subject"] for entry in page["messages"]] == ["Subject 2", "Subject 1"]
+    assert page["messages"][0]["preview"] is None
+
+    rest = services.find_message_inbox_summary_page(recipient.email, 2, page["next_cursor"], preview_length=10)
+    assert rest["messages"][0]["preview"] == "0 xxxxxxxx"
+    assert rest["next_cursor"] is None
+
+def test_export_mailbox(sqlite_db):
+    sender, alice, bob, carol = make_users("sender", "alice", "bob", "carol")
+    first = services.create_message(sender, [alice, bob, carol], "To three", "Body")
+    second = services.create_message(sender, [alice], "To one", "Body")
+    reply = services.create_message(alice, [sender], "Reply", "Body")
+    services.find_message_recipient_detail(first["id"], bob.id)
+
+    # A batch smaller than one message's recipient rows must not split the message
+    entries = list(services.export_mailbox(sender.email, batch_size=2))
+    assert [(entry["direction"], entry["id"]) for entry in entries] == [
+        ("sent", second["id"]), ("sent", first["id"]), ("received", reply["id"])
+    ]
+    read = {recipient["email"]: recipient["read"] for recipient in entries[1]["recipients"]}
+    assert read == {alice.email: False, bob.email: True, carol.email: False}
+    assert entries[2]["content"] == "Body"
+    assert list(services.export_mailbox("nobody@example.com")) == []
+
+def test_parse_user_import():
+    from app.schemas import normalize_email
+    body = "email,name\nann@example.com,Ann\nnot-an-email,Bad\nann@example.com,Ann again\nbob@example.com,\n"
+    rows, conflicts = services.parse_user_import(body, "csv", normalize_email)
+    assert rows == [{"line": 2, "email": "ann@example.com", "name": "Ann"}]
+    assert [(conflict["line"], conflict["reason"].split(":")[0]) for conflict in conflicts] == [
+        (3, "invalid"), (4, "duplicate in file"), (5, "invalid")
+    ]
+
+    body = '{"email": "ann@example.com", "name": "Ann"}\n\nnot json\n[1]\n'
+    rows, conflicts = services.parse_user_import(body, "ndjson", normalize_email)
+    assert [row["line"] for row in rows] == [1]
+    assert [conflict["line"] for conflict in conflicts] == [3, 4]
+
+    with pytest.raises(ValueError):
+        services.parse_user_import("mail,name\n", "csv", normalize_email)
+
+def test_import_users(sqlite_db):
+    existing, = make_users("existing")
+    rows = [{"line": i + 2, "email": f"import{i}@example.com", "name": f"Import {i}"} for i in range(2500)]
+    rows.append({"line": 2502, "email": existing.email, "name": "Existing"})
+    with count_queries(sqlite_db) as statements:
+        result = services.import_users(rows)
+    # Multi-row INSERT ... ON CONFLICT DO NOTHING in batches of USER_IMPORT_BATCH_SIZE
+    assert len([statement for statement in statements if statement.startswith("INSERT")]) == 3
+    assert result == {"created": 2500, "conflicts": [{"line": 2502, "email": existing.email, "reason": "already exists"}]}
+    assert services.find_user_by_mail("import2499@example.com").name == "Import 2499"
+    assert services.import_users(rows[:10])["created"] == 0
+
+def test_users_keyset_pagination(sqlite_db):
+    make_users("bob", "ann", "bo_b", "carl", "bobby")
+    page = services.find_users_page(2)
+    rest = services.find_users_page(10, page["next_cursor"])
+    listed = [user.email for user in page["users"] + rest["users"]]
+    assert listed == ["bob@example.com", "ann@example.com", "bo_b@example.com", "carl@example.com", "bobby@example.com"]
+    assert rest["next_cursor"] is None
+
+    # LIKE wildcards in the prefix match literally
+    matched = services.find_users_page(10, email_prefix="bo_", include_total=True)
+    assert [user.email for user in matched["users"]] == ["bo_b@example.com"]
+    assert matched["total_estimate"] == 1
+    assert services.find_users_page(10, email_prefix="bob")["total_estimate"] is None
+    assert len(services.find_users_page(10, email_prefix="bob")["users"]) == 2
+
+    with pytest.raises(ValueError):
+        services.find_users_page(10, "not-a-cursor")
+
+def test_search_messages(sqlite_db):
+    alice, bob, carol = make_users("alice", "bob", "carol")
+    budget = services.create_message(alice, [bob], "Quarterly budget", "The budget for next quarter, budget review")
+    lunch = services.create_message(bob, [alice], "Lunch", "Budget lunch?")
+    services.create_message(carol, [bob], "Budget", "Not in alice's mailbox")
+    services.create_message(alice, [bob], "Other", "Nothing to see")
+
+    page = services.find_messages_search_page(alice.email, "budget", 1)
+    assert [entry["id"] for entry in page["messages"]] == [budget["id"]]
+    rest = services.find_messages_search_page(alice.email, "budget", 1, page["next_cursor"])
+    assert [entry["id"] for entry in rest["messages"]] == [lunch["id"]]
+    assert rest["next_cursor"] is None
+
+    # Every word must match, and FTS5 syntax in the input is taken literally
+    assert [entry["subject"] for entry in services.find_messages_search_page(alice.email, 'lunch "budget', 10)["messages"]] == ["Lunch"]
+    assert services.find_messages_search_page(alice.email, "budget OR nothing", 10)["messages"] == []
+    assert services.find_messages_search_page("nobody@example.com", "budget", 10)["messages"] == []
+    with pytest.raises(ValueError):
+        services.find_messages_search_page(alice.email, "budget", 10, "not-a-cursor")
+
+def test_threads(sqlite_db):
+    alice, bob, carol = make_users("alice", "bob", "carol")
+    first = services.create_message(alice, [bob], "Plan", "Shall we?")
+    assert first["thread_id"] == first["id"]
+    reply_to = services.find_reply_thread(first["id"], bob.id)
+    reply = services.create_message(bob, [alice], "Re: Plan", "Yes", reply_to=reply_to)
+    again = services.create_message(alice, [bob, carol], "Re: Plan", "Adding Carol",
+                                    reply_to=services.find_reply_thread(reply["id"], alice.id))
+    assert reply["thread_id"] == again["thread_id"] == first["id"]
+    assert again["in_reply_to"] == reply["id"]
+    other = services.create_message(carol, [bob], "Other", "Unrelated")
+    # Carol never saw the first two messages and cannot reply to them
+    assert services.find_reply_thread(first["id"], carol.id) is None
+
+    with count_queries(sqlite_db) as statements:
+        thread = services.find_thread(alice.email, first["id"])
+    assert len(statements) == 1
+    assert [entry["id"] for entry in thread] == [first["id"], reply["id"], again["id"]]
+    assert [entry["read"] for entry in thread] == [None, False, None]
+    assert [entry["id"] for entry in services.find_thread(carol.email, first["id"])] == [again["id"]]
+
+    services.find_message_recipient_detail(first["id"], bob.id)
+    page = services.find_thread_summaries_page(bob.email, 1)
+    assert [(t["thread_id"], t["messages"], t["unread"]) for t in page["threads"]] == [(other["thread_id"], 1, 1)]
+    rest = services.find_thread_summaries_page(bob.email, 1, page["next_cursor"])
+    summary = rest["threads"][0]
+    assert (summary["thread_id"], summary["last_message_id"], summary["messages"], summary["unread"]) == (
+        first["id"], again["id"], 2, 1
+    )
+    assert rest["next_cursor"] is None
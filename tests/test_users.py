@@ -1,9 +1,11 @@
 # Test user-related functionality
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 
 # app = FastAPI()
 client = TestClient(app)
+pytestmark = pytest.mark.usefixtures("app_lifespan")
 
 ### Test Cases
 def test_create_user():
@@ -41,6 +43,26 @@ def test_get_users():
     assert isinstance(data, list)
     assert len(data) > 0  # Assuming at least one user exists
 
+def test_get_users_paginated():
+    response = client.get("/api/users", params={"limit": 2, "include_total": True})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    # Absent until PostgreSQL has statistics for the table
+    assert response.headers.get("X-Total-Estimate", "0").isdigit()
+    rest = client.get("/api/users", params={"limit": 500, "cursor": response.headers["X-Next-Cursor"]})
+    assert rest.status_code == 200
+    emails = [user["email"] for user in response.json() + rest.json()]
+    assert len(emails) == len(set(emails)) >= 4
+
+def test_get_users_email_prefix():
+    response = client.get("/api/users", params={"email_prefix": "user1@"})
+    assert response.status_code == 200
+    assert [user["email"] for user in response.json()] == ["user1@gmail.com"]
+
+def test_get_users_invalid_cursor():
+    response = client.get("/api/users", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
 def test_get_user_by_email():
     response = client.post("/api/users/byEmail", json={"email": "user1@gmail.com"})
     assert response.status_code == 200  
@@ -81,3 +103,22 @@ def test_create_user_empty_name():
     response = client.post("/api/users", json={"email": "user1@gmail.com", "name": ""})
     assert response.status_code == 400 # Bad Request for empty name
     assert response.json() == {"detail": "Email and name are required"}
+def test_import_users_csv():
+    body = "email,name\nimport1@gmail.com,Import One\nuser1@gmail.com,User One\nnot-an-email,Bad\n"
+    response = client.post("/api/users/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["received"] == 3
+    assert data["created"] == 1
+    assert [(conflict["line"], conflict["reason"]) for conflict in data["conflicts"]][0] == (3, "already exists")
+    assert data["conflicts"][1]["line"] == 4
+def test_import_users_ndjson():
+    body = '{"email": "import2@gmail.com", "name": "Import Two"}\n{"email": "import1@gmail.com", "name": "Import One"}\n'
+    response = client.post("/api/users/import?format=ndjson", content=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 1
+    assert data["conflicts"] == [{"line": 2, "email": "import1@gmail.com", "reason": "already exists"}]
+def test_import_users_unsupported_format():
+    response = client.post("/api/users/import", content="x", headers={"Content-Type": "text/plain"})
+    assert response.status_code == 415